@@ -1,4 +1,5 @@
 import os
+import re
 from logging.config import fileConfig
 
 from alembic import context
@@ -29,6 +30,14 @@ target_metadata = SQLModel.metadata
 # ... etc.
 
 
+# partitions of message and message_read, managed by app.services.partitions
+_PARTITION = re.compile(r'^message(_read)?_(p\d{4}_\d{2}|default)$')
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    return not (type_ == 'table' and reflected and _PARTITION.match(name))
+
+
 def get_url():
     return str(settings.SQLALCHEMY_DATABASE_URI)
 
@@ -47,7 +56,8 @@ def run_migrations_offline():
     """
     url = get_url()
     context.configure(
-        url=url, target_metadata=target_metadata, literal_binds=True, compare_type=True
+        url=url, target_metadata=target_metadata, literal_binds=True, compare_type=True,
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -71,7 +81,8 @@ def run_migrations_online():
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata, compare_type=True
+            connection=connection, target_metadata=target_metadata, compare_type=True,
+            include_object=include_object,
         )
 
         with context.begin_transaction():
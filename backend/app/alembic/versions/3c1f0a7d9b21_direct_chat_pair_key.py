@@ -0,0 +1,53 @@
+"""Direct chat pair key
+
+Revision ID: 3c1f0a7d9b21
+Revises: 8a550bc39a75
+Create Date: 2025-05-06 12:10:31.418206
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f0a7d9b21'
+down_revision = '8a550bc39a75'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('chats', sa.Column(
+        'direct_user_lo', sa.Integer(), nullable=True))
+    op.add_column('chats', sa.Column(
+        'direct_user_hi', sa.Integer(), nullable=True))
+    # Backfill from participants. Should duplicates already exist for a
+    # pair, only the oldest chat gets the key.
+    op.execute("""
+        UPDATE chats
+        SET direct_user_lo = pair.lo, direct_user_hi = pair.hi
+        FROM (
+            SELECT DISTINCT ON (lo, hi) chat_id, lo, hi
+            FROM (
+                SELECT p.chat_id, min(p.user_id) AS lo, max(p.user_id) AS hi
+                FROM user_chat_participants p
+                JOIN chats c ON c.id = p.chat_id
+                WHERE c.is_group = false
+                GROUP BY p.chat_id
+                HAVING count(*) = 2
+            ) AS pairs
+            ORDER BY lo, hi, chat_id
+        ) AS pair
+        WHERE chats.id = pair.chat_id
+    """)
+    op.create_index('uq_chats_direct_pair', 'chats', [
+                    'direct_user_lo', 'direct_user_hi'], unique=True,
+                    postgresql_where=sa.text('is_group = false'))
+
+
+def downgrade():
+    op.drop_index('uq_chats_direct_pair', table_name='chats',
+                  postgresql_where=sa.text('is_group = false'))
+    op.drop_column('chats', 'direct_user_hi')
+    op.drop_column('chats', 'direct_user_lo')
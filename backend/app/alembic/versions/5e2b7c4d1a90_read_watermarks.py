@@ -0,0 +1,40 @@
+"""Read watermarks
+
+Revision ID: 5e2b7c4d1a90
+Revises: 3c1f0a7d9b21
+Create Date: 2025-05-09 18:42:07.905113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2b7c4d1a90'
+down_revision = '3c1f0a7d9b21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('user_chat_participants', sa.Column(
+        'last_read_message_id', sa.Integer(), nullable=True))
+    # The newest message a participant has read becomes the watermark.
+    # message_read is left in place for READ_TRACKING_MODE=rows, which
+    # keeps advancing the watermark from here on.
+    op.execute("""
+        UPDATE user_chat_participants p
+        SET last_read_message_id = r.last_read
+        FROM (
+            SELECT m.chat_id, mr.user_id, max(mr.message_id) AS last_read
+            FROM message_read mr
+            JOIN message m ON m.id = mr.message_id
+            GROUP BY m.chat_id, mr.user_id
+        ) AS r
+        WHERE p.chat_id = r.chat_id AND p.user_id = r.user_id
+    """)
+
+
+def downgrade():
+    op.drop_column('user_chat_participants', 'last_read_message_id')
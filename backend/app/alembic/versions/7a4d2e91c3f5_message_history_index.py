@@ -0,0 +1,38 @@
+"""Message history index
+
+Revision ID: 7a4d2e91c3f5
+Revises: 5e2b7c4d1a90
+Create Date: 2025-05-12 11:03:26.418270
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = '7a4d2e91c3f5'
+down_revision = '5e2b7c4d1a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keyset pages of /msg/history: WHERE chat_id = ? AND (created_at, id) < (?, ?)
+    # ORDER BY created_at DESC, id DESC is a single backward index range scan.
+    # Built without blocking message writes, CONCURRENTLY can't run in a
+    # transaction.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_message_chat_created_id',
+            'message',
+            ['chat_id', 'created_at', 'id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_message_chat_created_id', table_name='message', postgresql_concurrently=True)
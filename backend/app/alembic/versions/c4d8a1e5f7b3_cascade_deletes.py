@@ -0,0 +1,55 @@
+"""Cascade deletes
+
+Revision ID: c4d8a1e5f7b3
+Revises: 9b6e3f0c2d48
+Create Date: 2025-05-19 10:42:08.517339
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d8a1e5f7b3'
+down_revision = '9b6e3f0c2d48'
+branch_labels = None
+depends_on = None
+
+# (table, column, referred table) of the foreign keys that now cascade,
+# created unnamed by 8a550bc39a75 so they carry the Postgres default names
+_CASCADES = [
+    ('message', 'sender_id', 'users'),
+    ('message_read', 'message_id', 'message'),
+    ('message_read', 'user_id', 'users'),
+    ('user_chat_participants', 'chat_id', 'chats'),
+    ('user_chat_participants', 'user_id', 'users'),
+]
+
+
+def _recreate_foreign_keys(ondelete):
+    for table, column, referred in _CASCADES:
+        name = f'{table}_{column}_fkey'
+        op.drop_constraint(name, table, type_='foreignkey')
+        op.create_foreign_key(name, table, referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    # Set when the delete is requested, the rows go away in the background
+    # (app.services.deletion)
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('chats', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    # A cascade from users scans the referencing tables by user, and the
+    # deletion job walks a user's messages and reads in primary key order.
+    op.create_index('ix_message_sender_id', 'message', ['sender_id', 'id'], unique=False)
+    op.create_index(
+        'ix_message_read_user_id', 'message_read', ['user_id', 'message_id'], unique=False)
+    _recreate_foreign_keys('CASCADE')
+
+
+def downgrade():
+    _recreate_foreign_keys(None)
+    op.drop_index('ix_message_read_user_id', table_name='message_read')
+    op.drop_index('ix_message_sender_id', table_name='message')
+    op.drop_column('chats', 'deleted_at')
+    op.drop_column('users', 'deleted_at')
@@ -0,0 +1,212 @@
+"""Partition messages
+
+Revision ID: e1f5b8c2a6d9
+Revises: c4d8a1e5f7b3
+Create Date: 2025-05-22 16:08:31.274950
+
+"""
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel.sql.sqltypes
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1f5b8c2a6d9'
+down_revision = 'c4d8a1e5f7b3'
+branch_labels = None
+depends_on = None
+
+# Months created past the current one, app.services.partitions keeps it up
+_AHEAD = 3
+
+_MESSAGE_COLUMNS = 'id, created_at, updated_at, message_uuid, chat_id, sender_id, content'
+_READ_COLUMNS = 'message_id, user_id, created_at, updated_at'
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _message_columns():
+    return [
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('message_id_seq')"),
+                  nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('message_uuid', sa.Uuid(), nullable=False),
+        sa.Column('chat_id', sa.Integer(), nullable=False),
+        sa.Column('sender_id', sa.Integer(), nullable=False),
+        sa.Column('content', sqlmodel.sql.sqltypes.AutoString(length=2048), nullable=False),
+    ]
+
+
+def _swap_tables(message_table: sa.Table, read_table: sa.Table, copy_reads: str,
+                 partitions: list[str] = ()):
+    """
+    Replaces message and message_read by the given (not yet created) tables
+    and their partitions, keeping the rows and the id sequence.
+    """
+    op.drop_constraint('message_read_message_id_fkey', 'message_read', type_='foreignkey')
+    # primary key names are index names, unique per schema
+    op.execute('ALTER TABLE message RENAME CONSTRAINT message_pkey TO message_old_pkey')
+    op.execute('ALTER TABLE message_read RENAME CONSTRAINT message_read_pkey TO message_read_old_pkey')
+    op.execute('ALTER SEQUENCE message_id_seq OWNED BY NONE')
+    message_table.create(op.get_bind())
+    read_table.create(op.get_bind())
+    for statement in partitions:
+        op.execute(statement)
+    op.execute(f'INSERT INTO {message_table.name} ({_MESSAGE_COLUMNS}) '
+               f'SELECT {_MESSAGE_COLUMNS} FROM message')
+    op.execute(copy_reads)
+    op.drop_table('message_read')
+    op.drop_table('message')
+    op.rename_table(message_table.name, 'message')
+    op.rename_table(read_table.name, 'message_read')
+    op.execute('ALTER SEQUENCE message_id_seq OWNED BY message.id')
+    op.create_index(
+        'ix_message_chat_created_id', 'message', ['chat_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_message_sender_id', 'message', ['sender_id', 'id'], unique=False)
+    op.create_index(
+        'ix_message_read_user_id', 'message_read', ['user_id', 'message_id'], unique=False)
+
+
+def _monthly_partitions() -> list[str]:
+    """
+    Monthly partitions from the oldest message on; the default ones catch
+    rows outside of them and should stay empty.
+    """
+    first = op.get_bind().execute(sa.text('SELECT min(created_at) FROM message')).scalar()
+    month = (first or datetime.now()).date().replace(day=1)
+    last = _add_months(datetime.now().date().replace(day=1), _AHEAD)
+    statements = []
+    while month <= last:
+        bounds = f"FROM ('{month}') TO ('{_add_months(month, 1)}')"
+        statements += [
+            f'CREATE TABLE message_p{month:%Y_%m} '
+            f'PARTITION OF message_partitioned FOR VALUES {bounds}',
+            f'CREATE TABLE message_read_p{month:%Y_%m} '
+            f'PARTITION OF message_read_partitioned FOR VALUES {bounds}',
+        ]
+        month = _add_months(month, 1)
+    return statements + [
+        'CREATE TABLE message_default PARTITION OF message_partitioned DEFAULT',
+        'CREATE TABLE message_read_default PARTITION OF message_read_partitioned DEFAULT',
+    ]
+
+
+def upgrade():
+    # Both tables are rebuilt with a copy of every row, plan downtime for it
+    # on a large database.
+    metadata = sa.MetaData()
+    message = sa.Table(
+        'message_partitioned', metadata,
+        *_message_columns(),
+        sa.PrimaryKeyConstraint('id', 'created_at', name='message_pkey'),
+        sa.ForeignKeyConstraint(['chat_id'], ['chats.id'], ondelete='CASCADE',
+                                name='message_chat_id_fkey'),
+        sa.ForeignKeyConstraint(['sender_id'], ['users.id'], ondelete='CASCADE',
+                                name='message_sender_id_fkey'),
+        postgresql_partition_by='RANGE (created_at)',
+    )
+    message_read = sa.Table(
+        'message_read_partitioned', metadata,
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('message_created_at', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('message_id', 'user_id', 'message_created_at',
+                                name='message_read_pkey'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE',
+                                name='message_read_user_id_fkey'),
+        postgresql_partition_by='RANGE (message_created_at)',
+    )
+    read_columns = ', '.join(f'r.{column}' for column in _READ_COLUMNS.split(', '))
+    _swap_tables(message, message_read, f"""
+        INSERT INTO message_read_partitioned ({_READ_COLUMNS}, message_created_at)
+        SELECT {read_columns}, m.created_at
+        FROM message_read r JOIN message m ON m.id = r.message_id
+    """, _monthly_partitions())
+    op.create_index('ix_message_message_uuid', 'message', ['message_uuid'], unique=False)
+    op.create_foreign_key(
+        'message_read_message_id_fkey', 'message_read', 'message',
+        ['message_id', 'message_created_at'], ['id', 'created_at'], ondelete='CASCADE')
+
+    # message_uuid can't be unique on the partitioned table
+    op.create_table(
+        'message_dedupe',
+        sa.Column('message_uuid', sa.Uuid(), nullable=False),
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('message_uuid'),
+    )
+    op.create_index('ix_message_dedupe_created_at', 'message_dedupe', ['created_at'], unique=False)
+    op.execute('INSERT INTO message_dedupe (message_uuid, message_id, created_at) '
+               'SELECT message_uuid, id, created_at FROM message')
+
+    op.create_table(
+        'message_archive',
+        sa.Column('partition_name', sqlmodel.sql.sqltypes.AutoString(length=63), nullable=False),
+        sa.Column('chat_id', sa.Integer(), nullable=False),
+        sa.Column('message_count', sa.Integer(), nullable=False),
+        sa.Column('range_start', sa.DateTime(), nullable=False),
+        sa.Column('range_end', sa.DateTime(), nullable=False),
+        sa.Column('messages_offset', sa.BigInteger(), nullable=False),
+        sa.Column('messages_length', sa.Integer(), nullable=False),
+        sa.Column('reads_offset', sa.BigInteger(), nullable=False),
+        sa.Column('reads_length', sa.Integer(), nullable=False),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('partition_name', 'chat_id'),
+    )
+    op.create_index(
+        'ix_message_archive_chat_id', 'message_archive', ['chat_id', 'range_start'], unique=False)
+    op.create_table(
+        'message_archive_sender',
+        sa.Column('partition_name', sqlmodel.sql.sqltypes.AutoString(length=63), nullable=False),
+        sa.Column('chat_id', sa.Integer(), nullable=False),
+        sa.Column('sender_id', sa.Integer(), nullable=False),
+        sa.Column('message_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('partition_name', 'chat_id', 'sender_id'),
+    )
+
+
+def downgrade():
+    # Archived partitions are not restored, their files stay where they are.
+    op.drop_table('message_archive_sender')
+    op.drop_index('ix_message_archive_chat_id', table_name='message_archive')
+    op.drop_table('message_archive')
+    op.drop_index('ix_message_dedupe_created_at', table_name='message_dedupe')
+    op.drop_table('message_dedupe')
+
+    metadata = sa.MetaData()
+    message = sa.Table(
+        'message_plain', metadata,
+        *_message_columns(),
+        sa.PrimaryKeyConstraint('id', name='message_pkey'),
+        sa.ForeignKeyConstraint(['chat_id'], ['chats.id'], ondelete='CASCADE',
+                                name='message_chat_id_fkey'),
+        sa.ForeignKeyConstraint(['sender_id'], ['users.id'], ondelete='CASCADE',
+                                name='message_sender_id_fkey'),
+    )
+    message_read = sa.Table(
+        'message_read_plain', metadata,
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('message_id', 'user_id', name='message_read_pkey'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE',
+                                name='message_read_user_id_fkey'),
+    )
+    op.drop_index('ix_message_message_uuid', table_name='message')
+    _swap_tables(message, message_read, f"""
+        INSERT INTO message_read_plain ({_READ_COLUMNS})
+        SELECT {_READ_COLUMNS} FROM message_read
+    """)
+    op.create_unique_constraint('uq_message_message_uuid', 'message', ['message_uuid'])
+    op.create_foreign_key(
+        'message_read_message_id_fkey', 'message_read', 'message',
+        ['message_id'], ['id'], ondelete='CASCADE')
@@ -1,19 +1,20 @@
-from collections.abc import Generator
 from typing import Annotated, AsyncGenerator
 from sqlalchemy.ext.asyncio import AsyncSession
 
-import jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException
+from fastapi.requests import HTTPConnection
 from fastapi.security import OAuth2PasswordBearer
-from jwt.exceptions import InvalidTokenError
-from pydantic import ValidationError
-from sqlmodel import Session
 
-from app.core import security
 from app.core.config import settings
-from app.core.db import AsyncSessionLocal, engine
+from app.core.db import AsyncAutocommitSessionLocal, AsyncSessionLocal
 from app.models import Users
-from app.dto import TokenPayload
+from app.services.auth import AuthCache
+from app.services.deletion import DeletionJobs
+from app.services.email_outbox import EmailOutbox
+from app.services.hot_page import HotPageCache
+from app.services.membership import ChatMembershipCache
+from app.services.presence import PresenceService
+from app.services.typing import TypingRelay
 
 reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/login/access-token"
@@ -25,33 +26,82 @@ async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
         yield session
 
 
-def get_db() -> Generator[Session, None, None]:
-    with Session(engine) as session:
+async def get_async_autocommit_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncAutocommitSessionLocal() as session:
         yield session
 
 
 SessionAsyncDep = Annotated[AsyncSession, Depends(get_async_db)]
-SessionDep = Annotated[Session, Depends(get_db)]
+SessionAsyncAutocommitDep = Annotated[AsyncSession, Depends(get_async_autocommit_db)]
 TokenDep = Annotated[str, Depends(reusable_oauth2)]
 
 
-def get_current_user(session: SessionDep, token: TokenDep) -> Users:
-    try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
-        )
-        token_data = TokenPayload(**payload)
-    except (InvalidTokenError, ValidationError):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Could not validate credentials",
-        )
-    user = session.get(Users, token_data.sub)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    if not user.is_active:
-        raise HTTPException(status_code=400, detail="Inactive user")
-    return user
+def get_membership_cache(connection: HTTPConnection) -> ChatMembershipCache:
+    return connection.app.state.membership_cache
+
+
+MembershipCacheDep = Annotated[ChatMembershipCache, Depends(get_membership_cache)]
+
+
+def get_hot_pages(connection: HTTPConnection) -> HotPageCache:
+    return connection.app.state.hot_pages
+
+
+HotPageCacheDep = Annotated[HotPageCache, Depends(get_hot_pages)]
+
+
+def get_presence(connection: HTTPConnection) -> PresenceService:
+    return connection.app.state.presence
+
+
+PresenceDep = Annotated[PresenceService, Depends(get_presence)]
+
+
+def get_typing(connection: HTTPConnection) -> TypingRelay:
+    return connection.app.state.typing
+
+
+TypingRelayDep = Annotated[TypingRelay, Depends(get_typing)]
+
+
+def get_auth_cache(connection: HTTPConnection) -> AuthCache:
+    return connection.app.state.auth_cache
+
+
+AuthCacheDep = Annotated[AuthCache, Depends(get_auth_cache)]
+
+
+def get_email_outbox(connection: HTTPConnection) -> EmailOutbox:
+    return connection.app.state.email_outbox
+
+
+EmailOutboxDep = Annotated[EmailOutbox, Depends(get_email_outbox)]
+
+
+def get_deletion_jobs(connection: HTTPConnection) -> DeletionJobs:
+    return connection.app.state.deletion_jobs
+
+
+DeletionJobsDep = Annotated[DeletionJobs, Depends(get_deletion_jobs)]
+
+
+def client_host(connection: HTTPConnection) -> str | None:
+    """
+    Client address for per-client limits: the socket peer, or when that is
+    one of TRUSTED_PROXIES, the nearest X-Forwarded-For hop that is not.
+    """
+    host = connection.client.host if connection.client else None
+    if host not in settings.TRUSTED_PROXIES:
+        return host
+    forwarded = connection.headers.get('x-forwarded-for', '')
+    for hop in reversed([hop.strip() for hop in forwarded.split(',') if hop.strip()]):
+        if hop not in settings.TRUSTED_PROXIES:
+            return hop
+    return host
+
+
+async def get_current_user(auth: AuthCacheDep, token: TokenDep) -> Users:
+    return await auth.authenticate(token)
 
 
 CurrentUser = Annotated[Users, Depends(get_current_user)]
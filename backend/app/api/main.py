@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from app.api.routes import login, private, users, utils, groups, ws_chats, msg
+from app.api.routes import login, private, users, utils, groups, ws_chats, msg, presence, deletions
 from app.core.config import settings
 
 api_router = APIRouter()
@@ -10,6 +10,8 @@ api_router.include_router(utils.router)
 api_router.include_router(groups.router)
 api_router.include_router(ws_chats.router)
 api_router.include_router(msg.router)
+api_router.include_router(presence.router)
+api_router.include_router(deletions.router)
 
 # api_router.include_router(items.router)
 
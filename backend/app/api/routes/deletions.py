@@ -0,0 +1,23 @@
+from fastapi import APIRouter, HTTPException
+
+from app.api.deps import CurrentUser, DeletionJobsDep
+from app.dto import DeletionJobPublic
+
+router = APIRouter(prefix="/deletions", tags=["deletions"])
+
+
+@router.get("/{job_id}", response_model=DeletionJobPublic)
+async def deletion_progress(
+    job_id: str,
+    current_user: CurrentUser,
+    deletions: DeletionJobsDep,
+):
+    """
+    Progress of a user or chat deletion, visible to whoever requested it
+    and to superusers.
+    """
+    job = await deletions.progress(job_id)
+    if job is None or (
+            not current_user.is_superuser and int(job['requested_by']) != current_user.id):
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    return job
@@ -1,13 +1,18 @@
-from typing import Any
-from app.crud.groups import add_participant_to_group, count_users_by_ids, create_group, find_lc_group, get_users_groups
-from app.dto.chatmsg import MyChatsPublic
+from typing import Any, List
+from app.crud.groups import add_participant_to_group, count_users_by_ids, create_group, find_lc_group, get_user_inbox, get_users_groups
+from app.dto.chatmsg import ChatInboxItem, MyChatsPublic
+from app.dto.users import UserShort
 from fastapi import APIRouter, HTTPException
 
 from app.api.deps import (
     CurrentUser,
+    DeletionJobsDep,
+    HotPageCacheDep,
+    MembershipCacheDep,
     SessionAsyncDep,
 )
-from app.dto import GroupCreate
+from app.crud.deletion import mark_chat_deleted
+from app.dto import DeletionAccepted, GroupCreate
 from app.models import Chats
 
 router = APIRouter(prefix="/groups", tags=["groups"])
@@ -21,6 +26,7 @@ async def group_create(
     group_data: GroupCreate,
     current_user: CurrentUser,
     async_session: SessionAsyncDep,
+    membership: MembershipCacheDep,
 ) -> Any:
     if current_user.id in group_data.user_ids:
         # Обычно такие места подвергаются доп. логированию
@@ -51,7 +57,9 @@ async def group_create(
         async_session=async_session,
         chat_name=group_data.name,
         is_group=True if cnt_users >= 2 else False,
-        owner_id=current_user.id
+        owner_id=current_user.id,
+        direct_user_ids=(
+            (current_user.id, group_data.user_ids[0]) if cnt_users == 1 else None),
     )
     group_data.user_ids.append(current_user.id)
     await add_participant_to_group(
@@ -59,6 +67,11 @@ async def group_create(
         user_ids=group_data.user_ids,
         group_id=new_group.id
     )
+    await membership.set_members(new_group.id, group_data.user_ids)
+    if new_group.is_group:
+        # open sockets of the members start receiving the group right away
+        await membership.announce_channel(
+            group_data.user_ids, str(new_group.chat_id), joined=True)
 
 
 @router.delete("/delete")
@@ -66,7 +79,10 @@ async def delete_group(
     chat_id: int,
     current_user: CurrentUser,
     async_session: SessionAsyncDep,
-) -> Any:
+    membership: MembershipCacheDep,
+    hot_pages: HotPageCacheDep,
+    deletions: DeletionJobsDep,
+) -> DeletionAccepted:
     chat = await async_session.get(Chats, chat_id)
 
     if not chat:
@@ -74,9 +90,25 @@ async def delete_group(
     if chat.owner_id != current_user.id:
         raise HTTPException(
             status_code=403, detail="Not authorized to delete this group.")
+    if chat.deleted_at:
+        # already marked: resumes a deletion whose job failed for good
+        job_id = await deletions.active_job('chat', chat_id)
+        if job_id is None:
+            job_id = await deletions.enqueue('chat', chat_id, current_user.id)
+        return DeletionAccepted(message="Chat deletion in progress", job_id=job_id)
 
-    await async_session.delete(chat)
+    chat_uuid = chat.chat_id
+    direct_user_ids = (
+        None if chat.is_group else (chat.direct_user_lo, chat.direct_user_hi))
+    # marked now, the messages go in the background (app.services.deletion)
+    member_ids = await mark_chat_deleted(async_session=async_session, chat=chat)
     await async_session.commit()
+    await membership.drop_chat(chat_id, chat_uuid, direct_user_ids)
+    if chat.is_group:
+        await membership.announce_channel(member_ids, str(chat_uuid), joined=False)
+    await hot_pages.invalidate(chat_id)
+    job_id = await deletions.enqueue('chat', chat_id, current_user.id)
+    return DeletionAccepted(message="Chat deleted successfully", job_id=job_id)
 
 
 @router.get("/my", response_model=MyChatsPublic)
@@ -88,3 +120,31 @@ async def my_chats(
         group_chats=(await get_users_groups(async_session=async_session, user_id=current_user.id, is_group=True)),
         lc_chats=(await get_users_groups(async_session=async_session, user_id=current_user.id, is_group=False)),
     )
+
+
+@router.get("/inbox", response_model=List[ChatInboxItem])
+async def inbox(
+    current_user: CurrentUser,
+    async_session: SessionAsyncDep,
+):
+    """
+    All chats of the current user with the last message preview and unread
+    count, most recently active first.
+    """
+    rows = await get_user_inbox(async_session=async_session, user_id=current_user.id)
+    return [
+        ChatInboxItem(
+            id=chat.id,
+            chat_id=chat.chat_id,
+            name=chat.name,
+            is_group=chat.is_group,
+            peer=UserShort.model_validate(peer) if peer else None,
+            member_count=chat.member_count,
+            unread_count=unread_count,
+            last_message_id=chat.last_message_id,
+            last_message_sender_id=chat.last_message_sender_id,
+            last_message_preview=chat.last_message_preview,
+            last_activity_at=last_activity_at,
+        )
+        for chat, unread_count, last_activity_at, peer in rows
+    ]
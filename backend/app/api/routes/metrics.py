@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+
+from app.core.metrics import REGISTRY
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics(request: Request) -> PlainTextResponse:
+    """
+    Metrics in the Prometheus text format, of every worker when METRICS_DIR
+    is set (app.core.metrics.MetricsFiles), of this one otherwise.
+    """
+    files = request.app.state.metrics_files
+    text = await files.render() if files else REGISTRY.render()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
@@ -1,25 +1,31 @@
 import json
+import logging
+from collections import defaultdict
 from typing import List
-from app.crud.groups import get_chat_from_id, get_user_participant_chat
-from app.crud.messages import get_msg_by_id, get_msg_for_chat, get_unread_msg, set_read_msg_by_user
-from app.dto.chatmsg import MessagePublic, NotifyMsg
+from app.crud.partitions import ArchiveUnavailableError
+from app.crud.messages import get_msg_by_id, get_msg_for_chat, get_msg_page, get_unread_msg, is_msg_read_by, set_read_msg_by_user, set_read_msgs_by_user
+from app.dto.chatmsg import MessagePublic, MessagesPage, NotifyMsg
 from app.dto.users import UserShort
 from app.models.users import Users
+from app.utils import decode_history_cursor, encode_history_cursor
+from datetime import datetime
 from fastapi import APIRouter, HTTPException, Request
 
 from app.api.deps import (
     CurrentUser,
-    SessionDep,
+    HotPageCacheDep,
+    MembershipCacheDep,
     SessionAsyncDep,
 )
 from app.models import Message
-from sqlalchemy.exc import IntegrityError
-from redis.asyncio import Redis
+from app.core.streams import MessageTransport
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/msg", tags=["msg"])
 
 
-async def _send_msg_read_notify(msg: Message, who_read: Users, redis_client: Redis) -> int:
+async def _send_msg_read_notify(msg: Message, who_read: Users, transport: MessageTransport):
     msg_content = msg.content
     if len(msg_content) > 50:
         msg_content = msg_content[:50] + '...'
@@ -32,29 +38,66 @@ async def _send_msg_read_notify(msg: Message, who_read: Users, redis_client: Red
         },
         content=f'Ваше сообщение: "{msg_content}" прочитанно пользователем: "{who_read.get_name}"\n',
     )
-    return await redis_client.publish(
+    return await transport.publish(
         f'lc_chat_{msg.sender_id}',
         json.dumps(payload.model_dump_json()),
+        recipients=(msg.sender_id,),
     )
 
 
+async def _send_msgs_read_notify(messages: list[Message], who_read: Users, transport: MessageTransport) -> None:
+    """
+    One MSG_READ event per sender for a batch of messages. meta_data.msg_ids
+    lists every message read, meta_data.msg_id keeps the newest one for
+    clients that only know the single-message event.
+    """
+    by_sender: dict[int, list[Message]] = defaultdict(list)
+    for msg in messages:
+        by_sender[msg.sender_id].append(msg)
+    if not by_sender:
+        return
+
+    who_read_json = UserShort.model_validate(who_read).model_dump_json()
+    async with transport.redis.pipeline(transaction=False) as pipe:
+        for sender_id, sender_msgs in by_sender.items():
+            msg_ids = sorted(msg.id for msg in sender_msgs)
+            payload = NotifyMsg(
+                type='MSG_READ',
+                meta_data={
+                    'msg_id': msg_ids[-1],
+                    'msg_ids': msg_ids,
+                    'chat_id': sender_msgs[0].chat_id,
+                    'who_read': who_read_json,
+                },
+                content=f'Ваши сообщения ({len(msg_ids)}) прочитаны пользователем: "{who_read.get_name}"\n',
+            )
+            await transport.publish(
+                f'lc_chat_{sender_id}',
+                json.dumps(payload.model_dump_json()),
+                recipients=(sender_id,),
+                client=pipe,
+            )
+        await pipe.execute()
+
+
 @router.get("/mark_msg_read/{msg_id}")
 async def mark_msg_read(
     msg_id: int,
     request: Request,
     async_session: SessionAsyncDep,
     current_user: CurrentUser,
+    membership: MembershipCacheDep,
+    hot_pages: HotPageCacheDep,
 ):
     msg = await get_msg_by_id(async_session=async_session, msg_id=msg_id)
     if not msg:
         raise HTTPException(detail='Message not found', status_code=404)
-    chat = await get_chat_from_id(async_session=async_session, chat_id=msg.chat_id)
-    if current_user not in chat.users:
+    if not await membership.is_member(msg.chat_id, current_user.id, async_session=async_session):
         raise HTTPException(detail='Object Permission Denied', status_code=403)
     if msg.sender_id == current_user.id:
         raise HTTPException(
             detail='Y cant read youself message!', status_code=400)
-    if current_user in msg.read_by_users:
+    if await is_msg_read_by(async_session=async_session, msg=msg, user_id=current_user.id):
         raise HTTPException(
             detail='Y already read this message!', status_code=400)
     await set_read_msg_by_user(
@@ -62,40 +105,107 @@ async def mark_msg_read(
         msg_id=msg_id,
         user_id=current_user.id,
     )
-    await _send_msg_read_notify(msg, current_user, request.app.state.redis_client)
+    await hot_pages.invalidate(msg.chat_id)
+    await _send_msg_read_notify(msg, current_user, request.app.state.transport)
+
+
+def _history_unavailable(chat_id: int, error: ArchiveUnavailableError) -> HTTPException:
+    logger.error(f"Archived history of chat {chat_id} unavailable: {error}")
+    return HTTPException(
+        detail='Message history is unavailable, try again later', status_code=503)
 
 
-@router.get("/history/{chat_id}", response_model=List[MessagePublic])
+@router.get("/history/{chat_id}", response_model=List[MessagePublic] | MessagesPage)
 async def chat_msg_history(
     chat_id: int,
     request: Request,
     async_session: SessionAsyncDep,
     current_user: CurrentUser,
+    membership: MembershipCacheDep,
+    hot_pages: HotPageCacheDep,
     limit: int = 100,
     offset: int = 0,
+    before: str | None = None,
+    after: str | None = None,
+    paged: bool = False,
 ):
-    user_participant = await get_user_participant_chat(
-        async_session=async_session,
-        chat_id=chat_id,
-        user_id=current_user.id,
-    )
-    if not user_participant:
+    """
+    Without before/after/paged: a list of messages, oldest first, paged by
+    limit/offset. With any of them: a MessagesPage paged by opaque cursors,
+    the first page holds the newest messages and next_cursor walks back in
+    time (or forward in time when paging with after).
+    The newest page (and the whole chat while it is short) is served from
+    the Redis hot page, see app.services.hot_page. Both ways go on into the
+    months archived by app.services.partitions.
+    """
+    if before and after:
+        raise HTTPException(
+            detail='Use either before or after, not both', status_code=400)
+    try:
+        before_key = decode_history_cursor(before) if before else None
+        after_key = decode_history_cursor(after) if after else None
+    except ValueError as e:
+        raise HTTPException(detail=str(e), status_code=400)
+
+    if not await membership.is_member(chat_id, current_user.id, async_session=async_session):
         raise HTTPException(
             detail='You are not a member of this chat', status_code=403)
 
     unread_messages = await get_unread_msg(async_session=async_session, user_id=current_user.id, chat_id=chat_id)
-    # кнш лучше отправить пачкой, но я не знаю как их обработать на фронте по христиански
-    for message in unread_messages:
-        await set_read_msg_by_user(
-            async_session=async_session,
-            msg_id=message.id,
-            user_id=current_user.id,
-        )
-        await _send_msg_read_notify(message, current_user, request.app.state.redis_client)
-
-    return await get_msg_for_chat(
+    marked_ids = set(await set_read_msgs_by_user(
         async_session=async_session,
+        user_id=current_user.id,
         chat_id=chat_id,
-        limit=limit,
-        offset=offset
+        msg_ids=[message.id for message in unread_messages],
+    ))
+    if marked_ids:
+        await hot_pages.invalidate(chat_id)
+    await _send_msgs_read_notify(
+        [message for message in unread_messages if message.id in marked_ids],
+        current_user,
+        request.app.state.transport,
+    )
+
+    # the hot page only knows the live partitions
+    months = await hot_pages.archived_months(chat_id, async_session=async_session)
+    if not (before or after or paged):
+        cached = None if months else await hot_pages.from_start(
+            chat_id, limit, offset, async_session=async_session)
+        if cached is not None:
+            return cached
+        try:
+            return await get_msg_for_chat(
+                async_session=async_session,
+                chat_id=chat_id,
+                limit=limit,
+                offset=offset,
+                months=months,
+            )
+        except ArchiveUnavailableError as e:
+            raise _history_unavailable(chat_id, e)
+
+    if not (before or after):
+        cached = await hot_pages.latest(chat_id, limit, async_session=async_session)
+        # a short page of a chat with archived months continues in them
+        if cached is not None and (len(cached) == limit or not months):
+            next_cursor = None
+            if cached and len(cached) == limit:
+                next_cursor = encode_history_cursor(
+                    datetime.fromisoformat(cached[0]['created_at']), cached[0]['id'])
+            return MessagesPage(data=cached, next_cursor=next_cursor)
+
+    try:
+        messages, next_key = await get_msg_page(
+            async_session=async_session,
+            chat_id=chat_id,
+            limit=limit,
+            before=before_key,
+            after=after_key,
+            months=months,
+        )
+    except ArchiveUnavailableError as e:
+        raise _history_unavailable(chat_id, e)
+    return MessagesPage(
+        data=messages,
+        next_cursor=encode_history_cursor(*next_key) if next_key else None,
     )
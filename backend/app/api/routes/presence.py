@@ -0,0 +1,25 @@
+from typing import List
+
+from fastapi import APIRouter, HTTPException, Query
+
+from app.api.deps import CurrentUser, PresenceDep
+from app.core.config import settings
+from app.dto.users import UserPresence
+
+router = APIRouter(prefix="/presence", tags=["presence"])
+
+
+@router.get("/", response_model=List[UserPresence])
+async def users_presence(
+    current_user: CurrentUser,
+    presence: PresenceDep,
+    user_ids: List[int] = Query(..., alias="user_id"),
+):
+    """
+    Online status and last-seen time of up to PRESENCE_QUERY_LIMIT users:
+    ?user_id=1&user_id=2...
+    """
+    if len(user_ids) > settings.PRESENCE_QUERY_LIMIT:
+        raise HTTPException(
+            detail=f'At most {settings.PRESENCE_QUERY_LIMIT} users per query', status_code=400)
+    return list((await presence.query(user_ids)).values())
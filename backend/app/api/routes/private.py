@@ -3,8 +3,8 @@ from typing import Any
 from fastapi import APIRouter
 from pydantic import BaseModel
 
-from app.api.deps import SessionDep
-from app.core.security import get_password_hash
+from app.api.deps import SessionAsyncDep
+from app.core.security import get_password_hash_async
 from app.models import Users
 from app.dto import UserPublic
 
@@ -20,15 +20,16 @@ class PrivateUserCreate(BaseModel):
 
 
 @router.post("/users/", response_model=UserPublic)
-def create_user(user_in: PrivateUserCreate, session: SessionDep) -> Any:
+async def create_user(user_in: PrivateUserCreate, async_session: SessionAsyncDep) -> Any:
     """
     Create a new user.
     """
     user = Users(
         email=user_in.email,
         full_name=user_in.full_name,
-        hashed_password=get_password_hash(user_in.password),
+        hashed_password=await get_password_hash_async(user_in.password),
     )
-    session.add(user)
-    session.commit()
+    async_session.add(user)
+    await async_session.commit()
+    await async_session.refresh(user)
     return user
@@ -1,20 +1,30 @@
-import uuid
 from typing import Any
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import col, delete, func, select
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse
+from sqlmodel import func, select
 
 from app.crud import users as crud
+from app.crud.deletion import mark_user_deleted
 from app.api.deps import (
+    AuthCacheDep,
     CurrentUser,
-    SessionDep,
+    DeletionJobsDep,
+    EmailOutboxDep,
+    HotPageCacheDep,
+    MembershipCacheDep,
+    SessionAsyncDep,
+    client_host,
     get_current_active_superuser,
     get_current_user,
 )
 from app.core.config import settings
-from app.core.security import get_password_hash, verify_password
+from app.core.hashing import retry_after
+from app.core.security import get_password_hash_async, verify_password_async
 from app.dto import (
+    DeletionAccepted,
     UserCreate,
+    UserImportReport,
     UserPublic,
     UserRegister,
     UsersPublic,
@@ -25,7 +35,8 @@ from app.dto import (
 from app.models import (
     Users,
 )
-from app.utils import generate_new_account_email, send_email
+from app.services.user_import import import_users as run_import, iter_lines, iter_records
+from app.utils import generate_new_account_email
 from app.dto import Message
 
 router = APIRouter(prefix="/users", tags=["users"])
@@ -36,16 +47,16 @@ router = APIRouter(prefix="/users", tags=["users"])
     dependencies=[Depends(get_current_user)],
     response_model=UsersPublic,
 )
-def read_users(session: SessionDep, skip: int = 0, limit: int = 100) -> Any:
+async def read_users(async_session: SessionAsyncDep, skip: int = 0, limit: int = 100) -> Any:
     """
     Retrieve users.
     """
 
-    count_statement = select(func.count()).select_from(Users)
-    count = session.exec(count_statement).one()
+    count_statement = select(func.count()).select_from(Users).where(Users.deleted_at.is_(None))
+    count = (await async_session.execute(count_statement)).scalar_one()
 
-    statement = select(Users).offset(skip).limit(limit)
-    users = session.exec(statement).all()
+    statement = select(Users).where(Users.deleted_at.is_(None)).offset(skip).limit(limit)
+    users = (await async_session.execute(statement)).scalars().all()
 
     return UsersPublic(data=users, count=count)
 
@@ -53,23 +64,25 @@ def read_users(session: SessionDep, skip: int = 0, limit: int = 100) -> Any:
 @router.post(
     "/", dependencies=[Depends(get_current_active_superuser)], response_model=UserPublic
 )
-def create_user(*, session: SessionDep, user_in: UserCreate) -> Any:
+async def create_user(
+    *, async_session: SessionAsyncDep, outbox: EmailOutboxDep, user_in: UserCreate
+) -> Any:
     """
     Create new user.
     """
-    user = crud.get_user_by_email(session=session, email=user_in.email)
+    user = await crud.get_user_by_email(async_session=async_session, email=user_in.email)
     if user:
         raise HTTPException(
             status_code=400,
             detail="The user with this email already exists in the system.",
         )
 
-    user = crud.create_user(session=session, user_create=user_in)
+    user = await crud.create_user(async_session=async_session, user_create=user_in)
     if settings.emails_enabled and user_in.email:
         email_data = generate_new_account_email(
             email_to=user_in.email, username=user_in.email, password=user_in.password
         )
-        send_email(
+        await outbox.enqueue(
             email_to=user_in.email,
             subject=email_data.subject,
             html_content=email_data.html_content,
@@ -77,59 +90,151 @@ def create_user(*, session: SessionDep, user_in: UserCreate) -> Any:
     return user
 
 
+# Content-Type -> iter_records format
+IMPORT_FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+
+@router.post(
+    "/import",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=UserImportReport,
+)
+async def import_users(
+    request: Request,
+    async_session: SessionAsyncDep,
+    membership: MembershipCacheDep,
+    chat_ids: list[int] = Query(default=[]),
+) -> Any:
+    """
+    Create users from a CSV (with a header row) or NDJSON body of UserCreate
+    records, streamed and committed in chunks; the imported users join the
+    group chats chat_ids. Rows that can't be created are reported, not fatal.
+    Without hashing capacity the import stops with 503 and a report whose
+    resume_line is where to send the rest from.
+    """
+    content_type = request.headers.get('content-type', '').split(';')[0].strip()
+    fmt = IMPORT_FORMATS.get(content_type)
+    if fmt is None:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Expected one of {', '.join(IMPORT_FORMATS)}",
+        )
+    report = await run_import(
+        async_session=async_session,
+        records=iter_records(iter_lines(request.stream()), fmt),
+        chat_ids=chat_ids,
+    )
+    if report.memberships:
+        await membership.forget_members(chat_ids)
+    if report.resume_line is not None:
+        return JSONResponse(
+            status_code=503,
+            content=report.model_dump(mode='json'),
+            headers={"Retry-After": retry_after()},
+        )
+    return report
+
+
 @router.patch("/me", response_model=UserPublic)
-def update_user_me(
-    *, session: SessionDep, user_in: UserUpdateMe, current_user: CurrentUser
+async def update_user_me(
+    *, async_session: SessionAsyncDep, auth: AuthCacheDep, user_in: UserUpdateMe, current_user: CurrentUser
 ) -> Any:
     """
     Update own user.
     """
 
     if user_in.email:
-        existing_user = crud.get_user_by_email(
-            session=session, email=user_in.email)
+        existing_user = await crud.get_user_by_email(
+            async_session=async_session, email=user_in.email)
         if existing_user and existing_user.id != current_user.id:
             raise HTTPException(
                 status_code=409, detail="User with this email already exists"
             )
+    # current_user may come from the auth cache, write through a fresh row
+    db_user = await async_session.get(Users, current_user.id)
     user_data = user_in.model_dump(exclude_unset=True)
-    current_user.sqlmodel_update(user_data)
-    session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
-    return current_user
+    db_user.sqlmodel_update(user_data)
+    async_session.add(db_user)
+    await async_session.commit()
+    await async_session.refresh(db_user)
+    auth.invalidate(db_user.id)
+    return db_user
 
 
 @router.patch("/me/password", response_model=Message)
-def update_password_me(
-    *, session: SessionDep, body: UpdatePassword, current_user: CurrentUser
+async def update_password_me(
+    *,
+    request: Request,
+    async_session: SessionAsyncDep,
+    auth: AuthCacheDep,
+    body: UpdatePassword,
+    current_user: CurrentUser,
 ) -> Any:
     """
     Update own password.
     """
-    if not verify_password(body.current_password, current_user.hashed_password):
+    db_user = await async_session.get(Users, current_user.id)
+    client = client_host(request)
+    if not await verify_password_async(
+            body.current_password, db_user.hashed_password, client=client):
         raise HTTPException(status_code=400, detail="Incorrect password")
     if body.current_password == body.new_password:
         raise HTTPException(
             status_code=400, detail="New password cannot be the same as the current one"
         )
-    hashed_password = get_password_hash(body.new_password)
-    current_user.hashed_password = hashed_password
-    session.add(current_user)
-    session.commit()
+    hashed_password = await get_password_hash_async(body.new_password, client=client)
+    db_user.hashed_password = hashed_password
+    async_session.add(db_user)
+    await async_session.commit()
+    auth.invalidate(db_user.id)
     return Message(message="Password updated successfully")
 
 
 @router.get("/me", response_model=UserPublic)
-def read_user_me(current_user: CurrentUser) -> Any:
+async def read_user_me(current_user: CurrentUser) -> Any:
     """
     Get current user.
     """
     return current_user
 
 
-@router.delete("/me", response_model=Message)
-def delete_user_me(session: SessionDep, current_user: CurrentUser) -> Any:
+async def _delete_user(
+    *,
+    async_session: SessionAsyncDep,
+    auth: AuthCacheDep,
+    membership: MembershipCacheDep,
+    hot_pages: HotPageCacheDep,
+    deletions: DeletionJobsDep,
+    user: Users,
+    requested_by: int,
+) -> DeletionAccepted:
+    # marked now, the rows go in the background (app.services.deletion)
+    owned_chats = await mark_user_deleted(async_session=async_session, user=user)
+    auth.invalidate(user.id)
+    for chat, member_ids in owned_chats:
+        # the members of a direct chat are its pair
+        direct_user_ids = tuple(member_ids) if not chat.is_group and len(member_ids) == 2 else None
+        await membership.drop_chat(chat.id, chat.chat_id, direct_user_ids)
+        if chat.is_group:
+            await membership.announce_channel(member_ids, str(chat.chat_id), joined=False)
+        await hot_pages.invalidate(chat.id)
+    job_id = await deletions.enqueue('user', user.id, requested_by)
+    return DeletionAccepted(message="User deleted successfully", job_id=job_id)
+
+
+@router.delete("/me", response_model=DeletionAccepted)
+async def delete_user_me(
+    async_session: SessionAsyncDep,
+    auth: AuthCacheDep,
+    membership: MembershipCacheDep,
+    hot_pages: HotPageCacheDep,
+    deletions: DeletionJobsDep,
+    current_user: CurrentUser,
+) -> Any:
     """
     Delete own user.
     """
@@ -137,42 +242,54 @@ def delete_user_me(session: SessionDep, current_user: CurrentUser) -> Any:
         raise HTTPException(
             status_code=403, detail="Super users are not allowed to delete themselves"
         )
-    session.delete(current_user)
-    session.commit()
-    return Message(message="User deleted successfully")
+    return await _delete_user(
+        async_session=async_session,
+        auth=auth,
+        membership=membership,
+        hot_pages=hot_pages,
+        deletions=deletions,
+        user=await async_session.get(Users, current_user.id),
+        requested_by=current_user.id,
+    )
 
 
 @router.post("/signup", response_model=UserPublic)
-def register_user(session: SessionDep, user_in: UserRegister) -> Any:
+async def register_user(request: Request, async_session: SessionAsyncDep, user_in: UserRegister) -> Any:
     """
     Create new user without the need to be logged in.
     """
-    user = crud.get_user_by_email(session=session, email=user_in.email)
+    user = await crud.get_user_by_email(async_session=async_session, email=user_in.email)
     if user:
         raise HTTPException(
             status_code=400,
             detail="The user with this email already exists in the system",
         )
     user_create = UserCreate.model_validate(user_in)
-    user = crud.create_user(session=session, user_create=user_create)
+    user = await crud.create_user(
+        async_session=async_session, user_create=user_create, client=client_host(request))
     return user
 
 
 @router.get("/{user_id}", response_model=UserPublic)
-def read_user_by_id(
-    user_id: uuid.UUID, session: SessionDep, current_user: CurrentUser
+async def read_user_by_id(
+    user_id: int, async_session: SessionAsyncDep, current_user: CurrentUser
 ) -> Any:
     """
     Get a specific user by id.
     """
-    user = session.get(Users, user_id)
-    if user == current_user:
-        return user
+    if user_id == current_user.id:
+        return current_user
     if not current_user.is_superuser:
         raise HTTPException(
             status_code=403,
             detail="The user doesn't have enough privileges",
         )
+    user = await async_session.get(Users, user_id)
+    if not user:
+        raise HTTPException(
+            status_code=404,
+            detail="The user with this id does not exist in the system",
+        )
     return user
 
 
@@ -181,51 +298,69 @@ def read_user_by_id(
     dependencies=[Depends(get_current_active_superuser)],
     response_model=UserPublic,
 )
-def update_user(
+async def update_user(
     *,
-    session: SessionDep,
-    user_id: uuid.UUID,
+    async_session: SessionAsyncDep,
+    auth: AuthCacheDep,
+    user_id: int,
     user_in: UserUpdate,
 ) -> Any:
     """
     Update a user.
     """
 
-    db_user = session.get(Users, user_id)
+    db_user = await async_session.get(Users, user_id)
     if not db_user:
         raise HTTPException(
             status_code=404,
             detail="The user with this id does not exist in the system",
         )
     if user_in.email:
-        existing_user = crud.get_user_by_email(
-            session=session, email=user_in.email)
+        existing_user = await crud.get_user_by_email(
+            async_session=async_session, email=user_in.email)
         if existing_user and existing_user.id != user_id:
             raise HTTPException(
                 status_code=409, detail="User with this email already exists"
             )
 
-    db_user = crud.update_user(
-        session=session, db_user=db_user, user_in=user_in)
+    db_user = await crud.update_user(
+        async_session=async_session, db_user=db_user, user_in=user_in)
+    auth.invalidate(db_user.id)
     return db_user
 
 
 @router.delete("/{user_id}", dependencies=[Depends(get_current_active_superuser)])
-def delete_user(
-    session: SessionDep, current_user: CurrentUser, user_id: uuid.UUID
-) -> Message:
+async def delete_user(
+    async_session: SessionAsyncDep,
+    auth: AuthCacheDep,
+    membership: MembershipCacheDep,
+    hot_pages: HotPageCacheDep,
+    deletions: DeletionJobsDep,
+    current_user: CurrentUser,
+    user_id: int,
+) -> DeletionAccepted:
     """
     Delete a user.
     """
-    user = session.get(Users, user_id)
+    user = await async_session.get(Users, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    if user == current_user:
+    if user.id == current_user.id:
         raise HTTPException(
             status_code=403, detail="Super users are not allowed to delete themselves"
         )
-    # statement = delete(Item).where(col(Item.owner_id) == user_id)
-    # session.exec(statement)  # type: ignore
-    session.delete(user)
-    session.commit()
-    return Message(message="User deleted successfully")
+    if user.deleted_at:
+        # already marked: resumes a deletion whose job failed for good
+        job_id = await deletions.active_job('user', user.id)
+        if job_id is None:
+            job_id = await deletions.enqueue('user', user.id, current_user.id)
+        return DeletionAccepted(message="User deletion in progress", job_id=job_id)
+    return await _delete_user(
+        async_session=async_session,
+        auth=auth,
+        membership=membership,
+        hot_pages=hot_pages,
+        deletions=deletions,
+        user=user,
+        requested_by=current_user.id,
+    )
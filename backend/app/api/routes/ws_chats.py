@@ -1,18 +1,29 @@
 import asyncio
 import json
 import logging
+import time
+from app.core.metrics import WS_MESSAGES_SENT, WS_SEND_SECONDS
+from app.core.tracing import MessageTrace, record_delivery, split_trace
+from app.core.streams import ReplayFilter, parse_stamp, stream_id_key
+from app.core.ws_queue import OutboundQueue, SlowConsumerError, live_queues
 from app.crud.groups import get_user_chats
-from app.crud.messages import create_group_msg, create_lc_msg, get_msg_by_id, get_msg_by_uuid
-from app.dto.chatmsg import MessageDTO, MessagePublic
+from app.crud.messages import insert_msg
+from app.dto.chatmsg import MessageDTO, MessagePublic, NotifyMsg
+from app.dto.users import UserShort
+from app.core.config import settings
+from app.services.membership import SocketChannelControl
 from app.utils import WsCloseCode, async_task_graceful_shutdown
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, WebSocketException
+from fastapi import APIRouter, Depends, Request, WebSocket, WebSocketDisconnect, WebSocketException
 from app.api.deps import (
-    SessionAsyncDep,
-    SessionDep,
-    get_current_user,
+    AuthCacheDep,
+    HotPageCacheDep,
+    MembershipCacheDep,
+    PresenceDep,
+    SessionAsyncAutocommitDep,
+    TypingRelayDep,
+    get_current_active_superuser,
 )
 from fastapi.websockets import WebSocketState
-from sqlmodel import select
 
 router = APIRouter(prefix="/ws", tags=["websocket"])
 logger = logging.getLogger(__name__)
@@ -21,22 +32,30 @@ logger = logging.getLogger(__name__)
 @router.websocket("/chat")
 async def ws_chat(
     websocket: WebSocket,
-    session: SessionDep,
-    async_session: SessionAsyncDep,
+    auth: AuthCacheDep,
+    async_session: SessionAsyncAutocommitDep,
+    membership: MembershipCacheDep,
+    hot_pages: HotPageCacheDep,
+    presence: PresenceDep,
+    typing: TypingRelayDep,
 ):
     await websocket.accept()
 
-    pubsub = websocket.app.state.redis_client.pubsub(
-        ignore_subscribe_messages=True)
+    hub = websocket.app.state.pubsub_hub
+    transport = websocket.app.state.transport
+    registry = websocket.app.state.node_registry
+    registered_user_id = None
+    replay_filter = ReplayFilter()
     is_init = False
     user_id = None
-    receive_task = None
+    send_task = None
+    channel_control = None
     ws_close_status = WsCloseCode.NORMAL_CLOSURE
-    message_queue = asyncio.Queue()
 
     # Log context
     socket_id = id(websocket)
     client_host = websocket.client.host if websocket.client else "unknown"
+    message_queue = OutboundQueue(socket_id=socket_id, client_host=client_host)
 
     def log_info(msg, **kwargs):
         base = {'socket_id': socket_id,
@@ -56,26 +75,34 @@ async def ws_chat(
         base.update(kwargs)
         logger.error(f"{msg} | context: {base}")
 
-    async def receive_messages():
-        try:
-            while True:
-                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
-                if message and message.get('data'):
-                    await message_queue.put(message['data'].decode())
-                else:
-                    await asyncio.sleep(0.1)
-        except asyncio.CancelledError:
-            log_info("Receive messages task cancelled")
-            raise
-        except Exception as e:
-            log_error(f"Error in receive_messages: {e}")
-
     async def send_messages():
+        nonlocal ws_close_status
         try:
             while True:
-                message = await message_queue.get()
                 try:
+                    message = await message_queue.get()
+                except SlowConsumerError as e:
+                    log_warning("Slow consumer, closing socket",
+                                queue=message_queue.stats())
+                    ws_close_status = e.close_code
+                    await websocket.close(e.close_code)
+                    break
+                if not replay_filter.allows(message):
+                    continue
+                message, trace = split_trace(message)
+                try:
+                    send_started_at = time.time()
+                    start = time.perf_counter()
                     await websocket.send_text(message)
+                    send_seconds = time.perf_counter() - start
+                    WS_SEND_SECONDS.observe(send_seconds)
+                    WS_MESSAGES_SENT.inc()
+                    if trace is not None:
+                        stamped = parse_stamp(message)
+                        record_delivery(
+                            trace, message_queue.last_enqueued_at, send_started_at,
+                            send_seconds, stream_id=stamped[1] if stamped else None,
+                            socket_id=socket_id, user_id=user_id)
                 except WebSocketDisconnect:
                     log_info("WebSocket client disconnected")
                     break
@@ -89,26 +116,106 @@ async def ws_chat(
         except Exception as e:
             log_error(f"Error in send_messages: {e}")
 
+    async def leave(user_id: int):
+        remaining = await registry.unregister(user_id)
+        await presence.disconnect(user_id, last_socket=remaining == 0)
+
+    async def resolve_target(kind: str | None, receiver_id):
+        """(chat id, channel, recipients) of a message to receiver_id."""
+        nonlocal ws_close_status
+        if kind == 'lc':
+            chat_id = await membership.direct_chat_id(
+                user_id, int(receiver_id), async_session=async_session)
+            if chat_id is None:
+                ws_close_status = WsCloseCode.POLICY_VIOLATION
+                raise WebSocketException(
+                    ws_close_status, f'LC-Chat not found for Users: {user_id, receiver_id}')
+            return chat_id, f"lc_chat_{receiver_id}", (int(receiver_id),)
+        if kind == 'group':
+            chat_id = await membership.resolve_chat_uuid(
+                receiver_id, async_session=async_session)
+            if chat_id is None or not await membership.is_member(
+                    chat_id, user_id, async_session=async_session):
+                ws_close_status = WsCloseCode.POLICY_VIOLATION
+                raise WebSocketException(
+                    ws_close_status, f'Not a member of chat {receiver_id}')
+            recipients = await membership.members(chat_id, async_session=async_session)
+            return chat_id, str(receiver_id), recipients
+        ws_close_status = WsCloseCode.UNSUPPORTED_DATA
+        raise WebSocketException(
+            ws_close_status, f'Undefined message type: {msg_dto.type} content: {msg_dto.content}'
+            )
+
+    async def replay_gap(resume: dict[str, str], channels: list[str]):
+        # Live payloads keep queueing while the gap is sent, replay_filter
+        # drops the ones the replay already covered.
+        for channel, last_id in resume.items():
+            if channel not in channels:
+                continue
+            try:
+                stream_id_key(last_id)
+            except ValueError:
+                frames, complete = [], False
+            else:
+                frames, complete = await transport.replay(channel, last_id)
+            for frame in frames:
+                await websocket.send_text(split_trace(frame)[0])
+            replay_filter.replayed(channel, frames)
+            if not complete:
+                await websocket.send_text(NotifyMsg(
+                    type='RESYNC',
+                    meta_data={'stream': channel, 'stream_id': last_id},
+                    content='Часть сообщений не может быть доставлена, обновите историю чата\n',
+                ).model_dump_json())
+            log_info("Replayed stream gap", channel=channel,
+                     last_id=last_id, frames=len(frames), complete=complete)
+
     try:
         while True:
+            # The session holds a connection from its first query until
+            # close(), give it back before waiting for the next frame.
+            await async_session.close()
             data = await websocket.receive_text()
+            trace = MessageTrace()
             msg_dto = MessageDTO(**json.loads(data))
 
             if msg_dto.is_init:
-                user = get_current_user(session, msg_dto.content)
+                if is_init:
+                    # the send task and subscriptions belong to the first one
+                    ws_close_status = WsCloseCode.POLICY_VIOLATION
+                    raise WebSocketException(
+                        ws_close_status, 'WebSocket is already initialized')
+                user = await auth.authenticate(msg_dto.content)
                 user_id = user.id
+                sender = UserShort.model_validate(user)
+                message_queue.labels['user_id'] = user_id
 
-                group_chats = await get_user_chats(
+                # before the chats are read, so no membership change is missed
+                channel_control = SocketChannelControl(hub, message_queue, user_id)
+                await channel_control.start()
+                user_chats = await get_user_chats(
                     async_session=async_session,
                     user_id=user_id,
-                    is_group=True,
+                    with_FK=False,
                 )
-                channels = [*[str(i.chat_id)
-                              for i in group_chats], f'lc_chat_{user_id}']
-                await pubsub.subscribe(*channels)
+                group_channels = [
+                    str(chat.chat_id) for chat in user_chats if chat.is_group]
+                channels = [*group_channels, f'lc_chat_{user_id}']
+                await hub.subscribe(message_queue, *channels)
+                channel_control.resume()
                 log_info("Subscribed to channels", channels=channels)
+                await registry.register(user_id)
+                registered_user_id = user_id
+                # presence changes go to the groups and to direct chat peers
+                await presence.connect(user_id, [*group_channels, *(
+                    f'lc_chat_{peer_id}'
+                    for chat in user_chats if not chat.is_group
+                    for peer_id in (chat.direct_user_lo, chat.direct_user_hi)
+                    if peer_id is not None and peer_id != user_id
+                )])
+                if transport.resumable and msg_dto.resume:
+                    await replay_gap(msg_dto.resume, channels)
 
-                receive_task = asyncio.create_task(receive_messages())
                 send_task = asyncio.create_task(send_messages())
                 is_init = True
                 continue
@@ -116,63 +223,115 @@ async def ws_chat(
             if not is_init:
                 ws_close_status = WsCloseCode.POLICY_VIOLATION
                 raise WebSocketException(
-                    'WebSocket is not initialized with user')
+                    ws_close_status, 'WebSocket is not initialized with user')
 
-            exist_msg = await get_msg_by_uuid(async_session=async_session, msg_uuid=msg_dto.message_uuid)
-            if exist_msg:
+            if msg_dto.is_ping:
+                await presence.touch(user_id)
+                message_queue.put_nowait(NotifyMsg(
+                    type='PONG', meta_data={}, content='').model_dump_json())
+                continue
+
+            if msg_dto.is_presence:
+                user_ids = msg_dto.user_ids or []
+                if len(user_ids) > settings.PRESENCE_QUERY_LIMIT:
+                    ws_close_status = WsCloseCode.POLICY_VIOLATION
+                    raise WebSocketException(
+                        ws_close_status, f'Presence of at most {settings.PRESENCE_QUERY_LIMIT} users per query')
+                statuses = await presence.query(user_ids)
+                message_queue.put_nowait(NotifyMsg(
+                    type='PRESENCE',
+                    meta_data={'users': [status.model_dump() for status in statuses.values()]},
+                    content='',
+                ).model_dump_json())
+                continue
+
+            if msg_dto.is_typing:
+                # never persisted, rate-limited and coalesced by TypingRelay
+                if not typing.accept(user_id, msg_dto.chat_type, msg_dto.receiver_id):
+                    continue
+                chat_id, publish_channel, recipients = await resolve_target(
+                    msg_dto.chat_type, msg_dto.receiver_id)
+                typing.offer(publish_channel, chat_id, user_id, recipients)
+                continue
+
+            trace.mark('parse')
+            chat_id, publish_channel, recipients = await resolve_target(
+                msg_dto.type, msg_dto.receiver_id)
+            trace.mark('resolve')
+
+            msg = await insert_msg(
+                async_session=async_session,
+                chat_id=chat_id,
+                sender_id=user_id,
+                message=msg_dto.content,
+                message_uuid=msg_dto.message_uuid,
+            )
+            if msg is None:
+                # chat_id is known at this point, so only a duplicate
+                # message_uuid leaves nothing inserted
                 log_warning(
                     f'Attempt to send an existing message',
-                    msg_id=exist_msg.id,
-                    msg_uuid=exist_msg.message_uuid,
+                    msg_uuid=msg_dto.message_uuid,
                 )
                 continue
 
-            if msg_dto.is_lc:
-                msg = await create_lc_msg(
-                    async_session=async_session,
-                    sender_id=user_id,
-                    receiver_id=msg_dto.receiver_id,
-                    message=msg_dto.content,
-                )
-                publish_channel = f"lc_chat_{msg_dto.receiver_id}"
-            elif msg_dto.is_group:
-                msg = await create_group_msg(
-                    async_session=async_session,
-                    sender_id=user_id,
-                    chat_uuid=msg_dto.receiver_id,
-                    message=msg_dto.content,
-                )
-                publish_channel = msg_dto.receiver_id
-            else:
-                ws_close_status = WsCloseCode.UNSUPPORTED_DATA
-                raise WebSocketException(
-                    f'Undefined message type: {msg_dto.type} content: {msg_dto.content}'
-                    )
+            trace.mark('persist')
 
-            updated_msg = await get_msg_by_id(async_session=async_session, msg_id=msg.id)
-            msg_dict = MessagePublic.model_validate(updated_msg).model_dump()
-            msg_dict['updated_at'] = msg_dict['updated_at'].isoformat()
+            msg_dict = MessagePublic(
+                id=msg.id,
+                chat_id=msg.chat_id,
+                sender_id=user_id,
+                content=msg_dto.content,
+                sender=sender,
+                created_at=msg.created_at,
+                updated_at=msg.updated_at,
+            ).model_dump(mode='json')
 
-            await websocket.app.state.redis_client.publish(
-                publish_channel,
-                json.dumps(msg_dict),
-            )
+            await transport.publish(
+                publish_channel, trace.attach(json.dumps(msg_dict), msg.id),
+                recipients=recipients)
+            # the trace is already published, recipients date this stage
+            # by the stream entry instead
+            trace.mark('publish')
+            await hot_pages.push(msg_dict)
             log_info(
                 f"Published message to channel {publish_channel}", message=msg_dict,
                 )
+    except WebSocketDisconnect:
+        log_info("WebSocket disconnected")
+    except WebSocketException as exc:
+        log_warning(f"Closing websocket: {exc.reason}", code=exc.code)
     except Exception as exc:
         log_error(f"Unexpected error in websocket: {exc}")
         ws_close_status = WsCloseCode.INTERNAL_SERVER_ERROR
     finally:
-        if receive_task:
-            await async_task_graceful_shutdown(receive_task)
         if send_task:
             await async_task_graceful_shutdown(send_task)
 
         try:
-            await pubsub.unsubscribe()
+            if channel_control:
+                await channel_control.close()
+            if registered_user_id is not None:
+                await leave(registered_user_id)
+            await hub.unsubscribe(message_queue)
         except Exception as e:
             log_error(f"Failed to unsubscribe from channels: {e}")
+        log_info("Socket closed", queue=message_queue.stats())
 
         if websocket.client_state == WebSocketState.CONNECTED:
             await websocket.close(ws_close_status)
+
+
+@router.get("/stats", dependencies=[Depends(get_current_active_superuser)])
+async def ws_stats(request: Request):
+    """
+    Outbound queue depth and drop counters of the sockets open on this worker.
+    """
+    sockets = [queue.stats() for queue in live_queues()]
+    return {
+        'hub': request.app.state.pubsub_hub.stats(),
+        'sockets_count': len(sockets),
+        'queued_total': sum(s['depth'] for s in sockets),
+        'dropped_total': sum(s['dropped'] for s in sockets),
+        'sockets': sockets,
+    }
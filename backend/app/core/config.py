@@ -1,3 +1,4 @@
+import os
 import secrets
 import warnings
 from typing import Annotated, Any, Literal
@@ -41,6 +42,9 @@ class Settings(BaseSettings):
     BACKEND_CORS_ORIGINS: Annotated[
         list[AnyUrl] | str, BeforeValidator(parse_cors)
     ] = []
+    # Peers whose X-Forwarded-For is believed (e.g. the Traefik container),
+    # app.api.deps.client_host; without them the client is the socket peer
+    TRUSTED_PROXIES: Annotated[list[str] | str, BeforeValidator(parse_cors)] = []
     # 172.19.0.1
 
     @computed_field  # type: ignore[prop-decorator]
@@ -112,6 +116,138 @@ class Settings(BaseSettings):
         # )
         return f'redis://{self.REDIS_HOST}:{self.REDIS_PORT}/0'
 
+    # push: blocking read on the pub/sub connection, wakes only on data
+    # poll: legacy get_message()/sleep loop, kept for comparison
+    WS_DELIVERY_MODE: Literal["push", "poll"] = "push"
+    WS_POLL_INTERVAL: float = 0.1
+    # pub/sub connections shared by all sockets of a worker
+    WS_PUBSUB_HUB_SHARDS: int = 1
+    # Outbound queue of a single socket, see app.core.ws_queue
+    WS_SEND_QUEUE_MAXSIZE: int = 1000
+    WS_SLOW_CONSUMER_POLICY: Literal["drop_oldest", "coalesce", "disconnect"] = "drop_oldest"
+    # 1009 MESSAGE_TOO_BIG or 1001 GOING_AWAY
+    WS_SLOW_CONSUMER_CLOSE_CODE: Literal[1001, 1009] = 1009
+    # app.core.tracing: log the full timeline of one in N chat messages, 0 disables
+    WS_TRACE_SAMPLE_RATE: int = 0
+    # pubsub: fire-and-forget PUBLISH
+    # streams: capped stream per channel, clients resume from the last stream_id,
+    # see app.core.streams
+    WS_TRANSPORT: Literal["pubsub", "streams"] = "pubsub"
+    WS_STREAM_MAXLEN: int = 1000
+    WS_STREAM_TTL: int = 60 * 60 * 24
+    # gaps longer than this are not replayed, the client gets RESYNC instead
+    WS_STREAM_REPLAY_LIMIT: int = 500
+    # broadcast: publish on the chat channel, every subscribed node receives it
+    # node: publish once per node holding sockets of the recipients,
+    # see app.core.routing (nodes register their users in both modes)
+    WS_ROUTING: Literal["broadcast", "node"] = "broadcast"
+    # defaults to <hostname>-<pid>-<random>
+    WS_NODE_ID: str | None = None
+    WS_NODE_HEARTBEAT: float = 5
+
+    # app.services.presence: online while the last heartbeat is younger than TTL
+    PRESENCE_TTL: int = 60
+    PRESENCE_HEARTBEAT: float = 20
+    # presence changes pushed to chats at most once per window
+    PRESENCE_PUSH_WINDOW: float = 2
+    PRESENCE_LAST_SEEN_TTL: int = 60 * 60 * 24 * 30
+    PRESENCE_QUERY_LIMIT: int = 500
+
+    # app.services.typing: one accepted typing event per user and chat per
+    # interval, one TYPING fan-out per chat per window
+    WS_TYPING_USER_INTERVAL: float = 1
+    WS_TYPING_WINDOW: float = 1
+    # (user, chat) pairs remembered for the interval, per worker
+    WS_TYPING_CACHE_SIZE: int = 10_000
+
+    # app.services.membership: local LRU in front of Redis sets
+    CHAT_MEMBERSHIP_CACHE_SIZE: int = 50_000
+    CHAT_MEMBERSHIP_CACHE_TTL: float = 300
+    CHAT_MEMBERSHIP_REDIS_TTL: int = 60 * 60 * 24
+
+    # rows: a MessageRead row per (message, reader)
+    # watermark: UserChatParticipant.last_read_message_id per (user, chat),
+    # kept up to date in rows mode as well, either mode can be switched to
+    READ_TRACKING_MODE: Literal["rows", "watermark"] = "rows"
+
+    # app.services.hot_page: newest messages of a chat kept in Redis, 0 disables
+    CHAT_HOT_PAGE_SIZE: int = 100
+    CHAT_HOT_PAGE_TTL: int = 60 * 60
+
+    # app.services.auth: token -> user cache per worker, invalidated on user
+    # update, deactivation and deletion
+    AUTH_CACHE_SIZE: int = 50_000
+    AUTH_CACHE_TTL: float = 30
+
+    # API processes per host, keep in line with `fastapi run --workers`
+    # (Dockerfile); per process pools are sized from it
+    WEB_WORKERS: int = 4
+
+    # app.core.hashing: bcrypt process pool of every API process, 0 workers
+    # = the host's CPUs / WEB_WORKERS; jobs beyond workers + QUEUE_LIMIT get
+    # 503, beyond CLIENT_LIMIT per client address 429 (0 = no client limit,
+    # see TRUSTED_PROXIES)
+    PASSWORD_HASH_WORKERS: int = 0
+    PASSWORD_HASH_QUEUE_LIMIT: int = 64
+    PASSWORD_HASH_CLIENT_LIMIT: int = 0
+    PASSWORD_HASH_TIMEOUT: float = 5
+
+    # app.services.user_import: rows per INSERT (7 bind params each, asyncpg
+    # takes 32767) and passwords per process pool job
+    USER_IMPORT_CHUNK_SIZE: int = 1000
+    USER_IMPORT_HASH_BATCH: int = 16
+
+    # app.services.email_outbox: every API process runs a sender unless
+    # WORKER is off; SMTP connections are reused until IDLE_TIMEOUT, a
+    # message is tried MAX_ATTEMPTS times, entries pending longer than
+    # CLAIM_IDLE (crashed process) are taken over
+    EMAIL_OUTBOX_WORKER: bool = True
+    EMAIL_OUTBOX_BATCH: int = 50
+    EMAIL_OUTBOX_MAX_ATTEMPTS: int = 5
+    EMAIL_OUTBOX_RETRY_DELAY: float = 10
+    EMAIL_OUTBOX_CLAIM_IDLE: float = 300
+    EMAIL_SMTP_IDLE_TIMEOUT: float = 60
+    EMAIL_SMTP_TIMEOUT: float = 30
+
+    # app.services.deletion: users and chats are deleted in the background
+    # by every API process unless WORKER is off, BATCH_SIZE messages per
+    # transaction with PAUSE seconds in between; a failed job is retried
+    # after CLAIM_IDLE, MAX_ATTEMPTS times in all
+    DELETION_WORKER: bool = True
+    DELETION_BATCH_SIZE: int = 1000
+    DELETION_BATCH_PAUSE: float = 0.05
+    DELETION_CLAIM_IDLE: float = 60
+    DELETION_MAX_ATTEMPTS: int = 5
+    DELETION_JOB_TTL: int = 60 * 60 * 24 * 7
+
+    # app.services.partitions: message and message_read are partitioned by
+    # month, created PARTITIONS_AHEAD months ahead by every API process
+    # unless WORKER is off; months older than RETENTION_MONTHS go to gzipped
+    # CSV files in ARCHIVE_DIR (0 keeps everything in Postgres). The history
+    # reads them back, so with retention on ARCHIVE_DIR is required: an
+    # absolute path on storage every replica mounts and redeploys keep.
+    MESSAGE_PARTITION_WORKER: bool = True
+    MESSAGE_PARTITION_CHECK_INTERVAL: float = 60 * 60
+    MESSAGE_PARTITIONS_AHEAD: int = 3
+    MESSAGE_RETENTION_MONTHS: int = 0
+    MESSAGE_ARCHIVE_DIR: str = ""
+
+    @model_validator(mode="after")
+    def _check_message_archive_dir(self) -> Self:
+        if self.MESSAGE_RETENTION_MONTHS and not os.path.isabs(self.MESSAGE_ARCHIVE_DIR):
+            raise ValueError(
+                "MESSAGE_ARCHIVE_DIR must be an absolute path on shared storage "
+                "when MESSAGE_RETENTION_MONTHS is set"
+            )
+        return self
+
+    # app.core.metrics: GET /metrics (outside API_V1_STR, unauthenticated,
+    # keep it off public listeners) and HTTP latency. With METRICS_DIR set
+    # the workers share their samples through it, every scrape sees all.
+    METRICS_ENABLED: bool = False
+    METRICS_DIR: str = ""
+    METRICS_FLUSH_INTERVAL: float = 5
+
     @computed_field  # type: ignore[prop-decorator]
     @property
     def emails_enabled(self) -> bool:
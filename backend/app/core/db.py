@@ -1,21 +1,71 @@
+import time
+
 from sqlmodel import Session, create_engine, select
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 
 from app.crud import users as crud
+from app.crud.groups import chat_summary_rebuild_statements
 from app.core.config import settings
+from app.core.metrics import DB_POOL_CHECKOUT_SECONDS, REGISTRY
+from app.core.security import get_password_hash
 from app.models import Users, Chats, UserChatParticipant, Message, MessageRead
 from app.dto import UserCreate
 
-engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
 
-async_engine = create_async_engine(str(settings.SQLALCHEMY_ASYNC_DATABASE_URI))
+
+def timed_pool(base: type[QueuePool], label: str) -> type[QueuePool]:
+    """
+    base pool class recording the checkout wait as engine=label. The pool
+    events only fire once a connection is checked out, so connect() (what
+    the engine calls for every checkout) is timed instead.
+    """
+    checkout_seconds = DB_POOL_CHECKOUT_SECONDS.labels(label)
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return base.connect(self)
+        finally:
+            checkout_seconds.observe(time.perf_counter() - start)
+
+    return type(f'Timed{base.__name__}', (base,), {'connect': connect})
+
+
+# Sync engine for scripts only (prestart checks, initial data, tests): the
+# app itself runs on async_engine, so a worker holds a single pool.
+engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI), poolclass=NullPool)
+
+async_engine = create_async_engine(
+    str(settings.SQLALCHEMY_ASYNC_DATABASE_URI),
+    poolclass=timed_pool(AsyncAdaptedQueuePool, 'async'),
+)
 AsyncSessionLocal = sessionmaker(
     bind=async_engine,
     class_=AsyncSession,
     expire_on_commit=False,
 )
+# Shares the pool of async_engine. Every statement commits on its own, so a
+# single-statement write costs one round trip (no BEGIN/COMMIT) and the
+# connection never idles inside an open transaction.
+AsyncAutocommitSessionLocal = sessionmaker(
+    bind=async_engine.execution_options(isolation_level="AUTOCOMMIT"),
+    class_=AsyncSession,
+    expire_on_commit=False,
+)
+
+_pools = {'async': async_engine.pool}
+REGISTRY.gauge(
+    'db_pool_checked_out', 'Connections currently checked out of the pool', ('engine',),
+    callback=lambda: {label: pool.checkedout() for label, pool in _pools.items()})
+REGISTRY.gauge(
+    'db_pool_size', 'Configured pool size', ('engine',),
+    callback=lambda: {label: pool.size() for label, pool in _pools.items()})
+REGISTRY.gauge(
+    'db_pool_overflow', 'Connections open beyond the pool size (negative: unopened slots)', ('engine',),
+    callback=lambda: {label: pool.overflow() for label, pool in _pools.items()})
 
 # make sure all SQLModel models are imported (app.models) before initializing DB
 # otherwise, SQLModel might fail to initialize relationships properly
@@ -75,7 +125,10 @@ def init_db(session: Session) -> None:
         ).first()
         if not user:
             user_in = UserCreate(**value)
-            user = crud.create_user(session=session, user_create=user_in)
+            user = crud.build_user(user_in, get_password_hash(user_in.password))
+            session.add(user)
+            session.commit()
+            session.refresh(user)
         db_users[user.email] = user
 
     first_second_chat = session.exec(
@@ -93,6 +146,8 @@ def init_db(session: Session) -> None:
             name=f'{db_users[first_email].full_name}_{db_users[second_email].full_name}',
             is_group=False,
             owner_id=db_users[first_email].id,
+            direct_user_lo=min(db_users[first_email].id, db_users[second_email].id),
+            direct_user_hi=max(db_users[first_email].id, db_users[second_email].id),
         )
         session.add(first_second_chat)
         session.commit()
@@ -103,6 +158,8 @@ def init_db(session: Session) -> None:
             name=f'{db_users.get(settings.FIRST_SUPERUSER).full_name}_{db_users[third_email].full_name}',
             is_group=False,
             owner_id=db_users.get(settings.FIRST_SUPERUSER).id,
+            direct_user_lo=min(db_users[settings.FIRST_SUPERUSER].id, db_users[third_email].id),
+            direct_user_hi=max(db_users[settings.FIRST_SUPERUSER].id, db_users[third_email].id),
         )
         session.add(thrid_admin_chat)
         session.commit()
@@ -207,6 +264,7 @@ def init_db(session: Session) -> None:
                 session.refresh(message)
                 message_read = MessageRead(
                     message_id=message.id,
+                    message_created_at=message.created_at,
                     user_id=users[cnt ^ 1].id,
                 )
                 cnt = cnt ^ 1
@@ -227,3 +285,8 @@ def init_db(session: Session) -> None:
                 chat_id=group_chat.id,
             ))
     session.commit()
+
+    # the seed above writes messages and participants directly
+    for statement in chat_summary_rebuild_statements(settings.READ_TRACKING_MODE):
+        session.execute(statement)
+    session.commit()
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from fastapi import HTTPException, status
+
+from app.core.config import settings
+from app.core.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+HASH_REJECTED = REGISTRY.counter(
+    'password_hash_rejected', 'Hashing jobs refused by admission control', ('reason',))
+HASH_SECONDS = REGISTRY.histogram(
+    'password_hash_duration_seconds', 'Queue wait plus bcrypt time of one hashing job')
+
+_DEFAULT_TIMEOUT: Any = object()
+
+
+def _warm_up() -> None:
+    # imports passlib/bcrypt in the worker before the first real job
+    from app.core import security  # noqa: F401
+
+
+def default_workers() -> int:
+    """The host's CPUs shared by the WEB_WORKERS API processes."""
+    return max(1, (os.cpu_count() or 1) // max(1, settings.WEB_WORKERS))
+
+
+def retry_after() -> str:
+    """Retry-After of the responses refused for lack of hashing capacity."""
+    return str(max(1, round(settings.PASSWORD_HASH_TIMEOUT)))
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a pool of PASSWORD_HASH_WORKERS processes, so hashing
+    neither blocks the event loop nor competes for the GIL or the
+    threadpool. Every API process has its own pool, so the limits below
+    are per process.
+
+    Admission control instead of an unbounded backlog: at most workers +
+    PASSWORD_HASH_QUEUE_LIMIT jobs are in flight, the next one is refused
+    with 503 and Retry-After. With PASSWORD_HASH_CLIENT_LIMIT set, a single
+    client (e.g. one IP hammering /login) gets 429 past that many jobs of
+    its own. A job not done after PASSWORD_HASH_TIMEOUT is answered with
+    503; one a worker already runs keeps its slot until it finishes, the
+    same goes for a job whose caller is cancelled.
+    """
+
+    def __init__(self, workers: int | None = None):
+        self.workers = workers or settings.PASSWORD_HASH_WORKERS or default_workers()
+        self.capacity = self.workers + settings.PASSWORD_HASH_QUEUE_LIMIT
+        self._executor: ProcessPoolExecutor | None = None
+        self._warming: asyncio.Task | None = None
+        self._inflight = 0
+        self._by_client: Counter[str] = Counter()
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # spawn: forking a process that runs an event loop and threads is unsafe
+        return ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    async def _warm(self, executor: ProcessPoolExecutor) -> None:
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(executor, _warm_up) for _ in range(self.workers)
+        ))
+
+    async def start(self) -> None:
+        self._executor = self._new_executor()
+        await self._warm(self._executor)
+        logger.info(f"Password hasher started with {self.workers} processes")
+
+    async def close(self) -> None:
+        if self._warming:
+            self._warming.cancel()
+            self._warming = None
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        # every job of the broken pool fails at once, the first one restarts it
+        if self._executor is not broken:
+            return
+        logger.error("Password hashing pool broken, restarting it")
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._new_executor()
+        self._warming = asyncio.create_task(self._warm(self._executor))
+
+    @staticmethod
+    def _refuse(status_code: int, reason: str) -> HTTPException:
+        HASH_REJECTED.labels(reason).inc()
+        return HTTPException(
+            status_code=status_code,
+            detail="Too many password operations, retry later",
+            headers={"Retry-After": retry_after()},
+        )
+
+    def _release(self, client: str | None) -> None:
+        self._inflight -= 1
+        if client is not None:
+            self._by_client[client] -= 1
+            if self._by_client[client] <= 0:
+                del self._by_client[client]
+
+    async def run(
+        self, func: Callable[..., Any], *args: Any, client: str | None = None,
+        timeout: float | None = _DEFAULT_TIMEOUT,
+    ) -> Any:
+        """
+        func(*args) in the pool; func must be importable by the worker.
+        timeout defaults to PASSWORD_HASH_TIMEOUT, None waits for good.
+        """
+        if self._executor is None:
+            raise RuntimeError('PasswordHasher is not started')
+        if self._inflight >= self.capacity:
+            raise self._refuse(status.HTTP_503_SERVICE_UNAVAILABLE, 'queue_full')
+        client_limit = settings.PASSWORD_HASH_CLIENT_LIMIT
+        if client is not None and client_limit and self._by_client[client] >= client_limit:
+            raise self._refuse(status.HTTP_429_TOO_MANY_REQUESTS, 'client_limit')
+
+        self._inflight += 1
+        if client is not None:
+            self._by_client[client] += 1
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        executor = self._executor
+        release = True
+        try:
+            job = executor.submit(func, *args)
+            if timeout is _DEFAULT_TIMEOUT:
+                timeout = settings.PASSWORD_HASH_TIMEOUT
+            # shielded: a timeout must not drop the job while a worker runs it
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job)), timeout)
+        except asyncio.TimeoutError:
+            if not job.cancel():
+                # still running, its worker is busy until it is done
+                release = False
+                job.add_done_callback(
+                    lambda _: loop.call_soon_threadsafe(self._release, client))
+            raise self._refuse(status.HTTP_503_SERVICE_UNAVAILABLE, 'timeout')
+        except asyncio.CancelledError:
+            # a queued job is dropped, a running one keeps its slot as above
+            if not job.cancel():
+                release = False
+                job.add_done_callback(
+                    lambda _: loop.call_soon_threadsafe(self._release, client))
+            raise
+        except BrokenProcessPool:
+            # a worker died (OOM killer...), the pool is unusable from now on
+            self._restart(executor)
+            raise self._refuse(status.HTTP_503_SERVICE_UNAVAILABLE, 'pool_broken')
+        finally:
+            HASH_SECONDS.observe(loop.time() - start)
+            if release:
+                self._release(client)
@@ -0,0 +1,419 @@
+import asyncio
+import glob
+import json
+import math
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+from redis.asyncio import ConnectionPool
+
+# Latency buckets in seconds, from sub-millisecond Redis/pool waits up to
+# slow HTTP handlers.
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_str(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, doc: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+        # the only child of a metric without labels
+        self._default = None if self.labelnames else self.labels()
+
+    def labels(self, *values):
+        """Child for one label combination, cache it on hot paths."""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default.inc(amount)
+
+    def _samples(self):
+        for values, child in self._children.items():
+            yield f'{self.name}_total{_label_str(self.labelnames, values)} {_fmt(child.value)}'
+
+
+class Gauge(_Metric):
+    """
+    Set directly, or computed at scrape time when created with a callback
+    (returns a number, or a dict label values -> number with labelnames).
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, doc: str, labelnames: Iterable[str] = (),
+                 callback: Callable[[], float | dict] | None = None):
+        super().__init__(name, doc, labelnames)
+        self.callback = callback
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+    def inc(self, amount: float = 1) -> None:
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self._default.dec(amount)
+
+    def _samples(self):
+        if self.callback is None:
+            values = {key: child.value for key, child in self._children.items()}
+        else:
+            result = self.callback()
+            if isinstance(result, dict):
+                values = {
+                    tuple(str(v) for v in (key if isinstance(key, tuple) else (key,))): value
+                    for key, value in result.items()
+                }
+            else:
+                values = {(): result}
+        for key, value in values.items():
+            yield f'{self.name}{_label_str(self.labelnames, key)} {_fmt(value)}'
+
+
+class _HistogramValue:
+    __slots__ = ('upper_bounds', 'counts', 'sum')
+
+    def __init__(self, upper_bounds: tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        # non-cumulative counts, summed up at scrape time
+        self.counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+    def time(self) -> '_Timer':
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: _HistogramValue):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, doc: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, doc, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return self._default.time()
+
+    def _samples(self):
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), child.counts):
+                cumulative += count
+                le = _label_str(self.labelnames, values, f'le="{_fmt(float(bound))}"')
+                yield f'{self.name}_bucket{le} {cumulative}'
+            labels = _label_str(self.labelnames, values)
+            yield f'{self.name}_count{labels} {cumulative}'
+            yield f'{self.name}_sum{labels} {_fmt(child.sum)}'
+
+
+class Registry:
+    """
+    Process-local metrics in the Prometheus text format.
+
+    Recording is a few attribute updates without locks: the event loop is
+    single threaded, and an increment lost to a race between threadpool
+    workers (sync routes, threadpool calls) is acceptable for monitoring.
+    Every worker process has its own numbers, MetricsFiles puts the
+    workers of an instance together.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name: str) -> None:
+        self._metrics.pop(name, None)
+
+    def counter(self, name: str, doc: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, doc, labelnames))
+
+    def gauge(self, name: str, doc: str, labelnames: Iterable[str] = (),
+              callback: Callable[[], float | dict] | None = None) -> Gauge:
+        return self.register(Gauge(name, doc, labelnames, callback))
+
+    def histogram(self, name: str, doc: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, doc, labelnames, buckets))
+
+    def collect(self) -> dict[str, list[str]]:
+        """metric name -> its lines, HELP and TYPE first."""
+        metrics = {}
+        for metric in self._metrics.values():
+            try:
+                metrics[metric.name] = metric.render().split('\n')
+            except Exception as e:
+                metrics[metric.name] = [f'# {metric.name} failed: {_escape(e)}']
+        return metrics
+
+    def render(self) -> str:
+        return render_collected([self.collect()])
+
+
+def render_collected(collected: Iterable[dict[str, list[str]]]) -> str:
+    """Text format of Registry.collect results, the samples of a metric kept together."""
+    metrics: dict[str, list[str]] = {}
+    for snapshot in collected:
+        for name, lines in snapshot.items():
+            if name in metrics:
+                metrics[name] += [line for line in lines if not line.startswith('#')]
+            else:
+                metrics[name] = list(lines)
+    return '\n'.join(line for lines in metrics.values() for line in lines) + '\n'
+
+
+def _with_label(sample: str, label: str) -> str:
+    series, value = sample.rsplit(' ', 1)
+    if series.endswith('}'):
+        return f'{series[:-1]},{label}}} {value}'
+    return f'{series}{{{label}}} {value}'
+
+
+class MetricsFiles:
+    """
+    Metrics of all worker processes (fastapi run --workers N) on every
+    scrape: each worker writes its samples, labelled worker=<pid>, to
+    directory every interval, and renders the files of all of them.
+    Files not written for three intervals belong to stopped workers and
+    are removed.
+    """
+
+    def __init__(self, registry: Registry, directory: str, interval: float):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.path = os.path.join(directory, f'{os.getpid()}.json')
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.to_thread(self._write, self._snapshot())
+            await asyncio.sleep(self.interval)
+
+    def _snapshot(self) -> dict[str, list[str]]:
+        # in the event loop, metrics are not recorded while it runs
+        label = f'worker="{os.getpid()}"'
+        return {
+            name: [line if line.startswith('#') else _with_label(line, label) for line in lines]
+            for name, lines in self.registry.collect().items()
+        }
+
+    def _write(self, snapshot: dict[str, list[str]]) -> None:
+        with open(f'{self.path}.tmp', 'w') as output:
+            json.dump(snapshot, output)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def _read_all(self) -> list[dict[str, list[str]]]:
+        snapshots = []
+        stale = time.time() - 3 * self.interval
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                if os.path.getmtime(path) < stale:
+                    os.remove(path)
+                    continue
+                with open(path) as lines:
+                    snapshots.append(json.load(lines))
+            except (OSError, ValueError):
+                # removed or replaced by its worker meanwhile
+                continue
+        return snapshots
+
+    async def render(self) -> str:
+        """This worker's current samples and the last ones of the others."""
+        await asyncio.to_thread(self._write, self._snapshot())
+        return render_collected(await asyncio.to_thread(self._read_all))
+
+
+class CountingConnectionPool(ConnectionPool):
+    """Redis connection pool counting its connections, redis-py has no public counts."""
+
+    def __init__(self, *args, **kwargs):
+        self.created = 0
+        self.in_use = 0
+        super().__init__(*args, **kwargs)
+
+    def reset(self) -> None:
+        super().reset()
+        self.created = 0
+        self.in_use = 0
+
+    def make_connection(self):
+        connection = super().make_connection()
+        self.created += 1
+        return connection
+
+    def get_available_connection(self):
+        connection = super().get_available_connection()
+        self.in_use += 1
+        return connection
+
+    async def release(self, connection) -> None:
+        await super().release(connection)
+        self.in_use -= 1
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route template',
+    ('method', 'route', 'status'))
+WS_SEND_SECONDS = REGISTRY.histogram(
+    'ws_send_duration_seconds', 'Time of one websocket.send_text in /ws/chat')
+WS_MESSAGES_SENT = REGISTRY.counter(
+    'ws_messages_sent', 'Payloads sent to sockets')
+WS_QUEUE_DROPPED = REGISTRY.counter(
+    'ws_send_queue_dropped', 'Payloads dropped by full outbound queues')
+WS_QUEUE_COALESCED = REGISTRY.counter(
+    'ws_send_queue_coalesced', 'Payloads merged into queued ones by full outbound queues')
+PUBSUB_LAG_SECONDS = REGISTRY.histogram(
+    'ws_pubsub_lag_seconds',
+    'From publish (stream entry id) to delivery into local queues, streams transport only')
+PUBSUB_RECEIVED = REGISTRY.counter(
+    'ws_pubsub_received', 'Payloads received by the pub/sub hub', ('shard',))
+DB_POOL_CHECKOUT_SECONDS = REGISTRY.histogram(
+    'db_pool_checkout_duration_seconds', 'Wait for a connection from the SQLAlchemy pool',
+    ('engine',))
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording HTTP_REQUEST_SECONDS. The route label is
+    the matched path template, requests that matched no route share
+    route="unmatched". Websocket scopes are passed through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get('route')
+            HTTP_REQUEST_SECONDS.labels(
+                scope['method'],
+                getattr(route, 'path', 'unmatched'),
+                status,
+            ).observe(time.perf_counter() - start)
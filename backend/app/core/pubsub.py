@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import time
+import zlib
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Protocol
+
+from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
+
+from app.core.config import settings
+from app.core.metrics import PUBSUB_LAG_SECONDS, PUBSUB_RECEIVED
+
+logger = logging.getLogger(__name__)
+
+OnMessage = Callable[[str, str], Awaitable[None]]
+
+# Prefix of payloads stamped by app.core.streams, the stream id starts
+# with the publish time in milliseconds.
+_STAMP_PREFIX = '{"stream_id":"'
+
+
+class Sink(Protocol):
+    def put_nowait(self, item: Any) -> None: ...
+
+
+async def poll_reader(pubsub: PubSub, on_message: OnMessage) -> None:
+    # Wakes up every WS_POLL_INTERVAL even when the socket is idle and
+    # delays delivery of anything that arrives while sleeping.
+    while True:
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
+        if message and message.get('data'):
+            await on_message(message['channel'].decode(), message['data'].decode())
+        else:
+            await asyncio.sleep(settings.WS_POLL_INTERVAL)
+
+
+async def push_reader(pubsub: PubSub, on_message: OnMessage) -> None:
+    # listen() blocks on the socket read, so the task is only scheduled
+    # when Redis actually sends something.
+    async for message in pubsub.listen():
+        if message.get('type') == 'message' and message.get('data'):
+            await on_message(message['channel'].decode(), message['data'].decode())
+
+
+READERS: dict[str, Callable[[PubSub, OnMessage], Awaitable[None]]] = {
+    'push': push_reader,
+    'poll': poll_reader,
+}
+
+
+def get_pubsub_reader(mode: str | None = None) -> Callable[[PubSub, OnMessage], Awaitable[None]]:
+    return READERS[mode or settings.WS_DELIVERY_MODE]
+
+
+class _HubShard:
+    def __init__(self, redis_client: Redis, index: int):
+        self.index = index
+        self.pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        self.sinks: dict[str, set[Sink]] = {}
+        self.lock = asyncio.Lock()
+        self.task: asyncio.Task | None = None
+        self._received = PUBSUB_RECEIVED.labels(index)
+
+    async def on_message(self, channel: str, data: str) -> None:
+        self._received.inc()
+        self.deliver(channel, data)
+
+    def deliver(self, channel: str, data: str) -> None:
+        if data.startswith(_STAMP_PREFIX):
+            ms_end = data.find('-', len(_STAMP_PREFIX))
+            if ms_end > 0:
+                PUBSUB_LAG_SECONDS.observe(
+                    time.time() - int(data[len(_STAMP_PREFIX):ms_end]) / 1000)
+        for sink in tuple(self.sinks.get(channel, ())):
+            try:
+                sink.put_nowait(data)
+            except Exception as e:
+                logger.error(f"Hub shard {self.index} failed to deliver to sink: {e}")
+
+    async def _run(self) -> None:
+        reader = get_pubsub_reader()
+        while self.pubsub.subscribed:
+            try:
+                await reader(self.pubsub, self.on_message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # redis-py reconnects and re-subscribes on the next read
+                logger.error(f"Hub shard {self.index} reader failed: {e}")
+                await asyncio.sleep(1)
+
+    def ensure_reader(self) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def subscribe(self, sink: Sink, channels: list[str]) -> None:
+        async with self.lock:
+            new_channels = []
+            for channel in channels:
+                sinks = self.sinks.setdefault(channel, set())
+                if not sinks:
+                    new_channels.append(channel)
+                sinks.add(sink)
+            if new_channels:
+                await self.pubsub.subscribe(*new_channels)
+                self.ensure_reader()
+
+    async def unsubscribe(self, sink: Sink, channels: list[str]) -> None:
+        async with self.lock:
+            dropped = []
+            for channel in channels:
+                sinks = self.sinks.get(channel)
+                if sinks is None:
+                    continue
+                sinks.discard(sink)
+                if not sinks:
+                    del self.sinks[channel]
+                    dropped.append(channel)
+            if dropped:
+                await self.pubsub.unsubscribe(*dropped)
+
+    async def close(self) -> None:
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        await self.pubsub.aclose()
+
+
+class PubSubHub:
+    """
+    Per-worker multiplexer: every socket of the process shares
+    WS_PUBSUB_HUB_SHARDS pub/sub connections, each Redis channel is
+    subscribed once and fanned out to local sinks in memory.
+    """
+
+    def __init__(self, redis_client: Redis, shards: int | None = None):
+        self._shards = [
+            _HubShard(redis_client, i)
+            for i in range(max(1, shards or settings.WS_PUBSUB_HUB_SHARDS))
+        ]
+        self._sink_channels: dict[Sink, set[str]] = defaultdict(set)
+
+    def _shard_for(self, channel: str) -> _HubShard:
+        return self._shards[zlib.crc32(channel.encode()) % len(self._shards)]
+
+    def _group_by_shard(self, channels) -> dict[_HubShard, list[str]]:
+        grouped: dict[_HubShard, list[str]] = defaultdict(list)
+        for channel in channels:
+            grouped[self._shard_for(channel)].append(channel)
+        return grouped
+
+    async def subscribe(self, sink: Sink, *channels: str) -> None:
+        self._sink_channels[sink].update(channels)
+        for shard, shard_channels in self._group_by_shard(channels).items():
+            await shard.subscribe(sink, shard_channels)
+
+    async def unsubscribe(self, sink: Sink, *channels: str) -> None:
+        """Drop the given channels for sink, or all of its channels if none given."""
+        owned = self._sink_channels.get(sink, set())
+        channels = tuple(channels) if channels else tuple(owned)
+        owned.difference_update(channels)
+        if not owned:
+            self._sink_channels.pop(sink, None)
+        for shard, shard_channels in self._group_by_shard(channels).items():
+            await shard.unsubscribe(sink, shard_channels)
+
+    def dispatch(self, channel: str, data: str) -> None:
+        """Deliver data to the local sinks of channel as if Redis sent it."""
+        self._shard_for(channel).deliver(channel, data)
+
+    def channels_of(self, sink: Sink) -> set[str]:
+        return set(self._sink_channels.get(sink, ()))
+
+    def stats(self) -> dict:
+        return {
+            'shards': len(self._shards),
+            'channels': sum(len(shard.sinks) for shard in self._shards),
+            'sinks': len(self._sink_channels),
+        }
+
+    async def close(self) -> None:
+        for shard in self._shards:
+            await shard.close()
+        self._sink_channels.clear()
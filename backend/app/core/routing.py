@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import Counter
+from typing import Iterable
+
+from redis.asyncio import Redis
+
+from app.core.config import settings
+from app.core.pubsub import PubSubHub
+
+logger = logging.getLogger(__name__)
+
+NODES_KEY = 'ws_nodes'
+
+_UNREGISTER_SCRIPT = """
+if redis.call('HINCRBY', KEYS[1], ARGV[1], -1) <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return redis.call('HLEN', KEYS[1])
+"""
+
+
+def node_channel(node_id: str) -> str:
+    return f'ws_node:{node_id}'
+
+
+def _user_nodes_key(user_id: int) -> str:
+    return f'ws_user_nodes:{user_id}'
+
+
+def node_frame(channel: str, payload: str) -> str:
+    # channel names never contain a newline
+    return f'{channel}\n{payload}'
+
+
+class NodeRegistry:
+    """
+    Which gateway nodes (workers) hold sockets of which users.
+
+    ws_user_nodes:<user id> is a hash node id -> open sockets, kept by
+    register()/unregister(). ws_nodes is a sorted set of node ids by last
+    heartbeat; nodes that stopped beating are ignored, and their leftover
+    hash fields are removed when a lookup runs into them.
+    Payloads routed to a node arrive on its own ws_node:<id> channel as
+    node_frame()s and are fanned out to the local sinks of the original
+    channel.
+    """
+
+    def __init__(self, redis_client: Redis, hub: PubSubHub, node_id: str | None = None):
+        self.redis = redis_client
+        self.hub = hub
+        self.node_id = node_id or settings.WS_NODE_ID or (
+            f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}')
+        self.channel = node_channel(self.node_id)
+        self._live_nodes: set[str] = set()
+        self._live_nodes_at = 0.0
+        self._heartbeat_task: asyncio.Task | None = None
+        self._local_users: Counter[int] = Counter()
+        self._unregister = self.redis.register_script(_UNREGISTER_SCRIPT)
+
+    async def start(self) -> None:
+        await self._beat()
+        await self.hub.subscribe(self, self.channel)
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def close(self) -> None:
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+        await self.hub.unsubscribe(self)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zrem(NODES_KEY, self.node_id)
+            for user_id in self._local_users:
+                pipe.hdel(_user_nodes_key(user_id), self.node_id)
+            await pipe.execute()
+        self._local_users.clear()
+
+    def put_nowait(self, frame: str) -> None:
+        # Hub sink for this node's channel
+        channel, sep, payload = frame.partition('\n')
+        if not sep:
+            logger.error(f"Bad node frame on {self.channel}: {frame[:100]}")
+            return
+        self.hub.dispatch(channel, payload)
+
+    async def _beat(self) -> None:
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(NODES_KEY, {self.node_id: now})
+            pipe.zremrangebyscore(NODES_KEY, '-inf', now - self._node_timeout)
+            await pipe.execute()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(settings.WS_NODE_HEARTBEAT)
+            try:
+                await self._beat()
+            except Exception as e:
+                logger.error(f"Node {self.node_id} heartbeat failed: {e}")
+
+    @property
+    def _node_timeout(self) -> float:
+        return settings.WS_NODE_HEARTBEAT * 3
+
+    async def live_nodes(self, refresh: bool = False) -> set[str]:
+        now = time.time()
+        if refresh or now - self._live_nodes_at > settings.WS_NODE_HEARTBEAT:
+            nodes = await self.redis.zrangebyscore(
+                NODES_KEY, now - self._node_timeout, '+inf')
+            self._live_nodes = {node.decode() for node in nodes}
+            self._live_nodes_at = now
+        return self._live_nodes
+
+    async def register(self, user_id: int) -> None:
+        self._local_users[user_id] += 1
+        await self.redis.hincrby(_user_nodes_key(user_id), self.node_id, 1)
+
+    async def unregister(self, user_id: int) -> int:
+        """Returns the number of nodes still registered for user_id."""
+        self._local_users[user_id] -= 1
+        if self._local_users[user_id] <= 0:
+            del self._local_users[user_id]
+        return await self._unregister(keys=[_user_nodes_key(user_id)], args=[self.node_id])
+
+    async def nodes_for(self, user_ids: Iterable[int]) -> set[str]:
+        """Live nodes holding at least one socket of user_ids."""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.hkeys(_user_nodes_key(user_id))
+            per_user = await pipe.execute()
+        registered = [
+            (user_id, node.decode())
+            for user_id, user_nodes in zip(user_ids, per_user)
+            for node in user_nodes
+        ]
+        live = await self.live_nodes()
+        if any(node not in live for _, node in registered):
+            # a node started after the cached list was read
+            live = await self.live_nodes(refresh=True)
+        nodes = {node for _, node in registered if node in live}
+        dead = [(user_id, node) for user_id, node in registered if node not in live]
+        if dead:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for user_id, node in dead:
+                    pipe.hdel(_user_nodes_key(user_id), node)
+                await pipe.execute()
+        return nodes
@@ -1,11 +1,16 @@
+import asyncio
 from datetime import datetime, timedelta, timezone
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 import jwt
 from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
 
 from app.core.config import settings
 
+if TYPE_CHECKING:
+    from app.core.hashing import PasswordHasher
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
@@ -26,3 +31,65 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+def get_password_hashes(passwords: list[str]) -> list[str]:
+    return [pwd_context.hash(password) for password in passwords]
+
+
+# bcrypt takes ~100ms of CPU, async callers must not run it on the event
+# loop. The app installs a PasswordHasher (process pool) at startup, scripts
+# and tests without one fall back to the threadpool.
+_hasher: "PasswordHasher | None" = None
+
+
+def use_hasher(hasher: "PasswordHasher | None") -> None:
+    global _hasher
+    _hasher = hasher
+
+
+async def _run(func, *args, client: str | None = None):
+    if _hasher is None:
+        return await run_in_threadpool(func, *args)
+    return await _hasher.run(func, *args, client=client)
+
+
+async def verify_password_async(
+    plain_password: str, hashed_password: str, *, client: str | None = None
+) -> bool:
+    """client: caller identity (IP) for the per-client admission limit."""
+    return await _run(verify_password, plain_password, hashed_password, client=client)
+
+
+async def get_password_hash_async(password: str, *, client: str | None = None) -> str:
+    return await _run(get_password_hash, password, client=client)
+
+
+async def get_password_hashes_async(passwords: list[str]) -> list[str]:
+    """
+    Hashes for a bulk import, in slices of USER_IMPORT_HASH_BATCH spread
+    over the pool. At most one slice per worker is queued at a time, so a
+    login waits behind one slice at worst instead of the whole import.
+    """
+    batch = settings.USER_IMPORT_HASH_BATCH
+    slices = [passwords[i:i + batch] for i in range(0, len(passwords), batch)]
+    if _hasher is None:
+        results = [await run_in_threadpool(get_password_hashes, part) for part in slices]
+    else:
+        semaphore = asyncio.Semaphore(_hasher.workers)
+
+        async def hash_slice(part: list[str]) -> list[str]:
+            async with semaphore:
+                return await _hasher.run(get_password_hashes, part, timeout=None)
+
+        tasks = [asyncio.ensure_future(hash_slice(part)) for part in slices]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # a refused slice ends the import, the others must not go on
+            # taking the pool from logins
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    return [hashed for part in results for hashed in part]
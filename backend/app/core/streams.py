@@ -0,0 +1,187 @@
+import json
+from typing import Iterable
+
+from redis.asyncio import Redis
+
+from app.core.config import settings
+from app.core.routing import NodeRegistry, node_channel, node_frame
+
+# XADD and PUBLISH are atomic together, so the order of a channel's live
+# messages always matches the order of its stream. The live copy carries
+# the entry id, spliced in front of the payload's first key. In 'node'
+# mode it is published as node frames on the node channels in ARGV[6:].
+_PUBLISH_SCRIPT = """
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[2], '*', 'd', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+local frame = '{"stream_id":"' .. id .. '","stream":"' .. ARGV[4] .. '",' .. string.sub(ARGV[1], 2)
+if ARGV[5] == 'node' then
+    for i = 6, #ARGV do
+        redis.call('PUBLISH', ARGV[i], ARGV[4] .. '\\n' .. frame)
+    end
+else
+    redis.call('PUBLISH', ARGV[4], frame)
+end
+return id
+"""
+_STAMP_PREFIX = '{"stream_id":"'
+
+
+def stream_key(channel: str) -> str:
+    return f'stream:{channel}'
+
+
+def stream_id_key(stream_id: str) -> tuple[int, int]:
+    ms, _, seq = stream_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+def as_object(payload: str) -> str:
+    """
+    A JSON object payload, NotifyMsg is published as a JSON encoded string
+    and is decoded once here so the stream id can be added to it.
+    """
+    data = json.loads(payload)
+    if isinstance(data, str):
+        return data
+    return payload
+
+
+def stamp(payload: str, channel: str, stream_id: str) -> str:
+    """Same frame as the live copy published by _PUBLISH_SCRIPT."""
+    return f'{_STAMP_PREFIX}{stream_id}","stream":"{channel}",{payload[1:]}'
+
+
+def parse_stamp(frame: str) -> tuple[str, str] | None:
+    """(channel, stream_id) of a stamped frame without decoding the payload."""
+    if not frame.startswith(_STAMP_PREFIX):
+        return None
+    id_end = frame.index('"', len(_STAMP_PREFIX))
+    channel_start = id_end + len('","stream":"')
+    channel_end = frame.index('"', channel_start)
+    return frame[channel_start:channel_end], frame[len(_STAMP_PREFIX):id_end]
+
+
+class MessageTransport:
+    """
+    Publishes socket payloads to their Redis channel.
+
+    pubsub: plain PUBLISH, a socket that is not subscribed at that moment
+    never sees the payload.
+    streams: every channel also has a capped stream; live payloads carry
+    "stream" and "stream_id", and a reconnecting socket replays the gap
+    after the last id it has seen (see replay()).
+
+    With WS_ROUTING=node and the recipients known, the live payload goes to
+    the channels of the nodes holding their sockets instead of the chat
+    channel.
+
+    Ephemeral payloads (typing indicators) are published live only, in
+    both modes: they are never added to the stream and are not replayed.
+    """
+
+    def __init__(
+        self,
+        redis_client: Redis,
+        mode: str | None = None,
+        registry: NodeRegistry | None = None,
+        routing: str | None = None,
+    ):
+        self.redis = redis_client
+        self.mode = mode or settings.WS_TRANSPORT
+        self.registry = registry
+        self.routing = routing or settings.WS_ROUTING
+        self._publish = self.redis.register_script(_PUBLISH_SCRIPT)
+
+    @property
+    def resumable(self) -> bool:
+        return self.mode == 'streams'
+
+    async def publish(
+        self,
+        channel: str,
+        payload: str,
+        *,
+        recipients: Iterable[int] | None = None,
+        ephemeral: bool = False,
+        client=None,
+    ):
+        """
+        recipients: user ids subscribed to channel, needed for node routing.
+        ephemeral: skip the stream, live subscribers only.
+        client: a pipeline to queue the publish on, defaults to the client.
+        """
+        client = client or self.redis
+        nodes = None
+        if self.routing == 'node' and self.registry and recipients is not None:
+            nodes = await self.registry.nodes_for(recipients)
+
+        if self.resumable and not ephemeral:
+            return await self._publish(
+                keys=[stream_key(channel)],
+                args=[
+                    as_object(payload),
+                    settings.WS_STREAM_MAXLEN,
+                    settings.WS_STREAM_TTL,
+                    channel,
+                    'broadcast' if nodes is None else 'node',
+                    *(node_channel(node) for node in sorted(nodes or ())),
+                ],
+                client=client,
+            )
+        if nodes is None:
+            return await client.publish(channel, payload)
+        frame = node_frame(channel, payload)
+        for node in nodes:
+            await client.publish(node_channel(node), frame)
+        return len(nodes)
+
+    async def replay(self, channel: str, last_id: str, limit: int | None = None) -> tuple[list[str], bool]:
+        """
+        Stamped frames published on channel after last_id, oldest first.
+        The flag is False when the gap can't be replayed in full: entries
+        were trimmed (or the stream expired) or there are more than limit
+        of them. The client has to reload history then.
+        """
+        limit = limit or settings.WS_STREAM_REPLAY_LIMIT
+        key = stream_key(channel)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xrange(key, '-', '+', count=1)
+            pipe.xrange(key, f'({last_id}', '+', count=limit + 1)
+            first, entries = await pipe.execute()
+
+        complete = bool(first) and stream_id_key(first[0][0].decode()) <= stream_id_key(last_id)
+        if len(entries) > limit:
+            entries = entries[:limit]
+            complete = False
+        frames = [
+            stamp(fields[b'd'].decode(), channel, entry_id.decode())
+            for entry_id, fields in entries
+        ]
+        return frames, complete
+
+
+class ReplayFilter:
+    """
+    Drops live frames already sent by a replay: per channel, everything up
+    to the last replayed id. A channel is forgotten at its first newer
+    frame, live frames of a channel arrive in stream order.
+    """
+
+    def __init__(self):
+        self._replayed: dict[str, tuple[int, int]] = {}
+
+    def replayed(self, channel: str, frames: list[str]) -> None:
+        if frames:
+            self._replayed[channel] = stream_id_key(parse_stamp(frames[-1])[1])
+
+    def allows(self, frame: str) -> bool:
+        if not self._replayed:
+            return True
+        stamped = parse_stamp(frame)
+        if stamped is None or stamped[0] not in self._replayed:
+            return True
+        channel, stream_id = stamped
+        if stream_id_key(stream_id) <= self._replayed[channel]:
+            return False
+        del self._replayed[channel]
+        return True
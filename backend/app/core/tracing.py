@@ -0,0 +1,116 @@
+import itertools
+import json
+import logging
+import time
+
+from app.core.config import settings
+from app.core.metrics import REGISTRY
+from app.core.streams import stream_id_key
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_STAGE_SECONDS = REGISTRY.histogram(
+    'ws_message_stage_seconds',
+    'Chat message latency per stage: parse, resolve, persist, publish on the '
+    'sending worker; fanout, queue, send on the delivering one',
+    ('stage',))
+MESSAGE_E2E_SECONDS = REGISTRY.histogram(
+    'ws_message_e2e_seconds', 'From receive on the sender socket to the end of the socket write')
+
+# Appended as the last key of a published chat message, split_trace()
+# cuts it off again before the payload reaches the client.
+_TRACE_KEY = ',"_trace":'
+_sequence = itertools.count()
+_stages = {}
+
+
+def _stage(name: str):
+    child = _stages.get(name)
+    if child is None:
+        child = _stages[name] = MESSAGE_STAGE_SECONDS.labels(name)
+    return child
+
+
+class MessageTrace:
+    """
+    Timeline of one chat message on the sending worker.
+
+    Stages are measured with perf_counter. The trace travels inside the
+    published payload with wall clock anchors (received_at, published_at),
+    so the delivering worker can add the cross-process stages; those are
+    only as accurate as the clock sync between the hosts. The publish stage
+    ends after the trace is sent, see record_delivery.
+    """
+
+    __slots__ = ('received_at', 'stages', '_last')
+
+    def __init__(self):
+        self.received_at = time.time()
+        self._last = time.perf_counter()
+        self.stages: dict[str, float] = {}
+
+    def mark(self, stage: str) -> None:
+        """End of stage, which started at the previous mark (or receive)."""
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self.stages[stage] = elapsed
+        _stage(stage).observe(elapsed)
+
+    def attach(self, payload: str, message_id: int) -> str:
+        """payload (a JSON object) with the trace as its last key, stamped as published now."""
+        rate = settings.WS_TRACE_SAMPLE_RATE
+        trace = json.dumps({
+            'id': message_id,
+            'sampled': rate > 0 and next(_sequence) % rate == 0,
+            'received_at': self.received_at,
+            'published_at': time.time(),
+            'stages': self.stages,
+        }, separators=(',', ':'))
+        return f'{payload[:-1]}{_TRACE_KEY}{trace}}}'
+
+
+def split_trace(payload: str) -> tuple[str, dict | None]:
+    """(payload without the trace, trace) of a delivered payload."""
+    index = payload.rfind(_TRACE_KEY)
+    if index < 0:
+        return payload, None
+    try:
+        trace = json.loads(payload[index + len(_TRACE_KEY):-1])
+    except ValueError:
+        return payload, None
+    return payload[:index] + '}', trace
+
+
+def record_delivery(trace: dict, enqueued_at: float, send_started_at: float,
+                    send_seconds: float, stream_id: str | None = None, **context) -> None:
+    """
+    Delivering side of a trace: enqueued_at/send_started_at are wall clock
+    times of the hub putting the payload into the socket queue and of the
+    socket write starting. stream_id (streams transport) dates the end of
+    the publish call, which goes into the logged timeline (the sending
+    worker observes the stage itself); without it fanout includes it.
+    """
+    published_at = trace['published_at']
+    publish = None
+    if stream_id:
+        stored_at = max(stream_id_key(stream_id)[0] / 1000, published_at)
+        publish = stored_at - published_at
+        published_at = stored_at
+    fanout = max(enqueued_at - published_at, 0.0)
+    queue = max(send_started_at - enqueued_at, 0.0)
+    e2e = max(send_started_at + send_seconds - trace['received_at'], 0.0)
+    _stage('fanout').observe(fanout)
+    _stage('queue').observe(queue)
+    _stage('send').observe(send_seconds)
+    MESSAGE_E2E_SECONDS.observe(e2e)
+    if trace.get('sampled'):
+        timeline = dict(trace['stages'])
+        if publish is not None:
+            timeline['publish'] = publish
+        timeline.update(fanout=fanout, queue=queue, send=send_seconds)
+        logger.info(
+            f"Message trace {trace['id']}: e2e {e2e * 1000:.2f}ms | "
+            + ' '.join(f'{stage}={seconds * 1000:.2f}ms' for stage, seconds in timeline.items())
+            + f" | context: {context}"
+        )
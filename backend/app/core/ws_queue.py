@@ -0,0 +1,173 @@
+import asyncio
+import json
+import time
+import weakref
+from collections import deque
+from typing import Any
+
+from app.core.config import settings
+from app.core.metrics import REGISTRY, WS_QUEUE_COALESCED, WS_QUEUE_DROPPED
+
+_NO_KEY = object()
+_live_queues: "weakref.WeakSet[OutboundQueue]" = weakref.WeakSet()
+
+
+class SlowConsumerError(Exception):
+    def __init__(self, close_code: int):
+        super().__init__(f'Outbound queue overflow, closing with {close_code}')
+        self.close_code = close_code
+
+
+# replies to a request of the client, each one answers a different request
+_REPLIES = frozenset({'PONG', 'RESYNC'})
+
+
+def _reader_id(meta: dict) -> Any:
+    """id of meta_data.who_read, a UserShort published as JSON."""
+    who_read = meta.get('who_read')
+    if isinstance(who_read, str):
+        try:
+            who_read = json.loads(who_read)
+        except ValueError:
+            return who_read
+    return who_read.get('id') if isinstance(who_read, dict) else who_read
+
+
+def coalesce_key(payload: str) -> str | None:
+    """
+    Key of payloads that supersede each other (notifications about the
+    same object). Chat messages, replies and notifications that name no
+    object have no key and are never merged.
+    """
+    try:
+        data = json.loads(payload)
+        # NotifyMsg is published as a JSON encoded string
+        if isinstance(data, str):
+            data = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or 'type' not in data or data['type'] in _REPLIES:
+        return None
+    meta = data.get('meta_data') or {}
+    ref = meta.get('msg_id') or meta.get('chat_id') or meta.get('user_id')
+    if ref is None:
+        # e.g. the PRESENCE reply to a query
+        return None
+    if data['type'] == 'MSG_READ':
+        # receipts of different readers all reach the sender
+        return f"MSG_READ:{ref}:{_reader_id(meta)}"
+    return f"{data['type']}:{ref}"
+
+
+class OutboundQueue:
+    """
+    Bounded per-socket send queue.
+
+    When full, the policy decides what happens to the new payload:
+    drop_oldest - evict the oldest queued payload;
+    coalesce - replace a queued payload with the same coalesce_key,
+               otherwise evict the oldest one;
+    disconnect - discard the queue, get() raises SlowConsumerError.
+    """
+
+    def __init__(
+        self,
+        maxsize: int | None = None,
+        policy: str | None = None,
+        close_code: int | None = None,
+        **labels: Any,
+    ):
+        self.maxsize = maxsize or settings.WS_SEND_QUEUE_MAXSIZE
+        self.policy = policy or settings.WS_SLOW_CONSUMER_POLICY
+        self.close_code = close_code or settings.WS_SLOW_CONSUMER_CLOSE_CODE
+        self.labels = labels
+        self._items: deque[list] = deque()
+        self._not_empty = asyncio.Event()
+        self.overflowed = False
+        self.max_depth = 0
+        self.enqueued = 0
+        self.dropped = 0
+        self.coalesced = 0
+        # wall clock time the payload returned by the last get() was queued at
+        self.last_enqueued_at = 0.0
+        _live_queues.add(self)
+
+    def qsize(self) -> int:
+        return len(self._items)
+
+    def _coalesce(self, payload: str) -> bool:
+        key = coalesce_key(payload)
+        if key is None:
+            return False
+        for entry in reversed(self._items):
+            if entry[1] is _NO_KEY:
+                entry[1] = coalesce_key(entry[0])
+            if entry[1] == key:
+                entry[0] = payload
+                return True
+        return False
+
+    def put_nowait(self, payload: str) -> None:
+        if self.overflowed:
+            self.dropped += 1
+            WS_QUEUE_DROPPED.inc()
+            return
+        self.enqueued += 1
+        if len(self._items) >= self.maxsize:
+            if self.policy == 'disconnect':
+                self.overflowed = True
+                self.dropped += len(self._items) + 1
+                WS_QUEUE_DROPPED.inc(len(self._items) + 1)
+                self._items.clear()
+                self._not_empty.set()
+                return
+            if self.policy == 'coalesce' and self._coalesce(payload):
+                self.coalesced += 1
+                WS_QUEUE_COALESCED.inc()
+                return
+            self._items.popleft()
+            self.dropped += 1
+            WS_QUEUE_DROPPED.inc()
+        self._items.append([payload, _NO_KEY, time.time()])
+        self.max_depth = max(self.max_depth, len(self._items))
+        self._not_empty.set()
+
+    async def get(self) -> str:
+        while not self._items:
+            if self.overflowed:
+                raise SlowConsumerError(self.close_code)
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        if self.overflowed:
+            raise SlowConsumerError(self.close_code)
+        payload, _, self.last_enqueued_at = self._items.popleft()
+        return payload
+
+    def stats(self) -> dict:
+        return {
+            **self.labels,
+            'depth': len(self._items),
+            'max_depth': self.max_depth,
+            'maxsize': self.maxsize,
+            'policy': self.policy,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'overflowed': self.overflowed,
+        }
+
+
+def live_queues() -> list[OutboundQueue]:
+    return list(_live_queues)
+
+
+REGISTRY.gauge(
+    'ws_open_sockets', 'Sockets with an outbound queue on this worker',
+    callback=lambda: len(_live_queues))
+REGISTRY.gauge(
+    'ws_send_queue_depth', 'Payloads waiting in outbound queues, total and of the fullest queue',
+    ('stat',),
+    callback=lambda: {
+        'total': sum(queue.qsize() for queue in live_queues()),
+        'max': max((queue.qsize() for queue in live_queues()), default=0),
+    })
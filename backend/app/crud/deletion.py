@@ -0,0 +1,255 @@
+from datetime import datetime
+
+from sqlalchemy import Integer, bindparam, delete, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
+
+from app.models import Chats, MessageArchive, MessageArchiveSender, UserChatParticipant, Users
+from app.models.chatmsg import CHAT_PREVIEW_LENGTH
+
+# Batches run on an autocommit session: every statement is a transaction
+# of its own, so locks are held for a single batch. Rows of message and
+# message_read are matched on their partition key too, so a batch only
+# touches the months it has rows in. The message_dedupe rows of deleted
+# messages go with them.
+
+_CHAT_MESSAGES_BATCH = text("""
+    WITH batch AS (
+        SELECT id, created_at FROM message
+        WHERE chat_id = :chat_id AND (created_at, id) > (:after_at, :after_id)
+        ORDER BY created_at, id
+        LIMIT :batch_size
+    ),
+    gone AS (
+        DELETE FROM message m USING batch b
+        WHERE m.id = b.id AND m.created_at = b.created_at
+        RETURNING m.message_uuid
+    ),
+    dedupe AS (
+        DELETE FROM message_dedupe d USING gone g WHERE d.message_uuid = g.message_uuid
+    )
+    SELECT (SELECT count(*) FROM gone), b.created_at, b.id
+    FROM batch b
+    ORDER BY b.created_at DESC, b.id DESC
+    LIMIT 1
+""")
+
+# read_count of the other participants loses the deleted messages they had
+# read: per message_read row, or below their watermark
+_READS_OF_BATCH = {
+    'rows': """
+        DELETE FROM message_read r USING batch b
+        WHERE r.message_id = b.id AND r.message_created_at = b.created_at
+        RETURNING b.chat_id, r.user_id
+    """,
+    'watermark': """
+        SELECT b.chat_id, p.user_id FROM batch b
+        JOIN user_chat_participants p
+          ON p.chat_id = b.chat_id AND b.id <= p.last_read_message_id
+        WHERE p.user_id <> :user_id
+    """,
+}
+
+_USER_MESSAGES_BATCH = """
+    WITH batch AS (
+        SELECT id, chat_id, created_at FROM message
+        WHERE sender_id = :user_id AND id > :after_id
+        ORDER BY id
+        LIMIT :batch_size
+    ),
+    reads AS ({reads}),
+    read_fix AS (
+        UPDATE user_chat_participants p
+        SET read_count = greatest(p.read_count - x.n, 0)
+        FROM (SELECT chat_id, user_id, count(*) AS n FROM reads GROUP BY chat_id, user_id) x
+        WHERE p.chat_id = x.chat_id AND p.user_id = x.user_id
+    ),
+    gone AS (
+        DELETE FROM message m USING batch b
+        WHERE m.id = b.id AND m.created_at = b.created_at
+        RETURNING m.chat_id, m.message_uuid
+    ),
+    dedupe AS (
+        DELETE FROM message_dedupe d USING gone g WHERE d.message_uuid = g.message_uuid
+    ),
+    chat_fix AS (
+        UPDATE chats c
+        SET message_count = greatest(c.message_count - g.n, 0)
+        FROM (SELECT chat_id, count(*) AS n FROM gone GROUP BY chat_id) g
+        WHERE c.id = g.chat_id
+        RETURNING c.id
+    )
+    SELECT
+        (SELECT count(*) FROM gone),
+        (SELECT max(id) FROM batch),
+        (SELECT coalesce(array_agg(id), '{{}}') FROM chat_fix)
+"""
+
+_USER_READS_BATCH = text("""
+    WITH batch AS (
+        SELECT message_id, message_created_at FROM message_read
+        WHERE user_id = :user_id AND message_id > :after_id
+        ORDER BY message_id
+        LIMIT :batch_size
+    ),
+    gone AS (
+        DELETE FROM message_read r USING batch b
+        WHERE r.user_id = :user_id AND r.message_id = b.message_id
+          AND r.message_created_at = b.message_created_at
+        RETURNING r.message_id
+    )
+    SELECT count(*), max(message_id) FROM gone
+""")
+
+_LAST_MESSAGE_FIX = text(f"""
+    UPDATE chats c
+    SET last_message_id = m.id,
+        last_message_at = m.created_at,
+        last_message_sender_id = m.sender_id,
+        last_message_preview = left(m.content, {CHAT_PREVIEW_LENGTH})
+    FROM chats c2
+    LEFT JOIN LATERAL (
+        SELECT id, created_at, sender_id, content FROM message
+        WHERE chat_id = c2.id
+        ORDER BY created_at DESC, id DESC
+        LIMIT 1
+    ) m ON true
+    WHERE c.id = c2.id AND c.id = ANY(:chat_ids) AND c.last_message_sender_id = :user_id
+""").bindparams(bindparam('chat_ids', type_=ARRAY(Integer)))
+
+_USER_MEMBERSHIPS = text("""
+    WITH gone AS (
+        DELETE FROM user_chat_participants WHERE user_id = :user_id RETURNING chat_id
+    )
+    UPDATE chats c
+    SET member_count = greatest(c.member_count - 1, 0)
+    FROM gone
+    WHERE c.id = gone.chat_id
+    RETURNING c.id
+""")
+
+
+async def mark_chat_deleted(*, async_session: AsyncSession, chat: Chats) -> list[int]:
+    """
+    Flags chat deleted and removes its participants, so it leaves every
+    inbox and membership check right away; a direct chat also releases its
+    pair and name. Returns the former member ids. The caller commits.
+    """
+    member_ids = (await async_session.execute(
+        delete(UserChatParticipant)
+        .where(UserChatParticipant.chat_id == chat.id)
+        .returning(UserChatParticipant.user_id)
+    )).scalars().all()
+    chat.deleted_at = datetime.now()
+    chat.member_count = 0
+    if not chat.is_group:
+        chat.direct_user_lo = chat.direct_user_hi = None
+        chat.name = None
+    async_session.add(chat)
+    return list(member_ids)
+
+
+async def mark_user_deleted(
+    *, async_session: AsyncSession, user: Users
+) -> list[tuple[Chats, list[int]]]:
+    """
+    Flags user deleted and inactive, together with the chats it owns.
+    Commits; returns (owned chat, its former member ids) pairs.
+    """
+    owned = (await async_session.execute(
+        select(Chats).where(Chats.owner_id == user.id, Chats.deleted_at.is_(None))
+    )).scalars().all()
+    chats = [
+        (chat, await mark_chat_deleted(async_session=async_session, chat=chat))
+        for chat in owned
+    ]
+    user.deleted_at = datetime.now()
+    user.is_active = False
+    async_session.add(user)
+    await async_session.commit()
+    return chats
+
+
+async def get_deleted_chat_ids(*, async_session: AsyncSession, owner_id: int) -> list[int]:
+    return list((await async_session.execute(
+        select(Chats.id).where(Chats.owner_id == owner_id, Chats.deleted_at.is_not(None))
+    )).scalars().all())
+
+
+async def delete_chat_messages_batch(
+    *, async_session: AsyncSession, chat_id: int, after: tuple[datetime, int], batch_size: int
+) -> tuple[int, tuple[datetime, int] | None]:
+    """
+    Deletes the next batch_size messages of chat_id in (created_at, id)
+    order, their reads go by cascade. Returns (deleted, cursor of the next
+    batch), the cursor is None once the chat has no messages left.
+    """
+    row = (await async_session.execute(_CHAT_MESSAGES_BATCH, {
+        'chat_id': chat_id,
+        'after_at': after[0],
+        'after_id': after[1],
+        'batch_size': batch_size,
+    })).first()
+    if row is None:
+        return 0, None
+    return row[0], (row[1], row[2])
+
+
+async def delete_user_messages_batch(
+    *, async_session: AsyncSession, user_id: int, after_id: int, batch_size: int,
+    read_tracking_mode: str,
+) -> tuple[int, int | None, list[int]]:
+    """
+    Deletes the next batch_size messages sent by user_id in id order and
+    takes them out of the chats' message_count and the readers' read_count.
+    Returns (deleted, last id or None when done, ids of the touched chats).
+    """
+    statement = text(_USER_MESSAGES_BATCH.format(reads=_READS_OF_BATCH[read_tracking_mode]))
+    deleted, last_id, chat_ids = (await async_session.execute(statement, {
+        'user_id': user_id,
+        'after_id': after_id,
+        'batch_size': batch_size,
+    })).one()
+    return deleted, last_id, list(chat_ids)
+
+
+async def fix_last_messages(*, async_session: AsyncSession, user_id: int, chat_ids: list[int]) -> None:
+    """Inbox previews of chat_ids that still point at a deleted message of user_id."""
+    await async_session.execute(_LAST_MESSAGE_FIX, {'user_id': user_id, 'chat_ids': chat_ids})
+
+
+async def delete_user_reads_batch(
+    *, async_session: AsyncSession, user_id: int, after_id: int, batch_size: int
+) -> tuple[int, int | None]:
+    deleted, last_id = (await async_session.execute(_USER_READS_BATCH, {
+        'user_id': user_id,
+        'after_id': after_id,
+        'batch_size': batch_size,
+    })).one()
+    return deleted, last_id
+
+
+async def delete_user_memberships(*, async_session: AsyncSession, user_id: int) -> list[int]:
+    """Removes user_id from its chats, returns their ids."""
+    return list((await async_session.execute(
+        _USER_MEMBERSHIPS, {'user_id': user_id})).scalars().all())
+
+
+async def delete_chat_row(*, async_session: AsyncSession, chat_id: int) -> None:
+    """
+    The chat and its message_archive rows. Its lines stay in the archive
+    files, shared by every chat of the month, but nothing points at them.
+    """
+    await async_session.execute(delete(MessageArchiveSender).where(MessageArchiveSender.chat_id == chat_id))
+    await async_session.execute(delete(MessageArchive).where(MessageArchive.chat_id == chat_id))
+    await async_session.execute(delete(Chats).where(Chats.id == chat_id))
+
+
+async def delete_user_row(*, async_session: AsyncSession, user_id: int) -> None:
+    """
+    The user and its message_archive_sender rows. Its archived messages
+    stay in the archive files, the history leaves out senders that are gone.
+    """
+    await async_session.execute(delete(MessageArchiveSender).where(MessageArchiveSender.sender_id == user_id))
+    await async_session.execute(delete(Users).where(Users.id == user_id))
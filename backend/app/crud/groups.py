@@ -1,8 +1,11 @@
+from datetime import datetime
 from uuid import UUID
-from app.models.chatmsg import Chats, UserChatParticipant
+from app.models.chatmsg import CHAT_PREVIEW_LENGTH, Chats, UserChatParticipant
 from app.models.users import Users
-from sqlalchemy import and_, func
-from sqlmodel import select
+from sqlalchemy import case, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import aliased
+from sqlmodel import select, update
 from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import subqueryload
@@ -83,21 +86,29 @@ async def get_chat_from_uuid(
 
 async def count_users_by_ids(*, async_session: AsyncSession, user_ids: list[int]) -> int:
     return (await async_session.execute(
-        select(func.count()).where(Users.id.in_(user_ids))
+        select(func.count()).where(Users.id.in_(user_ids), Users.deleted_at.is_(None))
     )).scalar()
 
 
+def direct_pair(user_1_id: int, user_2_id: int) -> tuple[int, int]:
+    return min(user_1_id, user_2_id), max(user_1_id, user_2_id)
+
+
 async def create_group(
         *,
         async_session: AsyncSession,
         chat_name: str,
         is_group: bool,
         owner_id: int,
+        direct_user_ids: tuple[int, int] | None = None,
 ) -> Chats:
+    lo, hi = direct_pair(*direct_user_ids) if direct_user_ids else (None, None)
     new_group = Chats(
         name=chat_name,
         is_group=is_group,
         owner_id=owner_id,
+        direct_user_lo=lo,
+        direct_user_hi=hi,
     )
     async_session.add(new_group)
     await async_session.commit()
@@ -114,28 +125,86 @@ async def add_participant_to_group(
     for user_id in user_ids:
         participant = UserChatParticipant(chat_id=group_id, user_id=user_id)
         async_session.add(participant)
+    await async_session.execute(
+        update(Chats)
+        .where(Chats.id == group_id)
+        .values(member_count=Chats.member_count + len(user_ids))
+    )
     await async_session.commit()
 
 
+async def add_participants_bulk(
+    *,
+    async_session: AsyncSession,
+    chat_ids: list[int],
+    user_ids: list[int],
+) -> int:
+    """
+    Every user_id joins every chat_id in a single statement, existing
+    memberships are left alone. member_count follows the rows actually
+    inserted. Returns their number; the caller commits.
+    """
+    now = datetime.now()
+    inserted = (
+        pg_insert(UserChatParticipant)
+        .values([
+            {'chat_id': chat_id, 'user_id': user_id, 'created_at': now, 'updated_at': now}
+            for chat_id in chat_ids
+            for user_id in user_ids
+        ])
+        .on_conflict_do_nothing(index_elements=['chat_id', 'user_id'])
+        .returning(UserChatParticipant.chat_id)
+        .cte('inserted')
+    )
+    added = (
+        select(inserted.c.chat_id, func.count().label('added'))
+        .group_by(inserted.c.chat_id)
+        .cte('added')
+    )
+    counted = (
+        update(Chats)
+        .where(Chats.id == added.c.chat_id)
+        .values(member_count=Chats.member_count + added.c.added)
+        .returning(added.c.added)
+    )
+    return sum((await async_session.execute(counted)).scalars().all())
+
+
+async def get_group_ids(*, async_session: AsyncSession, chat_ids: list[int]) -> set[int]:
+    statement = select(Chats.id).where(Chats.id.in_(chat_ids), Chats.is_group == True)
+    return set((await async_session.execute(statement)).scalars().all())
+
+
+def direct_chat_statement(*, user_1_id: int, user_2_id: int, only_id: bool = False):
+    lo, hi = direct_pair(user_1_id, user_2_id)
+    return (
+        select(Chats.id if only_id else Chats)
+        .where(
+            Chats.direct_user_lo == lo,
+            Chats.direct_user_hi == hi,
+            Chats.is_group == False,
+        )
+    )
+
+
 async def find_lc_group(
     *,
     async_session: AsyncSession,
     user_1_id: int,
     user_2_id: int,
 ) -> Chats | None:
-    state = (
-        select(Chats)
-        .join(UserChatParticipant)
-        .group_by(Chats.id)
-        .having(
-            and_(
-                func.count(UserChatParticipant.user_id) == 2,
-                func.bool_and(UserChatParticipant.user_id.in_(
-                    [user_1_id, user_2_id])),
-                Chats.is_group == False
-            )
-        )
-    )
+    state = direct_chat_statement(user_1_id=user_1_id, user_2_id=user_2_id)
+    return (await async_session.execute(state)).scalars().first()
+
+
+async def find_lc_group_id(
+    *,
+    async_session: AsyncSession,
+    user_1_id: int,
+    user_2_id: int,
+) -> int | None:
+    state = direct_chat_statement(
+        user_1_id=user_1_id, user_2_id=user_2_id, only_id=True)
     return (await async_session.execute(state)).scalars().first()
 
 
@@ -150,6 +219,15 @@ async def get_user_participant_chat(*, async_session: AsyncSession, user_id: int
     ).scalars().first()
 
 
+async def get_chat_member_ids(*, async_session: AsyncSession, chat_id: int) -> list[int]:
+    return (
+        await async_session.execute(
+            select(UserChatParticipant.user_id)
+            .where(UserChatParticipant.chat_id == chat_id)
+        )
+    ).scalars().all()
+
+
 async def get_users_groups(*, async_session: AsyncSession, user_id: int, is_group: bool = None):
     statement = (
         select(Chats)
@@ -163,3 +241,77 @@ async def get_users_groups(*, async_session: AsyncSession, user_id: int, is_grou
     if is_group is not None:
         statement = statement.where(Chats.is_group == is_group)
     return (await async_session.execute(statement)).scalars().all()
+
+
+async def get_user_inbox(*, async_session: AsyncSession, user_id: int):
+    """
+    Every chat of user_id with its summary columns, most recent activity
+    first: one query over ix_user_chat_participants_user_id and the chats
+    primary key. The peer of a direct chat is joined in as well.
+    """
+    peer = aliased(Users)
+    peer_id = case(
+        (Chats.direct_user_lo == user_id, Chats.direct_user_hi),
+        else_=Chats.direct_user_lo,
+    )
+    last_activity = func.coalesce(Chats.last_message_at, Chats.created_at)
+    statement = (
+        select(
+            Chats,
+            func.greatest(Chats.message_count - UserChatParticipant.read_count, 0),
+            last_activity,
+            peer,
+        )
+        .join(UserChatParticipant, UserChatParticipant.chat_id == Chats.id)
+        .outerjoin(peer, (peer.id == peer_id) & (Chats.is_group == False))
+        .where(UserChatParticipant.user_id == user_id)
+        .order_by(last_activity.desc(), Chats.id.desc())
+    )
+    return (await async_session.execute(statement)).all()
+
+
+def chat_summary_rebuild_statements(read_tracking_mode: str):
+    """
+    Recompute every inbox summary column from the message, participant and
+    read tables, for seeding and repairs. read_count follows the given
+    READ_TRACKING_MODE.
+    """
+    if read_tracking_mode == 'watermark':
+        is_read = 'm.id <= coalesce(p.last_read_message_id, 0)'
+    else:
+        is_read = (
+            'EXISTS (SELECT 1 FROM message_read mr '
+            'WHERE mr.message_id = m.id AND mr.user_id = p.user_id)'
+        )
+    return [
+        text(f"""
+            UPDATE chats c
+            SET message_count = coalesce(s.message_count, 0),
+                last_message_id = s.id,
+                last_message_at = s.created_at,
+                last_message_sender_id = s.sender_id,
+                last_message_preview = s.preview
+            FROM chats c2
+            LEFT JOIN (
+                SELECT DISTINCT ON (chat_id)
+                    chat_id, id, created_at, sender_id, left(content, {CHAT_PREVIEW_LENGTH}) AS preview,
+                    count(*) OVER (PARTITION BY chat_id) AS message_count
+                FROM message
+                ORDER BY chat_id, created_at DESC, id DESC
+            ) AS s ON s.chat_id = c2.id
+            WHERE c.id = c2.id
+        """),
+        text("""
+            UPDATE chats c
+            SET member_count = (
+                SELECT count(*) FROM user_chat_participants p WHERE p.chat_id = c.id)
+        """),
+        text(f"""
+            UPDATE user_chat_participants p
+            SET read_count = (
+                SELECT count(*) FROM message m
+                WHERE m.chat_id = p.chat_id
+                  AND (m.sender_id = p.user_id OR {is_read})
+            )
+        """),
+    ]
@@ -1,18 +1,42 @@
+import asyncio
+import uuid
+from datetime import datetime
 
 from app.models.chatmsg import Message
-from fastapi import HTTPException
 
-from sqlmodel import func, select
+from sqlmodel import func, select, update
+from sqlalchemy import Integer, Row, any_, case, literal, true, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import selectinload, subqueryload
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel.sql.expression import SelectOfScalar
 
-from app.models import Chats, UserChatParticipant, Message, MessageRead
-from .groups import get_chat_from_uuid
+from app.core.config import settings
+from app.dto.chatmsg import MessagePublic
+from app.dto.users import UserShort
+from app.models import Chats, UserChatParticipant, Message, MessageDedupe, MessageRead, Users
+from app.models.chatmsg import CHAT_PREVIEW_LENGTH
+from .partitions import (
+    ArchivedMonth,
+    add_months,
+    get_archived_months,
+    month_start,
+    read_archived_messages,
+    read_archived_readers,
+)
+
+
+def use_read_watermarks() -> bool:
+    return settings.READ_TRACKING_MODE == 'watermark'
 
 
 def add_FK_for_msg(state: SelectOfScalar) -> SelectOfScalar:
-    return state.options(selectinload(Message.chat), selectinload(Message.sender), subqueryload(Message.read_by_users))
+    state = state.options(selectinload(Message.chat), selectinload(Message.sender))
+    if use_read_watermarks():
+        # read state is derived from UserChatParticipant.last_read_message_id
+        return state
+    return state.options(subqueryload(Message.read_by_users))
 
 
 async def get_msg_by_id(
@@ -39,81 +63,304 @@ async def get_msg_by_uuid(
     return (await async_session.execute(state)).scalars().first()
 
 
-async def create_lc_msg(*, async_session: AsyncSession, sender_id, receiver_id, message: str) -> Message:
-    chat_id = (await async_session.execute(
-        select(Chats.id)
-        .join(UserChatParticipant)
-        .where(
-            Chats.is_group == False,
-            UserChatParticipant.user_id.in_([sender_id, receiver_id])
-        )
-        .group_by(Chats.id)
-        .having(func.count(UserChatParticipant.user_id) == 2)
-    )).scalars().first()
+async def insert_msg(
+    *,
+    async_session: AsyncSession,
+    chat_id: int | SelectOfScalar,
+    sender_id: int,
+    message: str,
+    message_uuid: str | uuid.UUID | None = None,
+) -> Row | None:
+    """
+    Idempotent insert in a single statement.
 
-    if not chat_id:
-        raise HTTPException(
-            detail=f'LC-Chat not found for Users: {sender_id, receiver_id}',
-            status_code=400,
+    chat_id is either a known id or a select resolving it (the sender's
+    membership can be enforced there). Returns (id, chat_id, message_uuid,
+    created_at, updated_at) of the new row, or None when message_uuid already
+    exists or the chat select matched nothing.
+    message_uuid is claimed in MessageDedupe first, the partitioned message
+    table can't hold a unique index on it.
+    The chat's inbox summary and the sender's read_count are updated by
+    the same statement.
+    """
+    now = datetime.now()
+    if message_uuid is None:
+        message_uuid = uuid.uuid4()
+    elif not isinstance(message_uuid, uuid.UUID):
+        message_uuid = uuid.UUID(message_uuid)
+    if not isinstance(chat_id, SelectOfScalar):
+        chat_id = select(literal(chat_id))
+    chat = chat_id.subquery('chat')
+    target = select(list(chat.c)[0].label('chat_id')).cte('target')
+    claimed = (
+        pg_insert(MessageDedupe)
+        .from_select(
+            ['message_uuid', 'message_id', 'created_at'],
+            select(
+                literal(message_uuid, MessageDedupe.message_uuid.type),
+                func.nextval('message_id_seq'),
+                literal(now),
+            ).select_from(target),
         )
-
-    db_obj = Message(
-        chat_id=chat_id,
-        sender_id=sender_id,
-        content=message,
+        .on_conflict_do_nothing(index_elements=['message_uuid'])
+        .returning(MessageDedupe.message_id)
+        .cte('claimed')
+    )
+    inserted = (
+        pg_insert(Message)
+        .from_select(
+            ['id', 'chat_id', 'sender_id', 'content', 'message_uuid', 'created_at', 'updated_at'],
+            select(
+                claimed.c.message_id,
+                target.c.chat_id,
+                literal(sender_id),
+                literal(message),
+                literal(message_uuid, Message.message_uuid.type),
+                literal(now),
+                literal(now),
+            ).select_from(claimed).join(target, true()),
+        )
+        .returning(
+            Message.id,
+            Message.chat_id,
+            Message.message_uuid,
+            Message.created_at,
+            Message.updated_at,
+        )
+        .cte('inserted')
+    )
+    # concurrent inserts may take the chat row lock out of id order
+    is_newest = inserted.c.id > func.coalesce(Chats.last_message_id, 0)
+    chat_summary = (
+        update(Chats)
+        .where(Chats.id == inserted.c.chat_id)
+        .values(
+            message_count=Chats.message_count + 1,
+            last_message_id=case((is_newest, inserted.c.id), else_=Chats.last_message_id),
+            last_message_at=case((is_newest, inserted.c.created_at), else_=Chats.last_message_at),
+            last_message_sender_id=case(
+                (is_newest, literal(sender_id)), else_=Chats.last_message_sender_id),
+            last_message_preview=case(
+                (is_newest, literal(message[:CHAT_PREVIEW_LENGTH])),
+                else_=Chats.last_message_preview,
+            ),
+        )
+        .cte('chat_summary')
     )
-    async_session.add(db_obj)
+    sender_read = (
+        update(UserChatParticipant)
+        .where(
+            UserChatParticipant.chat_id == inserted.c.chat_id,
+            UserChatParticipant.user_id == sender_id,
+        )
+        .values(read_count=UserChatParticipant.read_count + 1)
+        .cte('sender_read')
+    )
+    statement = select(*inserted.c).add_cte(chat_summary, sender_read)
+    row = (await async_session.execute(statement)).first()
     await async_session.commit()
-    await async_session.refresh(db_obj)
-    return db_obj
+    return row
 
 
-async def create_group_msg(*, async_session: AsyncSession, chat_uuid: str, sender_id: int, message: str) -> Message:
-    chat_id = await get_chat_from_uuid(
-        async_session=async_session,
-        chat_uuid=chat_uuid,
-        only_id=True,
-    )
-    db_obj = Message(
-        chat_id=chat_id,
-        sender_id=sender_id,
-        content=message,
+def _read_watermark(*, user_id: int, chat_id):
+    return func.coalesce(
+        select(UserChatParticipant.last_read_message_id)
+        .where(
+            UserChatParticipant.user_id == user_id,
+            UserChatParticipant.chat_id == chat_id,
+        )
+        .scalar_subquery(),
+        0,
     )
-    async_session.add(db_obj)
-    await async_session.commit()
-    await async_session.refresh(db_obj)
-    return db_obj
 
 
 async def get_unread_msg(*, async_session: AsyncSession, chat_id: int, user_id: int) -> Message:
+    if use_read_watermarks():
+        unread = Message.id > _read_watermark(user_id=user_id, chat_id=chat_id)
+    else:
+        unread = ~Message.read_by_users.any(id=user_id)
     return (await async_session.execute(
         select(Message)
         .where(
             Message.chat_id == chat_id,
             Message.sender_id != user_id,
-            ~Message.read_by_users.any(id=user_id)
+            unread,
         )
     )).scalars().all()
 
 
+def _advance_watermark(*, user_id: int, chat_id, last_read_id: int):
+    """
+    Move the watermark of (user_id, chat_id) up to last_read_id, read_count
+    grows by the other members' messages it passes over.
+    """
+    current = func.coalesce(UserChatParticipant.last_read_message_id, 0)
+    passed = (
+        select(func.count(Message.id))
+        .where(
+            Message.chat_id == UserChatParticipant.chat_id,
+            Message.id > current,
+            Message.id <= last_read_id,
+            Message.sender_id != user_id,
+        )
+        .scalar_subquery()
+    )
+    return (
+        update(UserChatParticipant)
+        .where(
+            UserChatParticipant.user_id == user_id,
+            UserChatParticipant.chat_id == chat_id,
+        )
+        .values(
+            last_read_message_id=func.greatest(current, last_read_id),
+            read_count=UserChatParticipant.read_count + passed,
+        )
+    )
+
+
+def _insert_read_rows(*, user_id: int, chat_id, msg_ids: list[int]):
+    """
+    MessageRead rows for msg_ids not read yet, with the reader's read_count
+    bumped by the number inserted and the watermark moved up to the newest
+    of them, so switching to watermark mode needs no conversion.
+    Selects the inserted message ids.
+    """
+    now = datetime.now()
+    marked = (
+        pg_insert(MessageRead)
+        .from_select(
+            ['message_id', 'message_created_at', 'user_id', 'created_at', 'updated_at'],
+            select(Message.id, Message.created_at, literal(user_id), literal(now), literal(now))
+            .where(
+                Message.chat_id == chat_id,
+                # a single array parameter, whatever the number of ids
+                Message.id == any_(literal(list(msg_ids), ARRAY(Integer))),
+            ),
+        )
+        .on_conflict_do_nothing()
+        .returning(MessageRead.message_id)
+        .cte('marked')
+    )
+    read_count = (
+        update(UserChatParticipant)
+        .where(
+            UserChatParticipant.user_id == user_id,
+            UserChatParticipant.chat_id == chat_id,
+        )
+        .values(
+            read_count=UserChatParticipant.read_count + (
+                select(func.count()).select_from(marked).scalar_subquery()),
+            # greatest() skips NULLs: nothing inserted keeps the watermark
+            last_read_message_id=func.greatest(
+                UserChatParticipant.last_read_message_id,
+                select(func.max(marked.c.message_id)).scalar_subquery()),
+        )
+        .cte('read_count')
+    )
+    return select(marked.c.message_id).add_cte(read_count)
+
+
 async def set_read_msg_by_user(
     *,
     async_session: AsyncSession,
     user_id: int,
     msg_id: int,
 ):
-    message_read = MessageRead(message_id=msg_id, user_id=user_id)
-    async_session.add(message_read)
+    chat_id = select(Message.chat_id).where(Message.id == msg_id).scalar_subquery()
+    if use_read_watermarks():
+        statement = _advance_watermark(
+            user_id=user_id, chat_id=chat_id, last_read_id=msg_id)
+    else:
+        statement = _insert_read_rows(
+            user_id=user_id, chat_id=chat_id, msg_ids=[msg_id])
+    await async_session.execute(statement)
     await async_session.commit()
 
 
+async def set_read_msgs_by_user(
+    *,
+    async_session: AsyncSession,
+    user_id: int,
+    chat_id: int,
+    msg_ids: list[int],
+) -> list[int]:
+    """
+    Mark msg_ids of chat_id as read with one statement and one commit.
+    Returns the ids that were not marked as read before.
+    """
+    if not msg_ids:
+        return []
+    if use_read_watermarks():
+        await async_session.execute(_advance_watermark(
+            user_id=user_id, chat_id=chat_id, last_read_id=max(msg_ids)))
+        await async_session.commit()
+        return list(msg_ids)
+
+    marked = (await async_session.execute(_insert_read_rows(
+        user_id=user_id, chat_id=chat_id, msg_ids=msg_ids))).scalars().all()
+    await async_session.commit()
+    return marked
+
+
+async def get_chat_readers(*, async_session: AsyncSession, chat_id: int) -> list[tuple[Users, int]]:
+    """Participants of chat_id that have read something, with their watermark."""
+    return (await async_session.execute(
+        select(Users, UserChatParticipant.last_read_message_id)
+        .join(UserChatParticipant, UserChatParticipant.user_id == Users.id)
+        .where(
+            UserChatParticipant.chat_id == chat_id,
+            UserChatParticipant.last_read_message_id.is_not(None),
+        )
+    )).all()
+
+
+def read_by_from_watermarks(msg: Message, readers: list[tuple[Users, int]]) -> list[UserShort]:
+    return [
+        UserShort.model_validate(user)
+        for user, last_read in readers
+        if last_read >= msg.id and user.id != msg.sender_id
+    ]
+
+
+async def is_msg_read_by(*, async_session: AsyncSession, msg: Message, user_id: int) -> bool:
+    if use_read_watermarks():
+        last_read = (await async_session.execute(
+            select(UserChatParticipant.last_read_message_id)
+            .where(
+                UserChatParticipant.user_id == user_id,
+                UserChatParticipant.chat_id == msg.chat_id,
+            )
+        )).scalar()
+        return last_read is not None and last_read >= msg.id
+    return any(user.id == user_id for user in msg.read_by_users)
+
+
 async def get_msg_for_chat(
         *,
         async_session: AsyncSession,
         chat_id: int,
         limit: int = None,
         offset: int = None,
+        months: list[ArchivedMonth] | None = None,
 ):
+    """
+    Oldest first limit/offset window over the whole history: the months
+    archived by app.services.partitions come first, read back from their
+    files, then the live partitions. months: get_archived_months of the
+    chat, looked up when not given.
+    """
+    start = offset or 0
+    if months is None:
+        months = await get_archived_months(async_session=async_session, chat_id=chat_id)
+    archived = await get_archived_messages(
+        async_session=async_session, chat_id=chat_id, months=months,
+        limit=limit, offset=start) if months else []
+    archived_total = sum(archived_month.message_count for archived_month in months)
+    if limit:
+        limit -= len(archived)
+        if limit <= 0:
+            return archived
+
     statement = (
         select(Message)
         .where(Message.chat_id == chat_id)
@@ -122,7 +369,216 @@ async def get_msg_for_chat(
     statement = add_FK_for_msg(statement)
     if limit:
         statement = statement.limit(limit)
-    if offset is not None:
-        statement = statement.offset(offset)
+    statement = statement.offset(max(start - archived_total, 0))
+
+    messages = (await async_session.execute(statement)).scalars().all()
+    return archived + list(await with_read_state(
+        async_session=async_session, chat_id=chat_id, messages=messages))
+
+
+async def get_archived_messages(
+        *,
+        async_session: AsyncSession,
+        chat_id: int,
+        months: list[ArchivedMonth],
+        limit: int | None,
+        offset: int,
+) -> list[MessagePublic]:
+    """
+    The archived part of the get_msg_for_chat window. Messages of users
+    deleted since are left out before the window is taken, as they are
+    from the counts of get_archived_months.
+    """
+    users: dict[int, UserShort] = {}
+    selected = []
+    taken = 0
+    for archived in months:
+        if limit and taken >= limit:
+            break
+        if offset >= archived.message_count:
+            offset -= archived.message_count
+            continue
+        rows = await _read_archived_month(async_session=async_session, archived=archived, users=users)
+        rows = rows[offset:offset + limit - taken] if limit else rows[offset:]
+        offset = 0
+        selected.append((archived, rows))
+        taken += len(rows)
+    return await _archived_public(
+        async_session=async_session, chat_id=chat_id, selected=selected, users=users)
+
+
+async def get_archived_page(
+        *,
+        async_session: AsyncSession,
+        chat_id: int,
+        months: list[ArchivedMonth],
+        limit: int,
+        before: tuple[datetime, int] | None = None,
+        after: tuple[datetime, int] | None = None,
+) -> list[MessagePublic]:
+    """The archived part of a get_msg_page page, oldest first."""
+    users: dict[int, UserShort] = {}
+    selected = []
+    taken = 0
+    for archived in (months if after is not None else reversed(months)):
+        if taken >= limit:
+            break
+        if not archived.message_count:
+            continue
+        if after is not None and month_start(add_months(archived.month, 1)) <= after[0]:
+            continue
+        if before is not None and month_start(archived.month) > before[0]:
+            continue
+        rows = await _read_archived_month(async_session=async_session, archived=archived, users=users)
+        if after is not None:
+            rows = [row for row in rows if (row['created_at'], row['id']) > after][:limit - taken]
+        else:
+            if before is not None:
+                rows = [row for row in rows if (row['created_at'], row['id']) < before]
+            rows = rows[-(limit - taken):]
+        if rows:
+            selected.append((archived, rows))
+            taken += len(rows)
+    if after is None:
+        selected.reverse()
+    return await _archived_public(
+        async_session=async_session, chat_id=chat_id, selected=selected, users=users)
+
+
+async def _load_users(*, async_session: AsyncSession, user_ids: set[int], users: dict[int, UserShort]) -> None:
+    """Adds the existing users of user_ids missing from users."""
+    user_ids = user_ids - users.keys()
+    if not user_ids:
+        return
+    for user in (await async_session.execute(
+            select(Users).where(Users.id.in_(user_ids)))).scalars().all():
+        users[user.id] = UserShort.model_validate(user)
+
+
+async def _read_archived_month(
+        *, async_session: AsyncSession, archived: ArchivedMonth, users: dict[int, UserShort],
+) -> list[dict]:
+    """Messages of the chat in the archived month whose sender still exists."""
+    rows = await asyncio.to_thread(read_archived_messages, settings.MESSAGE_ARCHIVE_DIR, archived)
+    await _load_users(
+        async_session=async_session, user_ids={row['sender_id'] for row in rows}, users=users)
+    return [row for row in rows if row['sender_id'] in users]
+
+
+async def _archived_public(
+        *,
+        async_session: AsyncSession,
+        chat_id: int,
+        selected: list[tuple[ArchivedMonth, list[dict]]],
+        users: dict[int, UserShort],
+) -> list[MessagePublic]:
+    messages = []
+    for archived, rows in selected:
+        if use_read_watermarks():
+            readers = {}
+        else:
+            readers = await asyncio.to_thread(
+                read_archived_readers, settings.MESSAGE_ARCHIVE_DIR, archived,
+                {row['id'] for row in rows})
+        messages += [(row, readers.get(row['id'], [])) for row in rows]
+
+    await _load_users(
+        async_session=async_session,
+        user_ids={user_id for _, reader_ids in messages for user_id in reader_ids},
+        users=users,
+    )
+    archived = [
+        MessagePublic(
+            **{key: row[key] for key in ('id', 'chat_id', 'sender_id', 'content',
+                                         'created_at', 'updated_at')},
+            sender=users[row['sender_id']],
+            read_by_users=[users[user_id] for user_id in reader_ids if user_id in users],
+        )
+        for row, reader_ids in messages
+    ]
+    if use_read_watermarks() and archived:
+        readers = await get_chat_readers(async_session=async_session, chat_id=chat_id)
+        for msg in archived:
+            msg.read_by_users = read_by_from_watermarks(msg, readers)
+    return archived
+
+
+async def with_read_state(*, async_session: AsyncSession, chat_id: int, messages: list[Message]):
+    """
+    Messages loaded with add_FK_for_msg, ready for MessagePublic. In watermark
+    mode read_by_users is derived from the chat's participants.
+    """
+    if not use_read_watermarks():
+        return messages
+
+    readers = await get_chat_readers(async_session=async_session, chat_id=chat_id)
+    return [
+        MessagePublic(
+            id=msg.id,
+            chat_id=msg.chat_id,
+            sender_id=msg.sender_id,
+            content=msg.content,
+            read_by_users=read_by_from_watermarks(msg, readers),
+            sender=UserShort.model_validate(msg.sender),
+            created_at=msg.created_at,
+            updated_at=msg.updated_at,
+        )
+        for msg in messages
+    ]
+
+
+async def get_msg_page(
+        *,
+        async_session: AsyncSession,
+        chat_id: int,
+        limit: int,
+        before: tuple[datetime, int] | None = None,
+        after: tuple[datetime, int] | None = None,
+        months: list[ArchivedMonth] = (),
+):
+    """
+    Keyset page over (created_at, id), always returned oldest first.
+    before: the newest `limit` messages older than the key,
+    after: the oldest `limit` messages newer than the key,
+    neither: the newest `limit` messages of the chat.
+    Also returns the key the next page continues from, None on the last page.
+    Served by ix_message_chat_created_id, deep pages cost the same as the first.
+    With months (get_archived_months of the chat) the page goes on into the
+    archived months, older than every live message, once the live ones run out.
+    """
+    archived = []
+    if after is not None and months and after[0] < month_start(add_months(months[-1].month, 1)):
+        archived = await get_archived_page(
+            async_session=async_session, chat_id=chat_id, months=months, limit=limit, after=after)
+
+    messages = []
+    if len(archived) < limit:
+        key = tuple_(Message.created_at, Message.id)
+        statement = select(Message).where(Message.chat_id == chat_id)
+        if after is not None:
+            statement = statement.where(key > tuple_(*after)).order_by(
+                Message.created_at, Message.id)
+        else:
+            if before is not None:
+                statement = statement.where(key < tuple_(*before))
+            statement = statement.order_by(
+                Message.created_at.desc(), Message.id.desc())
+        statement = add_FK_for_msg(statement).limit(limit - len(archived))
+        messages = (await async_session.execute(statement)).scalars().all()
+        if after is None:
+            messages = list(reversed(messages))
+        messages = list(await with_read_state(
+            async_session=async_session, chat_id=chat_id, messages=messages))
+
+    if after is None and months and len(messages) < limit:
+        archived = await get_archived_page(
+            async_session=async_session, chat_id=chat_id, months=months,
+            limit=limit - len(messages), before=before)
+    messages = archived + messages
 
-    return (await async_session.execute(statement)).scalars().all()
+    next_key = None
+    if len(messages) == limit:
+        # the oldest (or newest with after) message of the page
+        edge = messages[-1] if after is not None else messages[0]
+        next_key = (edge.created_at, edge.id)
+    return messages, next_key
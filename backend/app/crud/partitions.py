@@ -0,0 +1,339 @@
+import asyncio
+import csv
+import gzip
+import io
+import itertools
+import os
+import uuid
+import zlib
+from datetime import date, datetime, time
+from typing import NamedTuple
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import func, select
+
+from app.models import MessageArchive, MessageArchiveSender, Users
+
+# message and message_read are range partitioned by month of the message's
+# created_at (migration e1f5b8c2a6d9). Partitions are named
+# <table>_pYYYY_MM; both tables always have the same months, so a month is
+# detached, exported and dropped as a whole. These statements take
+# table-level locks, run them on an autocommit session.
+#
+# An exported table is a headerless CSV file made of one gzip member per
+# chat, message_archive keeps where each chat's member is, so the history
+# of a chat is read back without decompressing the rest of the month.
+
+PARTITIONED_TABLES = ('message', 'message_read')
+# columns of the exported files, ordered so a chat is one run of lines
+_FIELDS = {
+    'message': ('id', 'chat_id', 'sender_id', 'message_uuid', 'content', 'created_at', 'updated_at'),
+    'message_read': ('message_id', 'user_id', 'message_created_at', 'created_at', 'updated_at',
+                     'chat_id'),
+}
+_EXPORTS = {
+    'message': """
+        SELECT id, chat_id, sender_id, message_uuid, content, created_at, updated_at
+        FROM {message} ORDER BY chat_id, created_at, id
+    """,
+    'message_read': """
+        SELECT r.message_id, r.user_id, r.message_created_at, r.created_at, r.updated_at, m.chat_id
+        FROM {message_read} r
+        JOIN {message} m ON m.id = r.message_id AND m.created_at = r.message_created_at
+        ORDER BY m.chat_id, r.message_id, r.user_id
+    """,
+}
+
+_ATTACHED = text("""
+    SELECT c.relname FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = CAST(:table AS regclass) AND c.relname LIKE :pattern
+""")
+
+# detached by detach_month but not dropped yet
+_DETACHED = text("""
+    SELECT c.relname FROM pg_class c
+    WHERE c.relkind = 'r' AND c.relname LIKE 'message\\_p%'
+      AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)
+""")
+
+_EXISTS = text("SELECT EXISTS (SELECT 1 FROM pg_class WHERE relname = :name AND relkind = 'r')")
+
+_FOREIGN_KEYS = text("""
+    SELECT conname FROM pg_constraint
+    WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'
+""")
+
+
+class ArchiveUnavailableError(Exception):
+    """An exported month can't be read back, its file is missing or damaged."""
+
+
+class ArchivedMonth(NamedTuple):
+    """A chat's part of an archived month, see get_archived_months."""
+    month: date
+    message_count: int
+    messages_offset: int
+    messages_length: int
+    reads_offset: int
+    reads_length: int
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_start(month: date) -> datetime:
+    return datetime.combine(month, time())
+
+
+def partition_name(table: str, month: date) -> str:
+    return f'{table}_p{month:%Y_%m}'
+
+
+def partition_month(name: str) -> date:
+    """message_p2025_05 -> date(2025, 5, 1)"""
+    year, month = name.rsplit('_p', 1)[1].split('_')
+    return date(int(year), int(month), 1)
+
+
+def archive_path(directory: str, table: str, month: date) -> str:
+    return os.path.join(directory, f'{partition_name(table, month)}.csv.gz')
+
+
+async def create_partitions(*, async_session: AsyncSession, first: date, months: int) -> list[str]:
+    """Partitions of both tables for `months` months from first on, returns the new ones."""
+    created = []
+    for month in (add_months(first, i) for i in range(months)):
+        for table in PARTITIONED_TABLES:
+            name = partition_name(table, month)
+            if (await async_session.execute(_EXISTS, {'name': name})).scalar():
+                continue
+            # fails while the default partition holds rows of that month,
+            # they have to be moved out by hand
+            await async_session.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"))
+            created.append(name)
+    return created
+
+
+async def get_partition_months(*, async_session: AsyncSession) -> list[date]:
+    """Months attached to message, oldest first, the default partition aside."""
+    names = (await async_session.execute(
+        _ATTACHED, {'table': 'message', 'pattern': 'message\\_p%'})).scalars().all()
+    return sorted(partition_month(name) for name in names)
+
+
+async def get_detached_months(*, async_session: AsyncSession) -> list[date]:
+    names = (await async_session.execute(_DETACHED)).scalars().all()
+    return sorted({partition_month(name) for name in names})
+
+
+async def detach_month(*, async_session: AsyncSession, month: date) -> None:
+    """
+    Takes month out of both tables, reads first as they reference the
+    messages. The detached tables lose their foreign keys, nothing is
+    written to them anymore.
+    """
+    for table in reversed(PARTITIONED_TABLES):
+        name = partition_name(table, month)
+        attached = (await async_session.execute(
+            _ATTACHED, {'table': table, 'pattern': name})).scalar()
+        if attached:
+            await async_session.execute(text(f'ALTER TABLE {table} DETACH PARTITION {name}'))
+        elif not (await async_session.execute(_EXISTS, {'name': name})).scalar():
+            continue
+        for constraint in (await async_session.execute(
+                _FOREIGN_KEYS, {'table': name})).scalars().all():
+            await async_session.execute(text(f'ALTER TABLE {name} DROP CONSTRAINT {constraint}'))
+
+
+def split_by_chat(source: str, path: str, table: str) -> dict[int, tuple[int, int, int]]:
+    """
+    Rewrites the CSV export of table at source to path with one gzip member
+    per chat, returns chat id -> (offset, length, rows) of the members.
+    Blocking.
+    """
+    chat_column = _FIELDS[table].index('chat_id')
+    members = {}
+    with open(source, newline='') as lines, open(f'{path}.tmp', 'wb') as output:
+        for chat_id, rows in itertools.groupby(
+                csv.reader(lines), key=lambda row: int(row[chat_column])):
+            offset = output.tell()
+            count = 0
+            # mtime=0: a month exported again gives the same bytes
+            with gzip.GzipFile(fileobj=output, mode='wb', mtime=0) as member, \
+                    io.TextIOWrapper(member, encoding='utf-8', newline='') as member_lines:
+                writer = csv.writer(member_lines)
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+            members[chat_id] = (offset, output.tell() - offset, count)
+    os.replace(f'{path}.tmp', path)
+    return members
+
+
+async def export_month(
+        *, async_session: AsyncSession, month: date, directory: str,
+) -> dict[str, dict[int, tuple[int, int, int]]]:
+    """
+    Writes the detached tables of month to directory, replacing earlier
+    attempts. Returns split_by_chat of each table.
+    """
+    connection = await (await async_session.connection()).get_raw_connection()
+    names = {table: partition_name(table, month) for table in PARTITIONED_TABLES}
+    members = {}
+    for table in PARTITIONED_TABLES:
+        path = archive_path(directory, table, month)
+        with open(f'{path}.export', 'wb') as output:
+            await connection.driver_connection.copy_from_query(
+                _EXPORTS[table].format(**names), output=output, format='csv')
+        try:
+            members[table] = await asyncio.to_thread(split_by_chat, f'{path}.export', path, table)
+        finally:
+            os.remove(f'{path}.export')
+        await asyncio.to_thread(verify_export, path, members[table])
+    return members
+
+
+def verify_export(path: str, members: dict[int, tuple[int, int, int]]) -> None:
+    """
+    Reads every member of an exported file back and checks its row count,
+    the month's tables are only dropped once this passed. Blocking.
+    """
+    with open(path, 'rb') as archive:
+        for chat_id, (offset, length, count) in members.items():
+            archive.seek(offset)
+            rows = sum(1 for _ in csv.reader(io.StringIO(
+                gzip.decompress(archive.read(length)).decode(), newline='')))
+            if rows != count:
+                raise ValueError(f"{path}: chat {chat_id} has {rows} rows, exported {count}")
+
+
+async def record_month(
+        *, async_session: AsyncSession, month: date,
+        members: dict[str, dict[int, tuple[int, int, int]]],
+) -> None:
+    """
+    Chats and senders of the exported month into message_archive and
+    message_archive_sender, members as returned by export_month, then
+    drops the month's tables.
+    """
+    name = partition_name('message', month)
+    bounds = {'range_start': month_start(month), 'range_end': month_start(add_months(month, 1))}
+    reads = members['message_read']
+    rows = [
+        {
+            'partition_name': name,
+            'chat_id': chat_id,
+            'message_count': count,
+            'messages_offset': offset,
+            'messages_length': length,
+            'reads_offset': reads.get(chat_id, (0, 0, 0))[0],
+            'reads_length': reads.get(chat_id, (0, 0, 0))[1],
+            'archived_at': datetime.now(),
+            **bounds,
+        }
+        for chat_id, (offset, length, count) in members['message'].items()
+    ]
+    if rows:
+        statement = pg_insert(MessageArchive)
+        # a month exported again by a retry replaces its files
+        await async_session.execute(statement.on_conflict_do_update(
+            index_elements=['partition_name', 'chat_id'],
+            set_={column: statement.excluded[column] for column in (
+                'message_count', 'messages_offset', 'messages_length',
+                'reads_offset', 'reads_length')},
+        ), rows)
+    await async_session.execute(text(f"""
+        INSERT INTO message_archive_sender (partition_name, chat_id, sender_id, message_count)
+        SELECT CAST(:name AS varchar), chat_id, sender_id, count(*)
+        FROM {name}
+        GROUP BY chat_id, sender_id
+        ON CONFLICT DO NOTHING
+    """), {'name': name})
+    # message_uuid of the month can't be sent again anymore
+    await async_session.execute(text(
+        'DELETE FROM message_dedupe WHERE created_at >= :range_start AND created_at < :range_end'),
+        bounds)
+    # both at once, a month is either detached and exportable or gone
+    await async_session.execute(text('DROP TABLE IF EXISTS {}'.format(
+        ', '.join(partition_name(table, month) for table in reversed(PARTITIONED_TABLES)))))
+
+
+async def get_archived_months(*, async_session: AsyncSession, chat_id: int) -> list[ArchivedMonth]:
+    """
+    The archived months of chat_id, oldest first. message_count leaves out
+    the messages of users deleted since, as the history does.
+    """
+    live_count = (
+        select(func.coalesce(func.sum(MessageArchiveSender.message_count), 0))
+        .join(Users, Users.id == MessageArchiveSender.sender_id)
+        .where(
+            MessageArchiveSender.partition_name == MessageArchive.partition_name,
+            MessageArchiveSender.chat_id == MessageArchive.chat_id,
+        )
+        .scalar_subquery()
+    )
+    rows = (await async_session.execute(
+        select(
+            MessageArchive.range_start, live_count,
+            MessageArchive.messages_offset, MessageArchive.messages_length,
+            MessageArchive.reads_offset, MessageArchive.reads_length,
+        )
+        .where(MessageArchive.chat_id == chat_id)
+        .order_by(MessageArchive.range_start)
+    )).all()
+    return [ArchivedMonth(range_start.date(), *rest) for range_start, *rest in rows]
+
+
+def _read_member(directory: str, table: str, month: date, offset: int, length: int):
+    """csv.DictReader over one chat's gzip member of an exported table. Blocking."""
+    path = archive_path(directory, table, month)
+    try:
+        with open(path, 'rb') as archive:
+            archive.seek(offset)
+            member = gzip.decompress(archive.read(length)).decode()
+    except (OSError, EOFError, zlib.error) as e:
+        raise ArchiveUnavailableError(f"{path}: {e}") from e
+    return csv.DictReader(io.StringIO(member, newline=''), fieldnames=_FIELDS[table])
+
+
+def read_archived_messages(directory: str, archived: ArchivedMonth) -> list[dict]:
+    """Messages of the chat in an exported month, oldest first. Blocking."""
+    if not archived.messages_length:
+        return []
+    return [
+        {
+            'id': int(row['id']),
+            'chat_id': int(row['chat_id']),
+            'sender_id': int(row['sender_id']),
+            'message_uuid': uuid.UUID(row['message_uuid']),
+            'content': row['content'],
+            'created_at': datetime.fromisoformat(row['created_at']),
+            'updated_at': datetime.fromisoformat(row['updated_at']),
+        }
+        for row in _read_member(directory, 'message', archived.month,
+                                archived.messages_offset, archived.messages_length)
+    ]
+
+
+def read_archived_readers(directory: str, archived: ArchivedMonth,
+                          message_ids: set[int]) -> dict[int, list[int]]:
+    """message id -> ids of the users that read it, for message_ids of the chat's exported month. Blocking."""
+    readers: dict[int, list[int]] = {}
+    if not message_ids or not archived.reads_length:
+        return readers
+    last_id = max(message_ids)
+    for row in _read_member(directory, 'message_read', archived.month,
+                            archived.reads_offset, archived.reads_length):
+        message_id = int(row['message_id'])
+        if message_id > last_id:
+            break
+        if message_id in message_ids:
+            readers.setdefault(message_id, []).append(int(row['user_id']))
+    return readers
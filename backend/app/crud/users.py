@@ -1,48 +1,77 @@
-import uuid
 from typing import Any
 
-from sqlmodel import Session, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import select
 
-from app.core.security import get_password_hash, verify_password
+from app.core.security import get_password_hash_async, verify_password_async
 from app.models import Users
 from app.dto import UserCreate, UserUpdate
 
 
-def create_user(*, session: Session, user_create: UserCreate) -> Users:
-    db_obj = Users.model_validate(
-        user_create, update={
-            "hashed_password": get_password_hash(user_create.password)}
+def build_user(user_create: UserCreate, hashed_password: str) -> Users:
+    return Users.model_validate(
+        user_create, update={"hashed_password": hashed_password}
     )
-    session.add(db_obj)
-    session.commit()
-    session.refresh(db_obj)
+
+
+async def create_user(
+    *, async_session: AsyncSession, user_create: UserCreate, client: str | None = None
+) -> Users:
+    db_obj = build_user(
+        user_create, await get_password_hash_async(user_create.password, client=client))
+    async_session.add(db_obj)
+    await async_session.commit()
+    await async_session.refresh(db_obj)
     return db_obj
 
 
-def update_user(*, session: Session, db_user: Users, user_in: UserUpdate) -> Any:
+async def update_user(*, async_session: AsyncSession, db_user: Users, user_in: UserUpdate) -> Any:
     user_data = user_in.model_dump(exclude_unset=True)
     extra_data = {}
     if "password" in user_data:
         password = user_data["password"]
-        hashed_password = get_password_hash(password)
+        hashed_password = await get_password_hash_async(password)
         extra_data["hashed_password"] = hashed_password
     db_user.sqlmodel_update(user_data, update=extra_data)
-    session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    async_session.add(db_user)
+    await async_session.commit()
+    await async_session.refresh(db_user)
     return db_user
 
 
-def get_user_by_email(*, session: Session, email: str) -> Users | None:
+async def get_user_by_email(*, async_session: AsyncSession, email: str) -> Users | None:
     statement = select(Users).where(Users.email == email)
-    session_user = session.exec(statement).first()
-    return session_user
+    return (await async_session.execute(statement)).scalars().first()
 
 
-def authenticate(*, session: Session, email: str, password: str) -> Users | None:
-    db_user = get_user_by_email(session=session, email=email)
+async def authenticate(
+    *, async_session: AsyncSession, email: str, password: str, client: str | None = None
+) -> Users | None:
+    db_user = await get_user_by_email(async_session=async_session, email=email)
     if not db_user:
         return None
-    if not verify_password(password, db_user.hashed_password):
+    if not await verify_password_async(password, db_user.hashed_password, client=client):
         return None
     return db_user
+
+
+async def get_existing_emails(*, async_session: AsyncSession, emails: list[str]) -> set[str]:
+    statement = select(Users.email).where(Users.email.in_(emails))
+    return set((await async_session.execute(statement)).scalars().all())
+
+
+async def insert_users(*, async_session: AsyncSession, users: list[Users]) -> dict[str, int]:
+    """
+    One multi-row INSERT, rows whose email is taken (ix_users_email) are
+    skipped instead of failing the statement. Returns email -> id of the
+    inserted rows; the caller commits.
+    """
+    rows = [user.model_dump(exclude={'id'}) for user in users]
+    statement = (
+        pg_insert(Users)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=['email'])
+        .returning(Users.email, Users.id)
+    )
+    return dict((await async_session.execute(statement)).all())
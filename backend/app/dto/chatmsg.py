@@ -34,6 +34,22 @@ class ChatsPublic(SQLModel):
     owner: UserShort
 
 
+class ChatInboxItem(SQLModel):
+    id: int
+    chat_id: UUID = Field(..., description="Уникальный идентификатор чата")
+    name: str | None = Field(None, description="Название чата")
+    is_group: bool
+    peer: UserShort | None = Field(
+        None, description="Собеседник, только для личных чатов")
+    member_count: int
+    unread_count: int
+    last_message_id: int | None = None
+    last_message_sender_id: int | None = None
+    last_message_preview: str | None = None
+    last_activity_at: datetime = Field(
+        ..., description="Время последнего сообщения или создания чата")
+
+
 class MyChatsPublic(SQLModel):
     group_chats: List[ChatsPublic]
     lc_chats: List[ChatsPublic]
@@ -42,8 +58,14 @@ class MyChatsPublic(SQLModel):
 class MessageDTO(SQLModel):
     receiver_id: str | int = Field(None)
     content: str
-    type: Literal['lc', 'group', 'init']
+    type: Literal['lc', 'group', 'init', 'ping', 'presence', 'typing']
     message_uuid: str | UUID = Field(None)
+    # init only, WS_TRANSPORT=streams: channel -> last stream_id seen
+    resume: dict[str, str] | None = Field(None)
+    # presence only
+    user_ids: List[int] | None = Field(None)
+    # typing only: kind of the chat receiver_id points to
+    chat_type: Literal['lc', 'group'] | None = Field(None)
 
     @property
     def is_init(self):
@@ -57,6 +79,18 @@ class MessageDTO(SQLModel):
     def is_group(self) -> bool:
         return self.type == 'group'
 
+    @property
+    def is_ping(self) -> bool:
+        return self.type == 'ping'
+
+    @property
+    def is_presence(self) -> bool:
+        return self.type == 'presence'
+
+    @property
+    def is_typing(self) -> bool:
+        return self.type == 'typing'
+
 
 class MessagePublic(SQLModel):
     id: int
@@ -65,10 +99,17 @@ class MessagePublic(SQLModel):
     content: str
     read_by_users: List[UserShort] = []
     sender: UserShort
+    created_at: datetime
     updated_at: datetime
 
 
+class MessagesPage(SQLModel):
+    data: List[MessagePublic]
+    next_cursor: str | None = Field(
+        None, description="Курсор следующей страницы, None если страниц больше нет")
+
+
 class NotifyMsg(SQLModel):
-    type: Literal['MSG_READ', 'CHAT_INVITED']
+    type: Literal['MSG_READ', 'CHAT_INVITED', 'RESYNC', 'PRESENCE', 'TYPING', 'PONG']
     meta_data: dict
     content: str
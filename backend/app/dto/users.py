@@ -1,4 +1,5 @@
 import uuid
+from datetime import datetime
 from app.models import UserBase
 from pydantic import EmailStr
 from sqlmodel import Field, SQLModel
@@ -10,6 +11,13 @@ class UserShort(SQLModel):
     full_name: str | None
 
 
+class UserPresence(SQLModel):
+    user_id: int
+    online: bool
+    # unix time of the last heartbeat or disconnect, None if never seen
+    last_seen: int | None = None
+
+
 class UserCreate(UserBase):
     password: str = Field(min_length=8, max_length=40)
 
@@ -47,8 +55,42 @@ class UsersPublic(SQLModel):
     data: list[UserPublic]
     count: int
 
+
+class UserImportIssue(SQLModel):
+    # 1-based line of the input, the CSV header is line 1
+    line: int
+    email: str | None = None
+    error: str
+
+
+class UserImportReport(SQLModel):
+    created: int = 0
+    memberships: int = 0
+    issues: list[UserImportIssue] = []
+    # Set when password hashing ran out of capacity: the lines before it
+    # are committed or listed in issues, send the input again from there
+    resume_line: int | None = None
+
 # Generic message
 
 
 class Message(SQLModel):
     message: str
+
+
+class DeletionAccepted(Message):
+    # progress at GET /deletions/{job_id}
+    job_id: str
+
+
+class DeletionJobPublic(SQLModel):
+    id: str
+    kind: str
+    target_id: int
+    status: str
+    attempts: int = 0
+    messages: int
+    reads: int
+    error: str | None = None
+    created_at: datetime
+    updated_at: datetime
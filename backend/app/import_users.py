@@ -0,0 +1,77 @@
+"""
+Bulk user import, the CLI side of POST /users/import:
+
+    python -m app.import_users users.csv --chat-id 12 --chat-id 15
+    python -m app.import_users users.ndjson
+
+The format follows the file extension unless --format is given.
+"""
+import argparse
+import asyncio
+import json
+import logging
+from pathlib import Path
+from typing import AsyncIterator
+
+import redis.asyncio as redis
+from fastapi import HTTPException
+
+from app.core import security
+from app.core.config import settings
+from app.core.db import AsyncSessionLocal
+from app.core.hashing import PasswordHasher
+from app.services.membership import forget_chat_members
+from app.services.user_import import FORMATS, import_users, iter_lines, iter_records
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def read_chunks(path: Path, size: int = 1 << 16) -> AsyncIterator[bytes]:
+    with path.open('rb') as file:
+        while chunk := file.read(size):
+            yield chunk
+
+
+async def run(path: Path, fmt: str, chat_ids: list[int]) -> None:
+    hasher = PasswordHasher()
+    await hasher.start()
+    security.use_hasher(hasher)
+    try:
+        async with AsyncSessionLocal() as async_session:
+            report = await import_users(
+                async_session=async_session,
+                records=iter_records(iter_lines(read_chunks(path)), fmt),
+                chat_ids=chat_ids,
+            )
+    except HTTPException as e:
+        logger.error(e.detail)
+        return
+    finally:
+        security.use_hasher(None)
+        await hasher.close()
+
+    if report.memberships:
+        redis_client = redis.from_url(settings.get_redis_url)
+        try:
+            await forget_chat_members(redis_client, chat_ids)
+        finally:
+            await redis_client.aclose()
+    for issue in report.issues:
+        print(json.dumps(issue.model_dump()))
+    if report.resume_line is not None:
+        logger.error(f"Stopped for lack of hashing capacity, resume from line {report.resume_line}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', type=Path)
+    parser.add_argument('--format', choices=FORMATS)
+    parser.add_argument('--chat-id', dest='chat_ids', type=int, action='append', default=[])
+    args = parser.parse_args()
+    fmt = args.format or ('csv' if args.path.suffix.lower() == '.csv' else 'ndjson')
+    asyncio.run(run(args.path, fmt, args.chat_ids))
+
+
+if __name__ == "__main__":
+    main()
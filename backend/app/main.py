@@ -6,7 +6,22 @@ from starlette.middleware.cors import CORSMiddleware
 import redis.asyncio as redis
 
 from app.api.main import api_router
+from app.api.routes import metrics
+from app.core import security
 from app.core.config import settings
+from app.core.hashing import PasswordHasher
+from app.core.metrics import REGISTRY, CountingConnectionPool, MetricsFiles, MetricsMiddleware
+from app.core.pubsub import PubSubHub
+from app.core.routing import NodeRegistry
+from app.core.streams import MessageTransport
+from app.services.auth import AuthCache
+from app.services.deletion import DeletionJobs
+from app.services.email_outbox import EmailOutbox
+from app.services.hot_page import HotPageCache
+from app.services.membership import ChatMembershipCache
+from app.services.partitions import MessagePartitions
+from app.services.presence import PresenceService
+from app.services.typing import TypingRelay
 
 
 def custom_generate_unique_id(route: APIRoute) -> str:
@@ -17,13 +32,81 @@ if settings.SENTRY_DSN and settings.ENVIRONMENT != "local":
     sentry_sdk.init(dsn=str(settings.SENTRY_DSN), enable_tracing=True)
 
 
+def register_state_gauges(app: FastAPI) -> list[str]:
+    pool = app.state.redis_client.connection_pool
+    gauges = [
+        REGISTRY.gauge(
+            'redis_pool_connections', 'Connections of the Redis client pool', ('state',),
+            callback=lambda: {
+                'in_use': pool.in_use,
+                'idle': pool.created - pool.in_use,
+            }),
+        REGISTRY.gauge(
+            'password_hash_inflight', 'Hashing jobs running or queued',
+            callback=lambda: app.state.password_hasher.inflight),
+        REGISTRY.gauge(
+            'ws_pubsub_hub', 'Channels and sinks of the pub/sub hub', ('stat',),
+            callback=app.state.pubsub_hub.stats),
+    ]
+    return [gauge.name for gauge in gauges]
+
+
 @asynccontextmanager
 async def lifespan_wrapper(app: FastAPI):
-    app.state.redis_client = redis.from_url(settings.get_redis_url)
+    app.state.password_hasher = PasswordHasher()
+    await app.state.password_hasher.start()
+    security.use_hasher(app.state.password_hasher)
+    app.state.redis_client = redis.Redis.from_pool(
+        CountingConnectionPool.from_url(settings.get_redis_url))
+    app.state.pubsub_hub = PubSubHub(app.state.redis_client)
+    app.state.node_registry = NodeRegistry(app.state.redis_client, app.state.pubsub_hub)
+    await app.state.node_registry.start()
+    app.state.transport = MessageTransport(
+        app.state.redis_client, registry=app.state.node_registry)
+    app.state.membership_cache = ChatMembershipCache(
+        app.state.redis_client, app.state.pubsub_hub)
+    await app.state.membership_cache.start()
+    app.state.auth_cache = AuthCache(app.state.redis_client, app.state.pubsub_hub)
+    await app.state.auth_cache.start()
+    app.state.hot_pages = HotPageCache(app.state.redis_client)
+    app.state.presence = PresenceService(app.state.redis_client, app.state.transport)
+    await app.state.presence.start()
+    app.state.typing = TypingRelay(app.state.transport)
+    await app.state.typing.start()
+    app.state.email_outbox = EmailOutbox(app.state.redis_client)
+    if settings.emails_enabled and settings.EMAIL_OUTBOX_WORKER:
+        await app.state.email_outbox.start()
+    app.state.deletion_jobs = DeletionJobs(app.state.redis_client, app.state.hot_pages)
+    if settings.DELETION_WORKER:
+        await app.state.deletion_jobs.start()
+    app.state.message_partitions = MessagePartitions(app.state.hot_pages)
+    if settings.MESSAGE_PARTITION_WORKER:
+        await app.state.message_partitions.start()
+    state_gauges = register_state_gauges(app)
+    app.state.metrics_files = None
+    if settings.METRICS_ENABLED and settings.METRICS_DIR:
+        app.state.metrics_files = MetricsFiles(
+            REGISTRY, settings.METRICS_DIR, settings.METRICS_FLUSH_INTERVAL)
+        await app.state.metrics_files.start()
     try:
         yield
     finally:
+        if app.state.metrics_files:
+            await app.state.metrics_files.close()
+        for name in state_gauges:
+            REGISTRY.unregister(name)
+        await app.state.message_partitions.close()
+        await app.state.deletion_jobs.close()
+        await app.state.email_outbox.close()
+        await app.state.typing.close()
+        await app.state.presence.close()
+        await app.state.auth_cache.close()
+        await app.state.membership_cache.close()
+        await app.state.node_registry.close()
+        await app.state.pubsub_hub.close()
         await app.state.redis_client.close()
+        security.use_hasher(None)
+        await app.state.password_hasher.close()
 
 
 app = FastAPI(
@@ -45,4 +128,9 @@ if settings.all_cors_origins:
         allow_headers=["*"],
     )
 
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 app.include_router(api_router, prefix=settings.API_V1_STR)
+if settings.METRICS_ENABLED:
+    app.include_router(metrics.router)
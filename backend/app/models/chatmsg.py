@@ -1,7 +1,8 @@
 import uuid
+from datetime import datetime
 from typing import TYPE_CHECKING, List
 from app.models.base import BaseTSIDModel, BaseTSModel
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import BigInteger, ForeignKeyConstraint, text
 from sqlmodel import (
     Field,
     Index,
@@ -12,12 +13,24 @@ from sqlmodel import (
 if TYPE_CHECKING:
     from .users import Users
 
+CHAT_PREVIEW_LENGTH = 100
+
 
 class UserChatParticipant(BaseTSModel, SQLModel, table=True):
     __tablename__ = 'user_chat_participants'
 
-    chat_id: int = Field(foreign_key="chats.id", primary_key=True)
-    user_id: int = Field(foreign_key="users.id", primary_key=True)
+    chat_id: int = Field(foreign_key="chats.id", primary_key=True, ondelete="CASCADE")
+    user_id: int = Field(foreign_key="users.id", primary_key=True, ondelete="CASCADE")
+    # Every message of the chat up to this id counts as read by user_id,
+    # used when READ_TRACKING_MODE == 'watermark'
+    last_read_message_id: int | None = Field(default=None, nullable=True)
+    # Messages of the chat sent or read by user_id, unread = message_count - read_count
+    read_count: int = Field(default=0, sa_column_kwargs={'server_default': '0'})
+
+    __table_args__ = (
+        # /groups/inbox, chats of a user
+        Index('ix_user_chat_participants_user_id', 'user_id'),
+    )
 
 
 class Chats(BaseTSIDModel, SQLModel, table=True):
@@ -27,16 +40,31 @@ class Chats(BaseTSIDModel, SQLModel, table=True):
                       default=None, nullable=True)
     chat_id: uuid.UUID = Field(default_factory=uuid.uuid4)
     is_group: bool = Field(default=False)
+    # Canonical (min, max) user ids of a direct chat, NULL for groups
+    direct_user_lo: int | None = Field(default=None, nullable=True)
+    direct_user_hi: int | None = Field(default=None, nullable=True)
     owner_id: int = Field(foreign_key="users.id")
     owner: "Users" = Relationship(back_populates="own_chats")
 
+    # Inbox summary, maintained by insert_msg and add_participant_to_group
+    member_count: int = Field(default=0, sa_column_kwargs={'server_default': '0'})
+    message_count: int = Field(default=0, sa_column_kwargs={'server_default': '0'})
+    last_message_id: int | None = Field(default=None, nullable=True)
+    last_message_at: datetime | None = Field(default=None, nullable=True)
+    last_message_sender_id: int | None = Field(default=None, nullable=True)
+    last_message_preview: str | None = Field(
+        default=None, max_length=CHAT_PREVIEW_LENGTH, nullable=True)
+    # Delete requested, rows are removed by app.services.deletion
+    deleted_at: datetime | None = Field(default=None, nullable=True)
+
     users: List["Users"] = Relationship(
         back_populates="chats",
         link_model=UserChatParticipant
     )
 
+    # Deleted by the database (ON DELETE CASCADE), never loaded for it
     messages: List["Message"] = Relationship(
-        back_populates="chat", cascade_delete=True)
+        back_populates="chat", cascade_delete=True, passive_deletes=True)
 
     # experiment for personal needs
     __table_args__ = (
@@ -46,25 +74,54 @@ class Chats(BaseTSIDModel, SQLModel, table=True):
             postgresql_where=(is_group == False),
             unique=True
         ),
+        Index(
+            'uq_chats_direct_pair',
+            'direct_user_lo',
+            'direct_user_hi',
+            postgresql_where=text('is_group = false'),
+            unique=True,
+        ),
     )
 
 
 class MessageRead(BaseTSModel, SQLModel, table=True):
     __tablename__ = "message_read"
 
-    message_id: int = Field(foreign_key="message.id", primary_key=True)
-    user_id: int = Field(foreign_key="users.id", primary_key=True)
+    message_id: int = Field(primary_key=True)
+    user_id: int = Field(foreign_key="users.id", primary_key=True, ondelete="CASCADE")
+    # Partition key, the created_at of the message: the reads of a message
+    # live in the partition matching the message's one and are archived with it
+    message_created_at: datetime = Field(primary_key=True)
 
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ['message_id', 'message_created_at'], ['message.id', 'message.created_at'],
+            ondelete="CASCADE",
+        ),
+        # reads of a user, for the cascade from users and the deletion job
+        Index('ix_message_read_user_id', 'user_id', 'message_id'),
+        {'postgresql_partition_by': 'RANGE (message_created_at)'},
+    )
 
-class Message(BaseTSIDModel, SQLModel, table=True):
+
+class Message(SQLModel, table=True):
+    """
+    Range partitioned by month of created_at, see app.crud.partitions; the
+    primary key has to include it, so a row is (id, created_at).
+    """
     __tablename__ = "message"
 
+    id: int = Field(default=None, primary_key=True, sa_column_kwargs={
+        'server_default': text("nextval('message_id_seq')")})
+    created_at: datetime = Field(default_factory=datetime.now, primary_key=True)
+    updated_at: datetime = Field(default_factory=datetime.now, nullable=False)
+    # unique through MessageDedupe, a partitioned table can't enforce it
     message_uuid: uuid.UUID = Field(default_factory=uuid.uuid4)
 
     chat_id: int = Field(foreign_key="chats.id", ondelete="CASCADE")
     chat: "Chats" = Relationship(back_populates="messages")
 
-    sender_id: int = Field(foreign_key="users.id")
+    sender_id: int = Field(foreign_key="users.id", ondelete="CASCADE")
     sender: "Users" = Relationship(back_populates="send_messages")
 
     read_by_users: List["Users"] = Relationship(
@@ -75,5 +132,59 @@ class Message(BaseTSIDModel, SQLModel, table=True):
     content: str = Field(max_length=2048)
 
     __table_args__ = (
-        UniqueConstraint("message_uuid", name="uq_message_message_uuid"),
+        Index("ix_message_message_uuid", "message_uuid"),
+        # keyset pagination of a chat's history
+        Index("ix_message_chat_created_id", "chat_id", "created_at", "id"),
+        # messages of a user, for the cascade from users and the deletion job
+        Index("ix_message_sender_id", "sender_id", "id"),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
     )
+
+
+class MessageDedupe(SQLModel, table=True):
+    """
+    message_uuid of every live message, claimed by insert_msg before the
+    message row is written. Rows go when their partition is archived.
+    """
+    __tablename__ = "message_dedupe"
+
+    message_uuid: uuid.UUID = Field(primary_key=True)
+    message_id: int
+    created_at: datetime = Field(index=True)
+
+
+class MessageArchive(SQLModel, table=True):
+    """
+    Messages per chat of a partition archived by app.services.partitions,
+    to page the history across the live and archived ranges.
+    """
+    __tablename__ = "message_archive"
+
+    partition_name: str = Field(primary_key=True, max_length=63)
+    chat_id: int = Field(primary_key=True)
+    message_count: int
+    range_start: datetime
+    range_end: datetime
+    # the chat's gzip members in the month's files, see app.crud.partitions
+    messages_offset: int = Field(sa_type=BigInteger)
+    messages_length: int
+    reads_offset: int = Field(sa_type=BigInteger)
+    reads_length: int
+    archived_at: datetime = Field(default_factory=datetime.now)
+
+    __table_args__ = (
+        Index('ix_message_archive_chat_id', 'chat_id', 'range_start'),
+    )
+
+
+class MessageArchiveSender(SQLModel, table=True):
+    """
+    Messages per sender of a chat in an archived partition, so the history
+    windows can leave out the users deleted since.
+    """
+    __tablename__ = "message_archive_sender"
+
+    partition_name: str = Field(primary_key=True, max_length=63)
+    chat_id: int = Field(primary_key=True)
+    sender_id: int = Field(primary_key=True)
+    message_count: int
@@ -1,4 +1,6 @@
 
+from datetime import datetime
+
 from app.models.base import BaseTSIDModel
 from pydantic import EmailStr
 from sqlmodel import Field, Relationship, SQLModel
@@ -20,9 +22,13 @@ class Users(BaseTSIDModel, UserBase, table=True):
     __tablename__ = "users"
 
     hashed_password: str
+    # Delete requested, rows are removed by app.services.deletion
+    deleted_at: datetime | None = Field(default=None, nullable=True)
+    # Deleted by the database (ON DELETE CASCADE), never loaded for it
     send_messages: List["Message"] = Relationship(
         back_populates="sender",
         cascade_delete=True,
+        passive_deletes=True,
     )
     chats: List["Chats"] = Relationship(
         back_populates="users", link_model=UserChatParticipant,
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+import time
+
+import jwt
+from fastapi import HTTPException, status
+from jwt.exceptions import InvalidTokenError
+from pydantic import ValidationError
+from redis.asyncio import Redis
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.core import security
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.core.db import AsyncSessionLocal
+from app.core.pubsub import PubSubHub
+from app.dto import TokenPayload
+from app.models import Users
+
+logger = logging.getLogger(__name__)
+
+CONTROL_CHANNEL = 'ctl_auth_users'
+_COLUMNS = tuple(column.key for column in Users.__table__.columns)
+
+
+class AuthCache:
+    """
+    Resolves bearer tokens to users on the async engine.
+
+    Decoded tokens (token -> user id, expiry) and user rows are kept in
+    per-process LRUs for AUTH_CACHE_TTL, so a steady stream of requests
+    with the same token costs neither a JWT decode nor a query. Every call
+    returns a fresh detached Users: callers may read it or add it to a
+    session, but writes should go through a row loaded in that session.
+    A miss uses its own short session, so the connection goes back to the
+    pool right after the query.
+
+    invalidate() drops a user on every worker (via CONTROL_CHANNEL); call
+    it after a committed update, deactivation or deletion.
+    """
+
+    def __init__(self, redis_client: Redis, hub: PubSubHub):
+        self.redis = redis_client
+        self.hub = hub
+        self._tokens = LRUCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+        self._users = LRUCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        await self.hub.subscribe(self, CONTROL_CHANNEL)
+
+    async def close(self) -> None:
+        await self.hub.unsubscribe(self)
+
+    def put_nowait(self, payload: str) -> None:
+        # Hub sink for CONTROL_CHANNEL
+        try:
+            self._users.pop(int(json.loads(payload)['user_id']))
+        except (ValueError, KeyError, TypeError):
+            logger.error(f"Bad auth control message: {payload}")
+
+    def _decode(self, token: str) -> int:
+        cached = self._tokens.get(token)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        try:
+            payload = jwt.decode(
+                token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
+            )
+            token_data = TokenPayload(**payload)
+            user_id = int(token_data.sub)
+        except (InvalidTokenError, ValidationError, TypeError, ValueError):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Could not validate credentials",
+            )
+        self._tokens.set(token, (user_id, payload.get('exp', float('inf'))))
+        return user_id
+
+    async def authenticate(self, token: str) -> Users:
+        user_id = self._decode(token)
+        row = self._users.get(user_id)
+        if row is None:
+            async with AsyncSessionLocal() as async_session:
+                user = await async_session.get(Users, user_id)
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
+            row = {key: getattr(user, key) for key in _COLUMNS}
+            self._users.set(user_id, row)
+        if not row['is_active']:
+            raise HTTPException(status_code=400, detail="Inactive user")
+        user = Users(**row)
+        make_transient_to_detached(user)
+        return user
+
+    def invalidate(self, user_id: int) -> None:
+        """
+        Drop user_id here and announce it to the other workers. Safe to call
+        from sync routes (threadpool) as well as from the event loop.
+        """
+        self._users.pop(user_id)
+        if self._loop is None or self._loop.is_closed():
+            return
+        future = asyncio.run_coroutine_threadsafe(
+            self.redis.publish(CONTROL_CHANNEL, json.dumps({'user_id': user_id})), self._loop)
+        future.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(future) -> None:
+        if not future.cancelled() and future.exception():
+            logger.error(f"Auth invalidation publish failed: {future.exception()}")
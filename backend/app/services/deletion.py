@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime
+from typing import Literal
+
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from app.core.config import settings
+from app.core.db import AsyncAutocommitSessionLocal
+from app.crud import deletion as crud
+from app.services.hot_page import HotPageCache
+from app.services.membership import forget_chat_members
+
+logger = logging.getLogger(__name__)
+
+JOB_STREAM = 'jobs:deletion'
+_GROUP = 'deletion'
+
+
+def _job_key(job_id: str) -> str:
+    return f'deletion_job:{job_id}'
+
+
+def _target_key(kind: str, target_id: int) -> str:
+    return f'deletion_target:{kind}:{target_id}'
+
+
+class DeletionJobs:
+    """
+    Deletes users and chats in the background, in batches.
+
+    The API marks the entity deleted (app.crud.deletion.mark_*) and calls
+    enqueue(); one worker per API process takes jobs from JOB_STREAM through
+    a consumer group. Messages and reads go in DELETION_BATCH_SIZE batches
+    by key order, each batch a transaction of its own, with
+    DELETION_BATCH_PAUSE in between; rows referencing the deleted ones go by
+    ON DELETE CASCADE, their message_dedupe and message_archive rows with
+    them (the archive files are left as they are). Every job is idempotent, so one left behind by a
+    crashed process or by an error stays pending and is run again after
+    DELETION_CLAIM_IDLE, up to DELETION_MAX_ATTEMPTS times. A running job
+    keeps its entry claimed between batches.
+
+    Progress lives in the deletion_job:<id> hash for DELETION_JOB_TTL:
+    status (queued, running, retrying, done, failed), attempts, messages
+    and reads deleted so far. The latest job of an entity is kept in
+    deletion_target:<kind>:<id>, see active_job().
+    """
+
+    def __init__(self, redis_client: Redis, hot_pages: HotPageCache):
+        self.redis = redis_client
+        self.hot_pages = hot_pages
+        self.consumer = f'{socket.gethostname()}-{os.getpid()}'
+        self._task: asyncio.Task | None = None
+        self._next_claim = 0.0
+
+    async def enqueue(self, kind: Literal['user', 'chat'], target_id: int, requested_by: int) -> str:
+        job_id = uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(_job_key(job_id), mapping={
+                'id': job_id,
+                'kind': kind,
+                'target_id': target_id,
+                'requested_by': requested_by,
+                'status': 'queued',
+                'attempts': 0,
+                'messages': 0,
+                'reads': 0,
+                'created_at': now,
+                'updated_at': now,
+            })
+            pipe.expire(_job_key(job_id), settings.DELETION_JOB_TTL)
+            pipe.set(_target_key(kind, target_id), job_id, ex=settings.DELETION_JOB_TTL)
+            pipe.xadd(JOB_STREAM, {'job_id': job_id})
+            await pipe.execute()
+        return job_id
+
+    async def progress(self, job_id: str) -> dict[str, str] | None:
+        fields = await self.redis.hgetall(_job_key(job_id))
+        if not fields:
+            return None
+        return {key.decode(): value.decode() for key, value in fields.items()}
+
+    async def active_job(self, kind: Literal['user', 'chat'], target_id: int) -> str | None:
+        """
+        The job still deleting the entity, None when there is none (the
+        last one failed for good or expired) and it has to be enqueued again.
+        """
+        job_id = await self.redis.get(_target_key(kind, target_id))
+        if job_id is None:
+            return None
+        job = await self.progress(job_id.decode())
+        if job is None or job['status'] == 'failed':
+            return None
+        return job['id']
+
+    async def start(self) -> None:
+        try:
+            await self.redis.xgroup_create(JOB_STREAM, _GROUP, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                entry = await self._claim() or await self._read()
+                if entry:
+                    await self._execute(*entry)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Deletion worker error: {e}")
+                await asyncio.sleep(settings.DELETION_CLAIM_IDLE / 10)
+
+    async def _read(self) -> tuple[str, str] | None:
+        result = await self.redis.xreadgroup(
+            _GROUP, self.consumer, {JOB_STREAM: '>'}, count=1, block=1000)
+        if not result or not result[0][1]:
+            return None
+        entry_id, fields = result[0][1][0]
+        return entry_id.decode(), fields[b'job_id'].decode()
+
+    async def _claim(self) -> tuple[str, str] | None:
+        """A job another consumer took but never finished."""
+        if time.monotonic() < self._next_claim:
+            return None
+        _, entries, _ = await self.redis.xautoclaim(
+            JOB_STREAM, _GROUP, self.consumer,
+            min_idle_time=int(settings.DELETION_CLAIM_IDLE * 1000), count=1)
+        entries = [(entry_id, fields) for entry_id, fields in entries if fields]
+        if not entries:
+            self._next_claim = time.monotonic() + settings.DELETION_CLAIM_IDLE / 2
+            return None
+        entry_id, fields = entries[0]
+        return entry_id.decode(), fields[b'job_id'].decode()
+
+    async def _execute(self, entry_id: str, job_id: str) -> None:
+        job = await self.progress(job_id)
+        if job is not None:
+            attempts = await self.redis.hincrby(_job_key(job_id), 'attempts', 1)
+            await self._update(job_id, status='running')
+            try:
+                if job['kind'] == 'chat':
+                    await self._delete_chat(entry_id, job_id, int(job['target_id']))
+                else:
+                    await self._delete_user(entry_id, job_id, int(job['target_id']))
+            except Exception as e:
+                description = f"Deletion job {job_id} ({job['kind']} {job['target_id']})"
+                if attempts < settings.DELETION_MAX_ATTEMPTS:
+                    # left pending, _claim takes it again after DELETION_CLAIM_IDLE
+                    logger.warning(f"{description} failed, attempt {attempts}: {e}")
+                    await self._update(job_id, status='retrying', error=str(e))
+                    return
+                # the entity stays marked deleted, DELETE on it enqueues a new job
+                logger.error(f"{description} failed for good: {e}")
+                await self._update(job_id, status='failed', error=str(e))
+            else:
+                logger.info(f"Deletion job {job_id} ({job['kind']} {job['target_id']}) done")
+                await self._update(job_id, status='done')
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.xack(JOB_STREAM, _GROUP, entry_id)
+            pipe.xdel(JOB_STREAM, entry_id)
+            await pipe.execute()
+
+    async def _update(self, job_id: str, **fields) -> None:
+        await self.redis.hset(
+            _job_key(job_id), mapping={**fields, 'updated_at': datetime.now().isoformat()})
+
+    async def _batch_done(self, entry_id: str, job_id: str, field: str, deleted: int) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hincrby(_job_key(job_id), field, deleted)
+            pipe.hset(_job_key(job_id), 'updated_at', datetime.now().isoformat())
+            # resets the entry's idle time, nobody else claims a running job
+            pipe.xclaim(JOB_STREAM, _GROUP, self.consumer, 0, [entry_id], justid=True)
+            await pipe.execute()
+        if settings.DELETION_BATCH_PAUSE:
+            await asyncio.sleep(settings.DELETION_BATCH_PAUSE)
+
+    async def _delete_chat(self, entry_id: str, job_id: str, chat_id: int) -> None:
+        cursor = (datetime.min, 0)
+        while cursor is not None:
+            async with AsyncAutocommitSessionLocal() as async_session:
+                deleted, cursor = await crud.delete_chat_messages_batch(
+                    async_session=async_session, chat_id=chat_id, after=cursor,
+                    batch_size=settings.DELETION_BATCH_SIZE)
+            await self._batch_done(entry_id, job_id, 'messages', deleted)
+        async with AsyncAutocommitSessionLocal() as async_session:
+            await crud.delete_chat_row(async_session=async_session, chat_id=chat_id)
+        await self.hot_pages.archives_changed()
+
+    async def _delete_user(self, entry_id: str, job_id: str, user_id: int) -> None:
+        async with AsyncAutocommitSessionLocal() as async_session:
+            owned = await crud.get_deleted_chat_ids(async_session=async_session, owner_id=user_id)
+        for chat_id in owned:
+            await self._delete_chat(entry_id, job_id, chat_id)
+
+        touched: set[int] = set()
+        last_id = 0
+        while last_id is not None:
+            async with AsyncAutocommitSessionLocal() as async_session:
+                deleted, last_id, chat_ids = await crud.delete_user_messages_batch(
+                    async_session=async_session, user_id=user_id, after_id=last_id,
+                    batch_size=settings.DELETION_BATCH_SIZE,
+                    read_tracking_mode=settings.READ_TRACKING_MODE)
+            touched.update(chat_ids)
+            await self._batch_done(entry_id, job_id, 'messages', deleted)
+
+        last_id = 0
+        while last_id is not None:
+            async with AsyncAutocommitSessionLocal() as async_session:
+                deleted, last_id = await crud.delete_user_reads_batch(
+                    async_session=async_session, user_id=user_id, after_id=last_id,
+                    batch_size=settings.DELETION_BATCH_SIZE)
+            await self._batch_done(entry_id, job_id, 'reads', deleted)
+
+        for chat_id in touched:
+            await self.hot_pages.invalidate(chat_id)
+        async with AsyncAutocommitSessionLocal() as async_session:
+            if touched:
+                await crud.fix_last_messages(
+                    async_session=async_session, user_id=user_id, chat_ids=list(touched))
+            chat_ids = await crud.delete_user_memberships(
+                async_session=async_session, user_id=user_id)
+            await crud.delete_user_row(async_session=async_session, user_id=user_id)
+        # archived months count the user's messages no more
+        await self.hot_pages.archives_changed()
+        if chat_ids:
+            await forget_chat_members(self.redis, chat_ids)
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import smtplib
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from email.utils import formataddr
+
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from app.core.config import settings
+from app.core.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_STREAM = 'email:outbox'
+# messages given up on, kept for inspection and manual replay
+DEAD_STREAM = 'email:outbox:dead'
+_GROUP = 'email'
+_DEAD_MAXLEN = 10_000
+
+EMAILS_SENT = REGISTRY.counter('emails_sent', 'Emails accepted by the SMTP server')
+EMAILS_FAILED = REGISTRY.counter(
+    'emails_failed', 'Failed email deliveries, retried or dead-lettered', ('outcome',))
+
+
+def _decode(fields: dict) -> dict[str, str]:
+    return {key.decode(): value.decode() for key, value in fields.items()}
+
+
+def _build_message(email: dict[str, str]) -> EmailMessage:
+    message = EmailMessage()
+    message['Subject'] = email['subject']
+    message['From'] = formataddr((settings.EMAILS_FROM_NAME, settings.EMAILS_FROM_EMAIL))
+    message['To'] = email['to']
+    message.set_content(email['html'], subtype='html')
+    return message
+
+
+def _is_permanent(e: Exception) -> bool:
+    # 5xx replies and refused recipients won't get better with a retry
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(e, smtplib.SMTPResponseException) and e.smtp_code >= 500
+
+
+class EmailOutbox:
+    """
+    Durable outbound email queue on the OUTBOX_STREAM Redis stream.
+
+    Routes only enqueue() and return. The worker (start()) reads batches of
+    up to EMAIL_OUTBOX_BATCH through the consumer group shared by all API
+    processes and sends them over one SMTP connection, kept open between
+    batches until EMAIL_SMTP_IDLE_TIMEOUT. An entry is acknowledged and
+    deleted once the server accepted it; entries left pending by a crashed
+    process are claimed by another one after EMAIL_OUTBOX_CLAIM_IDLE.
+
+    A failed message goes back to the end of the stream until it was tried
+    EMAIL_OUTBOX_MAX_ATTEMPTS times, permanent SMTP errors (5xx) and the
+    last failure move it to DEAD_STREAM.
+    """
+
+    def __init__(self, redis_client: Redis):
+        self.redis = redis_client
+        self.consumer = f'{socket.gethostname()}-{os.getpid()}'
+        self._task: asyncio.Task | None = None
+        # smtplib is blocking and the connection is not thread safe
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='smtp')
+        self._smtp: smtplib.SMTP | None = None
+        self._smtp_used_at = 0.0
+        self._next_claim = 0.0
+
+    async def enqueue(self, *, email_to: str, subject: str = "", html_content: str = "") -> str:
+        assert settings.emails_enabled, "no provided configuration for email variables"
+        entry_id = await self.redis.xadd(OUTBOX_STREAM, {
+            'to': email_to, 'subject': subject, 'html': html_content, 'attempts': 0,
+        })
+        return entry_id.decode()
+
+    async def start(self) -> None:
+        try:
+            await self.redis.xgroup_create(OUTBOX_STREAM, _GROUP, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._disconnect)
+        self._executor.shutdown(wait=False)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                entries = await self._claim() or await self._read()
+                if entries:
+                    await self._deliver(entries)
+                elif self._smtp and time.monotonic() - self._smtp_used_at > settings.EMAIL_SMTP_IDLE_TIMEOUT:
+                    await asyncio.get_running_loop().run_in_executor(self._executor, self._disconnect)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Email outbox worker error: {e}")
+                await asyncio.sleep(settings.EMAIL_OUTBOX_RETRY_DELAY)
+
+    async def _read(self) -> list[tuple[str, dict[str, str]]]:
+        result = await self.redis.xreadgroup(
+            _GROUP, self.consumer, {OUTBOX_STREAM: '>'},
+            count=settings.EMAIL_OUTBOX_BATCH, block=1000,
+        )
+        if not result:
+            return []
+        return [(entry_id.decode(), _decode(fields)) for entry_id, fields in result[0][1]]
+
+    async def _claim(self) -> list[tuple[str, dict[str, str]]]:
+        """Entries another consumer read but never acknowledged."""
+        if time.monotonic() < self._next_claim:
+            return []
+        _, entries, _ = await self.redis.xautoclaim(
+            OUTBOX_STREAM, _GROUP, self.consumer,
+            min_idle_time=int(settings.EMAIL_OUTBOX_CLAIM_IDLE * 1000),
+            count=settings.EMAIL_OUTBOX_BATCH,
+        )
+        if not entries:
+            self._next_claim = time.monotonic() + settings.EMAIL_OUTBOX_CLAIM_IDLE / 2
+        return [(entry_id.decode(), _decode(fields)) for entry_id, fields in entries if fields]
+
+    async def _deliver(self, entries: list[tuple[str, dict[str, str]]]) -> None:
+        errors = await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._send_batch, [email for _, email in entries])
+        retried = False
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for (entry_id, email), error in zip(entries, errors):
+                if error is None:
+                    EMAILS_SENT.inc()
+                else:
+                    attempts = int(email['attempts']) + 1
+                    if _is_permanent(error) or attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                        logger.error(f"Giving up on email to {email['to']}: {error}")
+                        EMAILS_FAILED.labels('dead').inc()
+                        pipe.xadd(DEAD_STREAM, {**email, 'attempts': attempts, 'error': str(error)},
+                                  maxlen=_DEAD_MAXLEN, approximate=True)
+                    else:
+                        logger.warning(f"Email to {email['to']} failed, retrying: {error}")
+                        EMAILS_FAILED.labels('retried').inc()
+                        pipe.xadd(OUTBOX_STREAM, {**email, 'attempts': attempts})
+                        retried = True
+                pipe.xack(OUTBOX_STREAM, _GROUP, entry_id)
+                pipe.xdel(OUTBOX_STREAM, entry_id)
+            await pipe.execute()
+        if retried:
+            # mostly the SMTP server being down, don't spin on it
+            await asyncio.sleep(settings.EMAIL_OUTBOX_RETRY_DELAY)
+
+    # Runs in the SMTP thread from here on
+
+    def _connect(self) -> smtplib.SMTP:
+        if settings.SMTP_SSL:
+            smtp = smtplib.SMTP_SSL(
+                settings.SMTP_HOST, settings.SMTP_PORT, timeout=settings.EMAIL_SMTP_TIMEOUT)
+        else:
+            smtp = smtplib.SMTP(
+                settings.SMTP_HOST, settings.SMTP_PORT, timeout=settings.EMAIL_SMTP_TIMEOUT)
+            if settings.SMTP_TLS:
+                smtp.starttls()
+        if settings.SMTP_USER:
+            smtp.login(settings.SMTP_USER, settings.SMTP_PASSWORD or '')
+        return smtp
+
+    def _disconnect(self) -> None:
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except smtplib.SMTPException:
+            self._smtp.close()
+        except OSError:
+            pass
+        self._smtp = None
+
+    def _send_batch(self, emails: list[dict[str, str]]) -> list[Exception | None]:
+        errors: list[Exception | None] = []
+        for email in emails:
+            try:
+                self._send(_build_message(email))
+                errors.append(None)
+            except (smtplib.SMTPException, OSError) as e:
+                errors.append(e)
+                if self._smtp is None:
+                    # the server is unreachable, the rest would wait on it as well
+                    errors.extend([e] * (len(emails) - len(errors)))
+                    break
+        self._smtp_used_at = time.monotonic()
+        return errors
+
+    def _send(self, message: EmailMessage) -> None:
+        if self._smtp is None:
+            self._smtp = self._connect()
+        try:
+            self._smtp.send_message(message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # the server closed the kept connection, one more try on a new one
+            self._smtp = None
+            self._smtp = self._connect()
+            self._smtp.send_message(message)
+        except smtplib.SMTPException:
+            # the session may be mid-transaction, start the next one clean
+            try:
+                self._smtp.rset()
+            except (smtplib.SMTPException, OSError):
+                self._disconnect()
+            raise
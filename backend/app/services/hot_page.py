@@ -0,0 +1,186 @@
+import json
+import logging
+from datetime import date
+
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.crud.messages import get_msg_page
+from app.crud.partitions import ArchivedMonth, get_archived_months
+from app.dto.chatmsg import MessagePublic
+
+logger = logging.getLogger(__name__)
+
+# Replaces the buffer only if no message was pushed (and no invalidation
+# happened) since the version was read before querying Postgres.
+_WARM_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+for i = 3, #ARGV do
+    redis.call('RPUSH', KEYS[1], ARGV[i])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Pushes onto an existing buffer unless a warm that ran between the
+# message's commit and this push already loaded it; bumps the version
+# either way.
+_PUSH_SCRIPT = """
+local id = tonumber(ARGV[1])
+for _, entry in ipairs(redis.call('LRANGE', KEYS[1], 0, -1)) do
+    if cjson.decode(entry).id == id then
+        id = nil
+        break
+    end
+end
+if id then
+    redis.call('LPUSHX', KEYS[1], ARGV[2])
+    redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[3]) - 1)
+end
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return id and 1 or 0
+"""
+
+
+def _page_key(chat_id: int) -> str:
+    return f'chat_hot:{chat_id}'
+
+
+def _version_key(chat_id: int) -> str:
+    return f'chat_hot_ver:{chat_id}'
+
+
+def _archive_key(chat_id: int) -> str:
+    return f'chat_archive:{chat_id}'
+
+
+# bumped whenever the archived months (or their counts) of any chat change
+_ARCHIVE_GENERATION_KEY = 'chat_archive_gen'
+
+
+def _sort_key(message: dict) -> tuple[str, int]:
+    return message['created_at'], message['id']
+
+
+class HotPageCache:
+    """
+    Ring buffer of the newest CHAT_HOT_PAGE_SIZE MessagePublic payloads of
+    a chat, newest first, in a Redis list.
+
+    The buffer only exists once it was warmed from Postgres, new messages
+    are pushed with LPUSHX so a chat is never served from a partial list,
+    and skipped when a warm after their commit already has them.
+    While it exists it holds min(CHAT_HOT_PAGE_SIZE, messages in chat)
+    entries: a shorter list means the whole chat is cached.
+    read_by_users is part of the payload, so new reads invalidate it.
+
+    Next to it, the archived months of a chat (most chats have none) are
+    kept for CHAT_HOT_PAGE_TTL or until archives_changed, so a history
+    request doesn't look them up in message_archive.
+    """
+
+    def __init__(self, redis_client: Redis):
+        self.redis = redis_client
+        self.size = settings.CHAT_HOT_PAGE_SIZE
+        self._warm = self.redis.register_script(_WARM_SCRIPT)
+        self._push = self.redis.register_script(_PUSH_SCRIPT)
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    async def push(self, message: dict) -> None:
+        """message: MessagePublic.model_dump(mode='json') of a new message."""
+        if not self.enabled:
+            return
+        chat_id = message['chat_id']
+        await self._push(
+            keys=[_page_key(chat_id), _version_key(chat_id)],
+            args=[message['id'], json.dumps(message), self.size, settings.CHAT_HOT_PAGE_TTL],
+        )
+
+    async def invalidate(self, chat_id: int) -> None:
+        if not self.enabled:
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(_page_key(chat_id))
+            pipe.incr(_version_key(chat_id))
+            pipe.expire(_version_key(chat_id), settings.CHAT_HOT_PAGE_TTL)
+            await pipe.execute()
+
+    async def _load(self, chat_id: int, *, async_session: AsyncSession) -> list[dict]:
+        cached = await self.redis.lrange(_page_key(chat_id), 0, -1)
+        if cached:
+            return sorted((json.loads(raw) for raw in cached), key=_sort_key)
+
+        version = await self.redis.get(_version_key(chat_id))
+        version = version.decode() if version else '0'
+        messages, _ = await get_msg_page(
+            async_session=async_session, chat_id=chat_id, limit=self.size)
+        payloads = [
+            MessagePublic.model_validate(msg).model_dump(mode='json')
+            for msg in messages
+        ]
+        if payloads:
+            stored = await self._warm(
+                keys=[_page_key(chat_id), _version_key(chat_id)],
+                args=[
+                    version,
+                    settings.CHAT_HOT_PAGE_TTL,
+                    *(json.dumps(payload) for payload in reversed(payloads)),
+                ],
+            )
+            if not stored:
+                logger.info(f"Hot page of chat {chat_id} changed while warming, not stored")
+        return payloads
+
+    async def latest(self, chat_id: int, limit: int, *, async_session: AsyncSession) -> list[dict] | None:
+        """
+        The newest `limit` messages, oldest first, or None when limit does
+        not fit in the buffer and the caller has to query Postgres.
+        """
+        if not self.enabled or limit > self.size:
+            return None
+        messages = await self._load(chat_id, async_session=async_session)
+        return messages[-limit:] if limit > 0 else []
+
+    async def from_start(self, chat_id: int, limit: int | None, offset: int | None,
+                         *, async_session: AsyncSession) -> list[dict] | None:
+        """
+        The legacy oldest-first limit/offset window, answered only when the
+        whole chat fits in the buffer.
+        """
+        if not self.enabled:
+            return None
+        messages = await self._load(chat_id, async_session=async_session)
+        if len(messages) >= self.size:
+            return None
+        start = offset or 0
+        return messages[start:start + limit] if limit else messages[start:]
+
+    async def archived_months(self, chat_id: int, *, async_session: AsyncSession) -> list[ArchivedMonth]:
+        """get_archived_months of the chat."""
+        generation, cached = await self.redis.mget(_ARCHIVE_GENERATION_KEY, _archive_key(chat_id))
+        generation = generation.decode() if generation else '0'
+        if cached:
+            entry = json.loads(cached)
+            if entry['generation'] == generation:
+                return [ArchivedMonth(date.fromisoformat(month), *rest)
+                        for month, *rest in entry['months']]
+
+        months = await get_archived_months(async_session=async_session, chat_id=chat_id)
+        # stored under the generation read first, a change meanwhile discards it
+        await self.redis.set(_archive_key(chat_id), json.dumps({
+            'generation': generation,
+            'months': [[archived.month.isoformat(), *archived[1:]] for archived in months],
+        }), ex=settings.CHAT_HOT_PAGE_TTL)
+        return months
+
+    async def archives_changed(self) -> None:
+        """A month was archived or a user deleted, drops every cached archived_months."""
+        await self.redis.incr(_ARCHIVE_GENERATION_KEY)
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import logging
+from uuid import UUID
+
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.core.pubsub import PubSubHub
+from app.crud.groups import direct_pair, find_lc_group_id, get_chat_from_uuid, get_chat_member_ids
+
+logger = logging.getLogger(__name__)
+
+CONTROL_CHANNEL = 'ctl_chat_membership'
+# Stored in every Redis members set so that "no members" and "not cached"
+# can be told apart; user ids start at 1.
+_EMPTY_MARKER = 0
+
+# Fills the set from a Postgres read only if no membership change (and no
+# invalidation) bumped the version since it was read before the query.
+_FILL_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+for i = 3, #ARGV do
+    redis.call('SADD', KEYS[1], ARGV[i])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def _members_key(chat_id: int) -> str:
+    return f'chat_members:{chat_id}'
+
+
+def _version_key(chat_id: int) -> str:
+    return f'chat_members_ver:{chat_id}'
+
+
+def _chat_uuid_key(chat_uuid: str) -> str:
+    return f'chat_uuid:{chat_uuid}'
+
+
+def user_control_channel(user_id: int) -> str:
+    return f'user_ctl_{user_id}'
+
+
+async def forget_chat_members(redis_client: Redis, chat_ids) -> None:
+    """
+    Drop the cached members of chat_ids in Redis and on every worker, for
+    writers without a ChatMembershipCache (scripts). The next lookup
+    reloads them from Postgres.
+    """
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for chat_id in chat_ids:
+            pipe.delete(_members_key(chat_id))
+            pipe.incr(_version_key(chat_id))
+            pipe.expire(_version_key(chat_id), settings.CHAT_MEMBERSHIP_REDIS_TTL)
+            pipe.publish(CONTROL_CHANNEL, json.dumps({'chat_id': chat_id}))
+        await pipe.execute()
+
+
+class ChatMembershipCache:
+    """
+    Answers "is user X in chat Y" without Postgres in the steady state.
+
+    Lookups go per-process LRU -> Redis set -> Postgres (which then fills
+    Redis). Membership changes rewrite the Redis set, bump its version (a
+    fill from an older Postgres read is then discarded) and are announced
+    on CONTROL_CHANNEL so every worker evicts its local copy.
+    """
+
+    def __init__(self, redis_client: Redis, hub: PubSubHub):
+        self.redis = redis_client
+        self.hub = hub
+        self._members = LRUCache(
+            settings.CHAT_MEMBERSHIP_CACHE_SIZE, settings.CHAT_MEMBERSHIP_CACHE_TTL)
+        self._chat_ids = LRUCache(
+            settings.CHAT_MEMBERSHIP_CACHE_SIZE, settings.CHAT_MEMBERSHIP_CACHE_TTL)
+        # (min_user_id, max_user_id) -> direct chat id, local only
+        self._direct_chats = LRUCache(
+            settings.CHAT_MEMBERSHIP_CACHE_SIZE, settings.CHAT_MEMBERSHIP_CACHE_TTL)
+        self._fill = self.redis.register_script(_FILL_SCRIPT)
+        # control messages seen, a load that overlaps one isn't kept locally
+        self._evictions = 0
+
+    async def start(self) -> None:
+        await self.hub.subscribe(self, CONTROL_CHANNEL)
+
+    async def close(self) -> None:
+        await self.hub.unsubscribe(self)
+
+    def put_nowait(self, payload: str) -> None:
+        # Hub sink for CONTROL_CHANNEL
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logger.error(f"Bad membership control message: {payload}")
+            return
+        self._evictions += 1
+        self._members.pop(event.get('chat_id'))
+        if event.get('chat_uuid'):
+            self._chat_ids.pop(event['chat_uuid'])
+        if event.get('direct_pair'):
+            self._direct_chats.pop(tuple(event['direct_pair']))
+
+    async def _store(self, chat_id: int, member_ids) -> None:
+        key = _members_key(chat_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.sadd(key, _EMPTY_MARKER, *member_ids)
+            pipe.expire(key, settings.CHAT_MEMBERSHIP_REDIS_TTL)
+            pipe.incr(_version_key(chat_id))
+            pipe.expire(_version_key(chat_id), settings.CHAT_MEMBERSHIP_REDIS_TTL)
+            await pipe.execute()
+
+    async def members(self, chat_id: int, *, async_session: AsyncSession) -> frozenset[int]:
+        members = self._members.get(chat_id)
+        if members is not None:
+            return members
+        raw = await self.redis.smembers(_members_key(chat_id))
+        if raw:
+            members = frozenset(int(i) for i in raw) - {_EMPTY_MARKER}
+            self._members.set(chat_id, members)
+            return members
+
+        evictions = self._evictions
+        version = await self.redis.get(_version_key(chat_id))
+        version = version.decode() if version else '0'
+        members = frozenset(await get_chat_member_ids(
+            async_session=async_session, chat_id=chat_id))
+        stored = await self._fill(
+            keys=[_members_key(chat_id), _version_key(chat_id)],
+            args=[version, settings.CHAT_MEMBERSHIP_REDIS_TTL, _EMPTY_MARKER, *members],
+        )
+        if stored and evictions == self._evictions:
+            self._members.set(chat_id, members)
+        else:
+            # changed meanwhile, answer from this read but don't keep it
+            logger.info(f"Members of chat {chat_id} changed while loading, not cached")
+        return members
+
+    async def is_member(self, chat_id: int, user_id: int, *, async_session: AsyncSession) -> bool:
+        return user_id in await self.members(chat_id, async_session=async_session)
+
+    async def resolve_chat_uuid(self, chat_uuid: str | UUID, *, async_session: AsyncSession) -> int | None:
+        chat_uuid = str(chat_uuid)
+        chat_id = self._chat_ids.get(chat_uuid)
+        if chat_id is not None:
+            return chat_id
+        raw = await self.redis.get(_chat_uuid_key(chat_uuid))
+        if raw is not None:
+            chat_id = int(raw)
+        else:
+            chat_id = await get_chat_from_uuid(
+                async_session=async_session, chat_uuid=chat_uuid, only_id=True)
+            if chat_id is None:
+                return None
+            await self.redis.set(
+                _chat_uuid_key(chat_uuid), chat_id, ex=settings.CHAT_MEMBERSHIP_REDIS_TTL)
+        self._chat_ids.set(chat_uuid, chat_id)
+        return chat_id
+
+    async def direct_chat_id(self, user_1_id: int, user_2_id: int, *, async_session: AsyncSession) -> int | None:
+        pair = direct_pair(user_1_id, user_2_id)
+        chat_id = self._direct_chats.get(pair)
+        if chat_id is None:
+            # misses are not cached, the chat may be created later
+            chat_id = await find_lc_group_id(
+                async_session=async_session, user_1_id=user_1_id, user_2_id=user_2_id)
+            if chat_id is not None:
+                self._direct_chats.set(pair, chat_id)
+        return chat_id
+
+    async def set_members(self, chat_id: int, member_ids) -> None:
+        """Call after participants of chat_id were added or removed."""
+        await self._store(chat_id, member_ids)
+        await self._announce(chat_id)
+
+    async def forget_members(self, chat_ids) -> None:
+        """Call after participants were added in bulk (known only to Postgres)."""
+        for chat_id in chat_ids:
+            self._members.pop(chat_id)
+        await forget_chat_members(self.redis, chat_ids)
+
+    async def drop_chat(
+        self,
+        chat_id: int,
+        chat_uuid: str | UUID | None = None,
+        direct_user_ids: tuple[int, int] | None = None,
+    ) -> None:
+        """Call after chat_id was deleted."""
+        await self._store(chat_id, ())
+        if chat_uuid:
+            await self.redis.delete(_chat_uuid_key(str(chat_uuid)))
+        await self._announce(chat_id, chat_uuid, direct_user_ids)
+
+    async def announce_channel(self, user_ids, channel: str, *, joined: bool) -> None:
+        """
+        Make the open sockets of user_ids subscribe to (or drop) channel,
+        call after the membership change is committed.
+        """
+        payload = json.dumps({'op': 'join' if joined else 'leave', 'channel': channel})
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in set(user_ids):
+                pipe.publish(user_control_channel(user_id), payload)
+            await pipe.execute()
+
+    async def _announce(
+        self,
+        chat_id: int,
+        chat_uuid: str | UUID | None = None,
+        direct_user_ids: tuple[int, int] | None = None,
+    ) -> None:
+        payload = json.dumps({
+            'chat_id': chat_id,
+            'chat_uuid': str(chat_uuid) if chat_uuid else None,
+            'direct_pair': direct_pair(*direct_user_ids) if direct_user_ids else None,
+        })
+        # the local copy goes away now, other workers follow via pub/sub
+        self.put_nowait(payload)
+        await self.redis.publish(CONTROL_CHANNEL, payload)
+
+
+class SocketChannelControl:
+    """
+    Hub sink on the user's control channel for a single socket: join and
+    leave events from announce_channel() are applied to the socket's own
+    sink, in the order they were published.
+
+    Events are buffered from start() and applied only after resume(), so a
+    leave committed while the socket was loading its chats from Postgres
+    can't be overtaken by the initial subscribe.
+    """
+
+    def __init__(self, hub: PubSubHub, sink, user_id: int):
+        self.hub = hub
+        self.sink = sink
+        self.channel = user_control_channel(user_id)
+        self._events: asyncio.Queue[str] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        await self.hub.subscribe(self, self.channel)
+
+    def resume(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def put_nowait(self, payload: str) -> None:
+        self._events.put_nowait(payload)
+
+    async def _run(self) -> None:
+        while True:
+            payload = await self._events.get()
+            try:
+                event = json.loads(payload)
+                if event['op'] == 'join':
+                    await self.hub.subscribe(self.sink, event['channel'])
+                elif event['op'] == 'leave':
+                    await self.hub.unsubscribe(self.sink, event['channel'])
+                else:
+                    logger.error(f"Unknown channel control op: {payload}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to apply channel control {payload}: {e}")
+
+    async def close(self) -> None:
+        await self.hub.unsubscribe(self)
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.db import AsyncAutocommitSessionLocal
+from app.core.metrics import REGISTRY
+from app.crud import partitions as crud
+from app.services.hot_page import HotPageCache
+
+logger = logging.getLogger(__name__)
+
+# any constant, the same in every process of the app
+_LOCK_KEY = 0x6d736770
+
+MONTHS_ARCHIVED = REGISTRY.counter(
+    'message_months_archived', 'Monthly message partitions exported and dropped')
+
+
+class MessagePartitions:
+    """
+    Maintains the monthly partitions of message and message_read.
+
+    Every API process checks each MESSAGE_PARTITION_CHECK_INTERVAL unless
+    WORKER is off, a Postgres advisory lock lets a single one do the work:
+    partitions exist for the current month and MESSAGE_PARTITIONS_AHEAD
+    more, and with MESSAGE_RETENTION_MONTHS set, the months before that
+    many are detached, exported to MESSAGE_ARCHIVE_DIR and dropped.
+    app.crud.messages reads the exported months back, a chat at a time.
+    A month left half archived by a crash is finished on the next check.
+    """
+
+    def __init__(self, hot_pages: HotPageCache):
+        self.hot_pages = hot_pages
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.maintain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Message partition maintenance failed: {e}")
+            await asyncio.sleep(settings.MESSAGE_PARTITION_CHECK_INTERVAL)
+
+    async def maintain(self) -> None:
+        async with AsyncAutocommitSessionLocal() as async_session:
+            # session level, the autocommit session keeps its connection
+            locked = (await async_session.execute(
+                text('SELECT pg_try_advisory_lock(:key)'), {'key': _LOCK_KEY})).scalar()
+            if not locked:
+                return
+            try:
+                current = date.today().replace(day=1)
+                created = await crud.create_partitions(
+                    async_session=async_session, first=current,
+                    months=settings.MESSAGE_PARTITIONS_AHEAD + 1)
+                if created:
+                    logger.info(f"Created message partitions {', '.join(created)}")
+                if settings.MESSAGE_RETENTION_MONTHS:
+                    await self._archive(
+                        async_session, crud.add_months(current, -settings.MESSAGE_RETENTION_MONTHS))
+            finally:
+                await async_session.execute(
+                    text('SELECT pg_advisory_unlock(:key)'), {'key': _LOCK_KEY})
+
+    async def _archive(self, async_session: AsyncSession, cutoff: date) -> None:
+        for month in await crud.get_partition_months(async_session=async_session):
+            if month < cutoff:
+                await crud.detach_month(async_session=async_session, month=month)
+
+        os.makedirs(settings.MESSAGE_ARCHIVE_DIR, exist_ok=True)
+        for month in await crud.get_detached_months(async_session=async_session):
+            members = await crud.export_month(
+                async_session=async_session, month=month, directory=settings.MESSAGE_ARCHIVE_DIR)
+            await crud.record_month(async_session=async_session, month=month, members=members)
+            await self.hot_pages.archives_changed()
+            MONTHS_ARCHIVED.inc()
+            logger.info(f"Archived messages of {month:%Y-%m} to {settings.MESSAGE_ARCHIVE_DIR}")
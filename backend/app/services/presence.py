@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from collections import Counter, defaultdict
+from typing import Iterable
+
+from redis.asyncio import Redis
+
+from app.core.config import settings
+from app.core.streams import MessageTransport
+from app.dto.users import UserPresence
+from app.dto.chatmsg import NotifyMsg
+
+logger = logging.getLogger(__name__)
+
+# Users per last-seen hash: small hashes stay listpack encoded
+# (hash-max-listpack-entries defaults to 128), a few bytes per user.
+_BUCKET_SIZE = 100
+
+
+def _bucket_key(user_id: int) -> str:
+    return f'presence:{user_id // _BUCKET_SIZE}'
+
+
+class PresenceService:
+    """
+    Online status and last-seen time of users, fed by /ws/chat.
+
+    Every user has one field in a bucketed Redis hash: the unix time of the
+    last heartbeat while connected, or minus the disconnect time once the
+    last socket is gone. A user counts as online while the last heartbeat
+    is younger than PRESENCE_TTL, so sockets of a crashed worker expire on
+    their own. The worker heartbeats all its connected users with a single
+    pipeline every PRESENCE_HEARTBEAT.
+
+    Online/offline changes are pushed to the user's chats as PRESENCE
+    notifications once per PRESENCE_PUSH_WINDOW; a user that went offline
+    and back within the window produces nothing. A crashed worker's users
+    expire silently, without a push.
+    """
+
+    def __init__(self, redis_client: Redis, transport: MessageTransport):
+        self.redis = redis_client
+        self.transport = transport
+        self._local: Counter[int] = Counter()
+        # channels a user's presence changes are published on
+        self._audience: dict[int, list[str]] = {}
+        # user id -> [online before the window, online now]
+        self._pending: dict[int, list[bool]] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._every(settings.PRESENCE_HEARTBEAT, self._heartbeat)),
+            asyncio.create_task(self._every(settings.PRESENCE_PUSH_WINDOW, self._flush)),
+        ]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _every(self, interval: float, job) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await job()
+            except Exception as e:
+                logger.error(f"Presence {job.__name__} failed: {e}")
+
+    async def _write(self, stamps: dict[int, int]) -> None:
+        by_bucket: dict[str, dict[int, int]] = defaultdict(dict)
+        for user_id, stamp in stamps.items():
+            by_bucket[_bucket_key(user_id)][user_id] = stamp
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, fields in by_bucket.items():
+                pipe.hset(key, mapping=fields)
+                pipe.expire(key, settings.PRESENCE_LAST_SEEN_TTL)
+            await pipe.execute()
+
+    async def _heartbeat(self) -> None:
+        if self._local:
+            now = int(time.time())
+            await self._write({user_id: now for user_id in self._local})
+
+    async def touch(self, user_id: int) -> None:
+        await self._write({user_id: int(time.time())})
+
+    async def connect(self, user_id: int, channels: Iterable[str]) -> None:
+        """A socket of user_id was opened, channels reach the user's chat partners."""
+        was_online = (await self.query([user_id]))[user_id].online
+        self._local[user_id] += 1
+        self._audience[user_id] = list(channels)
+        await self.touch(user_id)
+        self._changed(user_id, was_online, True)
+
+    async def disconnect(self, user_id: int, *, last_socket: bool) -> None:
+        """
+        A socket of user_id was closed. last_socket: no other socket of the
+        user is open on any node.
+        """
+        self._local[user_id] -= 1
+        if self._local[user_id] <= 0:
+            del self._local[user_id]
+        if last_socket:
+            await self._write({user_id: -int(time.time())})
+            self._changed(user_id, True, False)
+        elif user_id not in self._local:
+            self._audience.pop(user_id, None)
+
+    def _changed(self, user_id: int, before: bool, after: bool) -> None:
+        if user_id in self._pending:
+            self._pending[user_id][1] = after
+        else:
+            self._pending[user_id] = [before, after]
+
+    async def query(self, user_ids: Iterable[int]) -> dict[int, UserPresence]:
+        """Presence of user_ids in one pipelined round trip."""
+        by_bucket: dict[str, list[int]] = defaultdict(list)
+        for user_id in dict.fromkeys(user_ids):
+            by_bucket[_bucket_key(user_id)].append(user_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key, bucket_ids in by_bucket.items():
+                pipe.hmget(key, bucket_ids)
+            replies = await pipe.execute()
+
+        now = time.time()
+        result = {}
+        for bucket_ids, stamps in zip(by_bucket.values(), replies):
+            for user_id, stamp in zip(bucket_ids, stamps):
+                stamp = int(stamp) if stamp is not None else None
+                result[user_id] = UserPresence(
+                    user_id=user_id,
+                    online=stamp is not None and stamp > 0 and now - stamp < settings.PRESENCE_TTL,
+                    last_seen=abs(stamp) if stamp is not None else None,
+                )
+        return result
+
+    async def _flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        changed = {
+            user_id: after for user_id, (before, after) in pending.items()
+            if before != after
+        }
+        audience = {user_id: self._audience.get(user_id, ()) for user_id in changed}
+        for user_id in pending:
+            if user_id not in self._local:
+                self._audience.pop(user_id, None)
+        if not changed:
+            return
+
+        now = int(time.time())
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id, online in changed.items():
+                payload = NotifyMsg(
+                    type='PRESENCE',
+                    meta_data=UserPresence(
+                        user_id=user_id, online=online, last_seen=now).model_dump(),
+                    content='',
+                ).model_dump_json()
+                for channel in audience.get(user_id, ()):
+                    await self.transport.publish(channel, payload, client=pipe)
+            await pipe.execute()
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+from typing import Iterable
+
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.core.streams import MessageTransport
+from app.dto.chatmsg import NotifyMsg
+
+logger = logging.getLogger(__name__)
+
+
+class TypingRelay:
+    """
+    Ephemeral "user is typing" events, never persisted.
+
+    A user is accepted at most once per WS_TYPING_USER_INTERVAL per chat,
+    everything above that is dropped. Accepted typers are collected per
+    channel and published as one TYPING notification per channel every
+    WS_TYPING_WINDOW. Coalescing is per worker: a chat with typers on
+    several workers gets one fan-out per window from each of them.
+    """
+
+    def __init__(self, transport: MessageTransport):
+        self.transport = transport
+        self._recent = LRUCache(
+            settings.WS_TYPING_CACHE_SIZE, settings.WS_TYPING_USER_INTERVAL)
+        # channel -> (chat_id, typing user ids, recipients)
+        self._pending: dict[str, tuple[int, set[int], Iterable[int]]] = {}
+        self._task: asyncio.Task | None = None
+        self.accepted = 0
+        self.dropped = 0
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def accept(self, user_id: int, chat_type: str | None, receiver_id) -> bool:
+        """
+        Rate limit, checked before the chat is resolved so dropped events
+        cost no lookups at all.
+        """
+        key = (user_id, chat_type, str(receiver_id))
+        if key in self._recent:
+            self.dropped += 1
+            return False
+        self._recent.set(key, True)
+        self.accepted += 1
+        return True
+
+    def offer(self, channel: str, chat_id: int, user_id: int, recipients: Iterable[int]) -> None:
+        if channel in self._pending:
+            self._pending[channel][1].add(user_id)
+        else:
+            self._pending[channel] = (chat_id, {user_id}, recipients)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(settings.WS_TYPING_WINDOW)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Typing flush failed: {e}")
+
+    async def flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        async with self.transport.redis.pipeline(transaction=False) as pipe:
+            for channel, (chat_id, user_ids, recipients) in pending.items():
+                payload = NotifyMsg(
+                    type='TYPING',
+                    meta_data={'chat_id': chat_id, 'user_ids': sorted(user_ids)},
+                    content='',
+                ).model_dump_json()
+                await self.transport.publish(
+                    channel, payload, recipients=recipients, ephemeral=True, client=pipe)
+            await pipe.execute()
@@ -0,0 +1,194 @@
+import codecs
+import csv
+import json
+import logging
+from typing import AsyncIterable, AsyncIterator, Sequence
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.security import get_password_hashes_async
+from app.crud import users as crud
+from app.crud.groups import add_participants_bulk, get_group_ids
+from app.dto import UserCreate, UserImportIssue, UserImportReport
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'ndjson')
+# bind params of one membership INSERT, asyncpg takes 32767
+_MEMBERSHIP_PARAMS = 25_000
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """Lines of a UTF-8 byte stream (request body, file) without newlines."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    tail = ''
+    async for chunk in chunks:
+        lines = (tail + decoder.decode(chunk)).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line.rstrip('\r')
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        yield tail.rstrip('\r')
+
+
+async def iter_records(
+    lines: AsyncIterable[str], fmt: str
+) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """
+    (line number, record, error) per non-empty line. CSV needs a header
+    row with the UserCreate field names; quoted fields can't span lines.
+    """
+    header = None
+    number = 0
+    async for line in lines:
+        number += 1
+        if not line.strip():
+            continue
+        if fmt == 'ndjson':
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield number, None, 'invalid JSON'
+                continue
+            if not isinstance(record, dict):
+                yield number, None, 'expected a JSON object'
+                continue
+            yield number, record, None
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield number, None, f'expected {len(header)} columns, got {len(values)}'
+            continue
+        # empty cells fall back to the field defaults
+        yield number, {name: value for name, value in zip(header, values) if value != ''}, None
+
+
+def _validation_error(e: ValidationError) -> str:
+    return '; '.join(
+        f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+        for error in e.errors()
+    )
+
+
+async def _import_chunk(
+    async_session: AsyncSession,
+    chunk: list[tuple[int, UserCreate]],
+    chat_ids: list[int],
+    report: UserImportReport,
+) -> None:
+    existing = await crud.get_existing_emails(
+        async_session=async_session, emails=[user.email for _, user in chunk])
+    accepted = []
+    for number, user_in in chunk:
+        if user_in.email in existing:
+            report.issues.append(
+                UserImportIssue(line=number, email=user_in.email, error='email already exists'))
+        else:
+            accepted.append((number, user_in))
+    if not accepted:
+        return
+
+    hashes = await get_password_hashes_async([user_in.password for _, user_in in accepted])
+    inserted = await crud.insert_users(
+        async_session=async_session,
+        users=[crud.build_user(user_in, hashed) for (_, user_in), hashed in zip(accepted, hashes)],
+    )
+    for number, user_in in accepted:
+        # taken by a concurrent insert after the lookup above
+        if user_in.email not in inserted:
+            report.issues.append(
+                UserImportIssue(line=number, email=user_in.email, error='email already exists'))
+
+    user_ids = list(inserted.values())
+    if chat_ids and user_ids:
+        step = max(1, _MEMBERSHIP_PARAMS // (5 * len(chat_ids)))
+        for start in range(0, len(user_ids), step):
+            report.memberships += await add_participants_bulk(
+                async_session=async_session,
+                chat_ids=chat_ids,
+                user_ids=user_ids[start:start + step],
+            )
+    await async_session.commit()
+    report.created += len(inserted)
+
+
+async def import_users(
+    *,
+    async_session: AsyncSession,
+    records: AsyncIterable[tuple[int, dict | None, str | None]],
+    chat_ids: Sequence[int] = (),
+) -> UserImportReport:
+    """
+    Creates the users of records (from iter_records) in chunks of
+    USER_IMPORT_CHUNK_SIZE: passwords are hashed on the process pool, each
+    chunk is one multi-row INSERT and one commit. Invalid rows and emails
+    that already exist (or repeat within the import) end up in the
+    report's issues, the rest of the chunk goes in regardless.
+
+    Imported users join the group chats chat_ids in the same transaction.
+    No welcome emails are sent: the passwords come from the importer.
+
+    When hashing is refused (pool busy or the client over its limit) the
+    chunk is rolled back and the import stops with resume_line set: the
+    earlier chunks stay committed, and sending the input again from that
+    line (after the CSV header) finishes it.
+    """
+    chat_ids = list(dict.fromkeys(chat_ids))
+    if chat_ids:
+        found = await get_group_ids(async_session=async_session, chat_ids=chat_ids)
+        missing = [chat_id for chat_id in chat_ids if chat_id not in found]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Group chats not found: {missing}")
+
+    report = UserImportReport()
+    seen: set[str] = set()
+    chunk: list[tuple[int, UserCreate]] = []
+
+    async def flush() -> bool:
+        try:
+            await _import_chunk(async_session, chunk, chat_ids, report)
+        except HTTPException as e:
+            if e.status_code not in (429, 503):
+                raise
+            await async_session.rollback()
+            report.resume_line = chunk[0][0]
+            # reported again when the rest is sent
+            report.issues = [issue for issue in report.issues if issue.line < report.resume_line]
+            logger.warning(f"User import stopped at line {report.resume_line}: {e.detail}")
+            return False
+        return True
+    async for number, record, error in records:
+        if error is None:
+            try:
+                user_in = UserCreate.model_validate(record)
+            except ValidationError as e:
+                error = _validation_error(e)
+        if error is not None:
+            email = str(record['email']) if record and record.get('email') else None
+            report.issues.append(UserImportIssue(line=number, email=email, error=error))
+            continue
+        if user_in.email in seen:
+            report.issues.append(
+                UserImportIssue(line=number, email=user_in.email, error='duplicate email in import'))
+            continue
+        seen.add(user_in.email)
+        chunk.append((number, user_in))
+        if len(chunk) >= settings.USER_IMPORT_CHUNK_SIZE:
+            if not await flush():
+                return report
+            chunk = []
+    if chunk and not await flush():
+        return report
+
+    logger.info(
+        f"User import: {report.created} created, {report.memberships} memberships, "
+        f"{len(report.issues)} rows skipped"
+    )
+    return report
@@ -5,10 +5,10 @@ from sqlmodel import Session
 
 from app.core.config import settings
 from app.core.security import verify_password
-from app.crud import create_user
-from app.models import UserCreate
+from app.crud import users as crud
+from app.models import UserCreate, Users
 from app.tests.utils.user import user_authentication_headers
-from app.tests.utils.utils import random_email, random_lower_string
+from app.tests.utils.utils import random_email, random_lower_string, run_crud
 from app.utils import generate_password_reset_token
 
 
@@ -86,7 +86,7 @@ def test_reset_password(client: TestClient, db: Session) -> None:
         is_active=True,
         is_superuser=False,
     )
-    user = create_user(session=db, user_create=user_create)
+    user = run_crud(crud.create_user, user_create=user_create)
     token = generate_password_reset_token(email=email)
     headers = user_authentication_headers(
         client=client, email=email, password=password)
@@ -101,6 +101,7 @@ def test_reset_password(client: TestClient, db: Session) -> None:
     assert r.status_code == 200
     assert r.json() == {"message": "Password updated successfully"}
 
+    user = db.get(Users, user.id)
     db.refresh(user)
     assert verify_password(new_password, user.hashed_password)
 
@@ -1,3 +1,4 @@
+import time
 import uuid
 from unittest.mock import patch
 
@@ -8,7 +9,7 @@ from app.crud import users as crud
 from app.core.config import settings
 from app.core.security import verify_password
 from app.models import Users, UserCreate
-from app.tests.utils.utils import random_email, random_lower_string
+from app.tests.utils.utils import random_email, random_lower_string, run_crud
 
 
 def test_get_users_superuser_me(
@@ -53,7 +54,7 @@ def test_create_user_new_email(
         )
         assert 200 <= r.status_code < 300
         created_user = r.json()
-        user = crud.get_user_by_email(session=db, email=username)
+        user = run_crud(crud.get_user_by_email, email=username)
         assert user
         assert user.email == created_user["email"]
 
@@ -64,7 +65,7 @@ def test_get_existing_user(
     username = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=username, password=password)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
     user_id = user.id
     r = client.get(
         f"{settings.API_V1_STR}/users/{user_id}",
@@ -72,7 +73,7 @@ def test_get_existing_user(
     )
     assert 200 <= r.status_code < 300
     api_user = r.json()
-    existing_user = crud.get_user_by_email(session=db, email=username)
+    existing_user = run_crud(crud.get_user_by_email, email=username)
     assert existing_user
     assert existing_user.email == api_user["email"]
 
@@ -81,7 +82,7 @@ def test_get_existing_user_current_user(client: TestClient, db: Session) -> None
     username = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=username, password=password)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
     user_id = user.id
 
     login_data = {
@@ -100,7 +101,7 @@ def test_get_existing_user_current_user(client: TestClient, db: Session) -> None
     )
     assert 200 <= r.status_code < 300
     api_user = r.json()
-    existing_user = crud.get_user_by_email(session=db, email=username)
+    existing_user = run_crud(crud.get_user_by_email, email=username)
     assert existing_user
     assert existing_user.email == api_user["email"]
 
@@ -116,6 +117,17 @@ def test_get_existing_user_permissions_error(
     assert r.json() == {"detail": "The user doesn't have enough privileges"}
 
 
+def test_get_user_not_found(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/users/999999999",
+        headers=superuser_token_headers,
+    )
+    assert r.status_code == 404
+    assert r.json() == {"detail": "The user with this id does not exist in the system"}
+
+
 def test_create_user_existing_username(
     client: TestClient, superuser_token_headers: dict[str, str], db: Session
 ) -> None:
@@ -123,7 +135,7 @@ def test_create_user_existing_username(
     # username = email
     password = random_lower_string()
     user_in = UserCreate(email=username, password=password)
-    crud.create_user(session=db, user_create=user_in)
+    run_crud(crud.create_user, user_create=user_in)
     data = {"email": username, "password": password}
     r = client.post(
         f"{settings.API_V1_STR}/users/",
@@ -155,12 +167,12 @@ def test_retrieve_users(
     username = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=username, password=password)
-    crud.create_user(session=db, user_create=user_in)
+    run_crud(crud.create_user, user_create=user_in)
 
     username2 = random_email()
     password2 = random_lower_string()
     user_in2 = UserCreate(email=username2, password=password2)
-    crud.create_user(session=db, user_create=user_in2)
+    run_crud(crud.create_user, user_create=user_in2)
 
     r = client.get(f"{settings.API_V1_STR}/users/",
                    headers=superuser_token_headers)
@@ -256,7 +268,7 @@ def test_update_user_me_email_exists(
     username = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=username, password=password)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
 
     data = {"email": user.email}
     r = client.patch(
@@ -332,7 +344,7 @@ def test_update_user(
     username = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=username, password=password)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
 
     data = {"full_name": "Updated_full_name"}
     r = client.patch(
@@ -372,12 +384,12 @@ def test_update_user_email_exists(
     username = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=username, password=password)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
 
     username2 = random_email()
     password2 = random_lower_string()
     user_in2 = UserCreate(email=username2, password=password2)
-    user2 = crud.create_user(session=db, user_create=user_in2)
+    user2 = run_crud(crud.create_user, user_create=user_in2)
 
     data = {"email": user2.email}
     r = client.patch(
@@ -389,11 +401,24 @@ def test_update_user_email_exists(
     assert r.json()["detail"] == "User with this email already exists"
 
 
-def test_delete_user_me(client: TestClient, db: Session) -> None:
+def _wait_for_deletion(client: TestClient, headers: dict[str, str], job_id: str) -> dict:
+    for _ in range(100):
+        r = client.get(f"{settings.API_V1_STR}/deletions/{job_id}", headers=headers)
+        assert r.status_code == 200
+        job = r.json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"Deletion job {job_id} did not finish")
+
+
+def test_delete_user_me(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
     username = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=username, password=password)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
     user_id = user.id
 
     login_data = {
@@ -413,8 +438,13 @@ def test_delete_user_me(client: TestClient, db: Session) -> None:
     assert r.status_code == 200
     deleted_user = r.json()
     assert deleted_user["message"] == "User deleted successfully"
-    result = db.exec(select(Users).where(Users.id == user_id)).first()
-    assert result is None
+    # the user can no longer log in, the row goes in the background
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=headers)
+    assert r.status_code == 400
+    job = _wait_for_deletion(client, superuser_token_headers, deleted_user["job_id"])
+    assert job["status"] == "done"
+    assert job["kind"] == "user"
+    assert job["target_id"] == user_id
 
     user_query = select(Users).where(Users.id == user_id)
     user_db = db.execute(user_query).first()
@@ -439,7 +469,7 @@ def test_delete_user_super_user(
     username = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=username, password=password)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
     user_id = user.id
     r = client.delete(
         f"{settings.API_V1_STR}/users/{user_id}",
@@ -448,6 +478,8 @@ def test_delete_user_super_user(
     assert r.status_code == 200
     deleted_user = r.json()
     assert deleted_user["message"] == "User deleted successfully"
+    job = _wait_for_deletion(client, superuser_token_headers, deleted_user["job_id"])
+    assert job["status"] == "done"
     result = db.exec(select(Users).where(Users.id == user_id)).first()
     assert result is None
 
@@ -466,8 +498,7 @@ def test_delete_user_not_found(
 def test_delete_user_current_super_user_error(
     client: TestClient, superuser_token_headers: dict[str, str], db: Session
 ) -> None:
-    super_user = crud.get_user_by_email(
-        session=db, email=settings.FIRST_SUPERUSER)
+    super_user = run_crud(crud.get_user_by_email, email=settings.FIRST_SUPERUSER)
     assert super_user
     user_id = super_user.id
 
@@ -486,7 +517,7 @@ def test_delete_user_without_privileges(
     username = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=username, password=password)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
 
     r = client.delete(
         f"{settings.API_V1_STR}/users/{user.id}",
@@ -494,3 +525,45 @@ def test_delete_user_without_privileges(
     )
     assert r.status_code == 403
     assert r.json()["detail"] == "The user doesn't have enough privileges"
+
+
+def test_import_users(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    existing = random_email()
+    run_crud(crud.create_user, user_create=UserCreate(
+        email=existing, password=random_lower_string()))
+    new_email = random_email()
+    password = random_lower_string()
+    body = "\n".join([
+        "email,password,full_name",
+        f"{new_email},{password},Imported",
+        f"{existing},{random_lower_string()},",
+        f"{new_email},{random_lower_string()},",
+        "not-an-email,short,",
+    ])
+    r = client.post(
+        f"{settings.API_V1_STR}/users/import",
+        headers={**superuser_token_headers, "Content-Type": "text/csv"},
+        content=body,
+    )
+    assert r.status_code == 200
+    report = r.json()
+    assert report["created"] == 1
+    assert [issue["line"] for issue in report["issues"]] == [3, 4, 5]
+    assert report["issues"][0]["error"] == "email already exists"
+    user = run_crud(crud.get_user_by_email, email=new_email)
+    assert user
+    assert user.full_name == "Imported"
+    assert verify_password(password, user.hashed_password)
+
+
+def test_import_users_unsupported_format(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/users/import",
+        headers={**superuser_token_headers, "Content-Type": "application/xml"},
+        content="<users/>",
+    )
+    assert r.status_code == 415
@@ -0,0 +1,136 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.core import security
+from app.core.config import settings
+from app.core.hashing import PasswordHasher
+
+
+async def _admit(monkeypatch, queue_limit: int, client_limit: int) -> list:
+    monkeypatch.setattr(settings, 'PASSWORD_HASH_QUEUE_LIMIT', queue_limit)
+    monkeypatch.setattr(settings, 'PASSWORD_HASH_CLIENT_LIMIT', client_limit)
+    hasher = PasswordHasher(workers=1)
+    await hasher.start()
+    try:
+        return await asyncio.gather(
+            *(hasher.run(time.sleep, 0.3, client='10.0.0.1') for _ in range(3)),
+            return_exceptions=True,
+        )
+    finally:
+        await hasher.close()
+
+
+def test_hasher_verifies_in_worker() -> None:
+    async def run() -> tuple[bool, bool]:
+        hasher = PasswordHasher(workers=1)
+        await hasher.start()
+        security.use_hasher(hasher)
+        try:
+            hashed = await security.get_password_hash_async('secret')
+            return (
+                await security.verify_password_async('secret', hashed),
+                await security.verify_password_async('wrong', hashed),
+            )
+        finally:
+            security.use_hasher(None)
+            await hasher.close()
+
+    assert asyncio.run(run()) == (True, False)
+
+
+@pytest.mark.parametrize('queue_limit, client_limit, status_code', [
+    (0, 10, 503),
+    (10, 1, 429),
+])
+def test_hasher_refuses_past_limits(monkeypatch, queue_limit, client_limit, status_code) -> None:
+    results = asyncio.run(_admit(monkeypatch, queue_limit, client_limit))
+    assert results[0] is None
+    for refused in results[1:]:
+        assert isinstance(refused, HTTPException)
+        assert refused.status_code == status_code
+        assert 'Retry-After' in refused.headers
+
+
+def test_hasher_keeps_slot_of_timed_out_job(monkeypatch) -> None:
+    monkeypatch.setattr(settings, 'PASSWORD_HASH_QUEUE_LIMIT', 0)
+
+    async def run() -> list:
+        hasher = PasswordHasher(workers=1)
+        await hasher.start()
+        try:
+            results = await asyncio.gather(
+                hasher.run(time.sleep, 0.5, timeout=0.1), return_exceptions=True)
+            # the worker still sleeps, so the pool is still full
+            results += await asyncio.gather(
+                hasher.run(time.sleep, 0, timeout=0.1), return_exceptions=True)
+            await asyncio.sleep(0.6)
+            results.append(await hasher.run(time.sleep, 0))
+            return results
+        finally:
+            await hasher.close()
+
+    timed_out, refused, done = asyncio.run(run())
+    assert isinstance(timed_out, HTTPException) and timed_out.status_code == 503
+    assert isinstance(refused, HTTPException) and refused.status_code == 503
+    assert done is None
+
+
+def test_hasher_keeps_slot_of_cancelled_job() -> None:
+    async def run() -> tuple[int, int]:
+        hasher = PasswordHasher(workers=1)
+        await hasher.start()
+        try:
+            task = asyncio.ensure_future(hasher.run(time.sleep, 0.5))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            running = hasher.inflight
+            await asyncio.sleep(0.6)
+            return running, hasher.inflight
+        finally:
+            await hasher.close()
+
+    assert asyncio.run(run()) == (1, 0)
+
+
+class _RefusingHasher:
+    """Refuses the slice holding 'refused', the others run until cancelled."""
+
+    workers = 2
+
+    def __init__(self) -> None:
+        self.started: list[list[str]] = []
+        self.cancelled = 0
+
+    async def run(self, func, part: list[str], timeout=None) -> list[str]:
+        self.started.append(part)
+        if part == ['refused']:
+            await asyncio.sleep(0.05)
+            raise HTTPException(status_code=503)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return part
+
+
+def test_refused_slice_cancels_the_import(monkeypatch) -> None:
+    monkeypatch.setattr(settings, 'USER_IMPORT_HASH_BATCH', 1)
+    hasher = _RefusingHasher()
+    monkeypatch.setattr(security, '_hasher', hasher)
+
+    async def run() -> list[asyncio.Task]:
+        with pytest.raises(HTTPException):
+            await security.get_password_hashes_async(['a', 'refused', 'b', 'c'])
+        await asyncio.sleep(0.1)
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    # nothing is left running once the import stopped
+    assert asyncio.run(run()) == []
+    # the slice taking the refused one's turn may start, but nothing runs on
+    assert ['c'] not in hasher.started
+    assert hasher.cancelled == len(hasher.started) - 1
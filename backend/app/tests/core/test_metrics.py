@@ -0,0 +1,98 @@
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+
+from app.core.metrics import (
+    WS_MESSAGES_SENT,
+    WS_SEND_SECONDS,
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsFiles,
+    Registry,
+)
+from app.core.tracing import split_trace
+from app.core.ws_queue import OutboundQueue
+
+
+def test_histogram_buckets_are_cumulative() -> None:
+    histogram = Histogram('latency_seconds', 'test', ('route',), buckets=(0.1, 1))
+    child = histogram.labels('/a')
+    for value in (0.05, 0.1, 0.5, 3):
+        child.observe(value)
+    lines = histogram.render().splitlines()
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{route="/a"} 4' in lines
+    assert 'latency_seconds_sum{route="/a"} 3.65' in lines
+
+
+def test_registry_renders_counters_and_callback_gauges() -> None:
+    registry = Registry()
+    counter = registry.register(Counter('sent', 'test'))
+    registry.register(Gauge('depth', 'test', ('stat',), callback=lambda: {'max': 3}))
+    counter.inc(2)
+    text = registry.render()
+    assert '# TYPE sent counter\nsent_total 2.0' in text
+    assert 'depth{stat="max"} 3' in text
+
+
+def test_metrics_files_merge_workers(tmp_path: Path) -> None:
+    registry = Registry()
+    counter = registry.register(Counter('sent', 'test', ('kind',)))
+    counter.labels('a').inc(2)
+    # another worker, and one stopped long ago
+    (tmp_path / '1.json').write_text(json.dumps(
+        {'sent': ['# HELP sent test', '# TYPE sent counter', 'sent_total{kind="a",worker="1"} 5.0']}))
+    stale = tmp_path / '2.json'
+    stale.write_text(json.dumps({'sent': ['sent_total{worker="2"} 1.0']}))
+    os.utime(stale, (0, 0))
+
+    text = asyncio.run(MetricsFiles(registry, str(tmp_path), 5).render())
+    lines = text.splitlines()
+    assert lines.count('# TYPE sent counter') == 1
+    assert f'sent_total{{kind="a",worker="{os.getpid()}"}} 2.0' in lines
+    assert 'sent_total{kind="a",worker="1"} 5.0' in lines
+    assert 'worker="2"' not in text
+    assert not stale.exists()
+
+
+class _NullWebSocket:
+    async def send_text(self, data: str) -> None:
+        pass
+
+
+async def _send_loop(queue: OutboundQueue, websocket: _NullWebSocket, count: int,
+                     instrumented: bool) -> float:
+    # mirrors send_messages() in app.api.routes.ws_chats
+    start = time.perf_counter()
+    for _ in range(count):
+        message = await queue.get()
+        if instrumented:
+            message, _ = split_trace(message)
+            send_start = time.perf_counter()
+            await websocket.send_text(message)
+            WS_SEND_SECONDS.observe(time.perf_counter() - send_start)
+            WS_MESSAGES_SENT.inc()
+        else:
+            await websocket.send_text(message)
+    return time.perf_counter() - start
+
+
+def _timed_run(count: int, instrumented: bool) -> float:
+    queue = OutboundQueue(maxsize=count)
+    for i in range(count):
+        queue.put_nowait(f'{{"id": {i}}}')
+    return asyncio.run(_send_loop(queue, _NullWebSocket(), count, instrumented))
+
+
+def test_ws_send_recording_overhead() -> None:
+    count = 20_000
+    bare = min(_timed_run(count, False) for _ in range(5))
+    instrumented = min(_timed_run(count, True) for _ in range(5))
+    per_message = (instrumented - bare) / count
+    # a real send_text (ASGI message + socket write) costs tens of µs
+    assert per_message < 5e-6, f'{per_message * 1e6:.2f}µs per message'
@@ -0,0 +1,27 @@
+import json
+
+from app.core.streams import ReplayFilter, as_object, parse_stamp, stamp
+
+
+def test_stamp_round_trip() -> None:
+    frame = stamp('{"id": 1}', 'lc_chat_7', '1700000000000-3')
+    assert json.loads(frame) == {'stream_id': '1700000000000-3', 'stream': 'lc_chat_7', 'id': 1}
+    assert parse_stamp(frame) == ('lc_chat_7', '1700000000000-3')
+    assert parse_stamp('{"id": 1}') is None
+
+
+def test_notify_payload_is_decoded_once() -> None:
+    payload = json.dumps(json.dumps({'type': 'MSG_READ'}))
+    assert json.loads(as_object(payload)) == {'type': 'MSG_READ'}
+    assert as_object('{"id": 1}') == '{"id": 1}'
+
+
+def test_replay_filter_drops_replayed_frames() -> None:
+    replay_filter = ReplayFilter()
+    replay_filter.replayed('a', [stamp('{}', 'a', '5-0'), stamp('{}', 'a', '10-1')])
+    assert not replay_filter.allows(stamp('{}', 'a', '10-0'))
+    assert not replay_filter.allows(stamp('{}', 'a', '10-1'))
+    assert replay_filter.allows(stamp('{}', 'b', '1-0'))
+    assert replay_filter.allows(stamp('{}', 'a', '11-0'))
+    # forgotten after the first newer frame
+    assert replay_filter.allows(stamp('{}', 'a', '1-0'))
@@ -0,0 +1,52 @@
+import json
+import time
+
+from app.core.streams import stamp
+from app.core.tracing import MESSAGE_E2E_SECONDS, MessageTrace, record_delivery, split_trace
+
+
+def test_trace_round_trip() -> None:
+    payload = json.dumps({'id': 1, 'content': 'hi "_trace"'})
+    trace = MessageTrace()
+    trace.mark('parse')
+    trace.mark('persist')
+
+    traced = trace.attach(payload, 1)
+    assert json.loads(traced)['_trace']['id'] == 1
+    stripped, received = split_trace(traced)
+    assert stripped == payload
+    assert set(received['stages']) == {'parse', 'persist'}
+    assert received['published_at'] >= received['received_at']
+
+
+def test_trace_survives_stream_stamp() -> None:
+    traced = MessageTrace().attach(json.dumps({'id': 2}), 2)
+    stripped, trace = split_trace(stamp(traced, 'chan', '1-0'))
+    assert json.loads(stripped) == {'stream_id': '1-0', 'stream': 'chan', 'id': 2}
+    assert trace['id'] == 2
+
+
+def test_untraced_payload_passes_through() -> None:
+    assert split_trace('{"type": "PONG"}') == ('{"type": "PONG"}', None)
+
+
+def test_record_delivery_observes_e2e() -> None:
+    _, trace = split_trace(MessageTrace().attach('{"id": 3}', 3))
+    before = sum(MESSAGE_E2E_SECONDS.labels().counts)
+    now = time.time()
+    record_delivery(trace, enqueued_at=now, send_started_at=now, send_seconds=0.001)
+    assert sum(MESSAGE_E2E_SECONDS.labels().counts) == before + 1
+
+
+def test_record_delivery_dates_publish_by_stream_entry(caplog) -> None:
+    trace = MessageTrace()
+    trace.mark('persist')
+    _, received = split_trace(trace.attach('{"id": 4}', 4))
+    received['sampled'] = True
+    stored_ms = int(received['published_at'] * 1000) + 20
+    with caplog.at_level('INFO', logger='app.core.tracing'):
+        record_delivery(received, enqueued_at=stored_ms / 1000 + 0.005,
+                        send_started_at=stored_ms / 1000 + 0.005, send_seconds=0.001,
+                        stream_id=f'{stored_ms}-0')
+    timeline = caplog.records[-1].getMessage()
+    assert ' publish=' in timeline and ' fanout=5.00ms' in timeline
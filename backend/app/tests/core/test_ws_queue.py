@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+import pytest
+
+from app.core.ws_queue import OutboundQueue, SlowConsumerError, coalesce_key
+from app.utils import WsCloseCode
+
+
+def _read_notify(msg_id: int, who: int) -> str:
+    who_read = json.dumps({'id': who, 'email': f'{who}@example.com', 'full_name': None})
+    payload = json.dumps(
+        {'type': 'MSG_READ', 'meta_data': {'msg_id': msg_id, 'who_read': who_read}, 'content': ''})
+    return json.dumps(payload)
+
+
+def test_drop_oldest_keeps_newest() -> None:
+    queue = OutboundQueue(maxsize=2, policy='drop_oldest')
+    for i in range(5):
+        queue.put_nowait(str(i))
+    assert queue.qsize() == 2
+    assert queue.dropped == 3
+    assert asyncio.run(queue.get()) == '3'
+    assert asyncio.run(queue.get()) == '4'
+
+
+def test_coalesce_replaces_same_key() -> None:
+    queue = OutboundQueue(maxsize=2, policy='coalesce')
+    queue.put_nowait(_read_notify(1, 7))
+    queue.put_nowait('{"id": 10}')
+    queue.put_nowait(_read_notify(1, 7))
+    assert queue.qsize() == 2
+    assert queue.coalesced == 1
+    assert queue.dropped == 0
+    assert coalesce_key(asyncio.run(queue.get())) == 'MSG_READ:1:7'
+    # no matching key: falls back to dropping the oldest
+    queue.put_nowait('{"id": 11}')
+    queue.put_nowait('{"id": 12}')
+    assert queue.dropped == 1
+
+
+def test_coalesce_keys_keep_distinct_frames_apart() -> None:
+    # another reader of the same message
+    assert coalesce_key(_read_notify(1, 8)) != coalesce_key(_read_notify(1, 7))
+    # replies and notifications naming no object are never merged
+    assert coalesce_key(json.dumps({'type': 'PONG', 'meta_data': {}, 'content': ''})) is None
+    assert coalesce_key(json.dumps(
+        {'type': 'PRESENCE', 'meta_data': {'users': []}, 'content': ''})) is None
+    assert coalesce_key(json.dumps(
+        {'type': 'PRESENCE', 'meta_data': {'user_id': 3, 'online': True}, 'content': ''})) == 'PRESENCE:3'
+
+
+def test_disconnect_policy_raises() -> None:
+    queue = OutboundQueue(
+        maxsize=1, policy='disconnect', close_code=WsCloseCode.GOING_AWAY)
+    queue.put_nowait('a')
+    queue.put_nowait('b')
+    assert queue.overflowed
+    assert queue.stats()['depth'] == 0
+    with pytest.raises(SlowConsumerError) as exc:
+        asyncio.run(queue.get())
+    assert exc.value.close_code == WsCloseCode.GOING_AWAY
@@ -0,0 +1,39 @@
+import pytest
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.crud import groups as crud
+from app.crud.messages import get_unread_msg, insert_msg, set_read_msgs_by_user
+from app.tests.utils.user import create_random_user
+from app.tests.utils.utils import run_crud
+
+
+def _unread(user_id: int, chat_id: int) -> tuple[int, int]:
+    """The inbox's message_count - read_count, and the unread messages counted directly."""
+    inbox = run_crud(crud.get_user_inbox, user_id=user_id)
+    counted = next(unread for chat, unread, *_ in inbox if chat.id == chat_id)
+    return counted, len(run_crud(get_unread_msg, chat_id=chat_id, user_id=user_id))
+
+
+@pytest.mark.parametrize("mode", ["rows", "watermark"])
+def test_inbox_unread_counts(db: Session, monkeypatch, mode: str) -> None:
+    monkeypatch.setattr(settings, "READ_TRACKING_MODE", mode)
+    alice, bob, carol = (create_random_user(db) for _ in range(3))
+    chat = run_crud(crud.create_group, chat_name="inbox", is_group=True, owner_id=alice.id)
+    run_crud(crud.add_participant_to_group, user_ids=[alice.id, bob.id, carol.id], group_id=chat.id)
+
+    sent = [
+        run_crud(insert_msg, chat_id=chat.id, sender_id=sender.id, message=f"message {i}").id
+        for i, sender in enumerate([alice, alice, alice, bob, bob])
+    ]
+    assert _unread(alice.id, chat.id) == (2, 2)
+    assert _unread(bob.id, chat.id) == (3, 3)
+
+    run_crud(set_read_msgs_by_user, user_id=bob.id, chat_id=chat.id, msg_ids=sent[:2])
+    # reading the same messages again changes nothing
+    run_crud(set_read_msgs_by_user, user_id=bob.id, chat_id=chat.id, msg_ids=sent[:2])
+    run_crud(set_read_msgs_by_user, user_id=carol.id, chat_id=chat.id, msg_ids=sent)
+
+    assert _unread(alice.id, chat.id) == (2, 2)
+    assert _unread(bob.id, chat.id) == (1, 1)
+    assert _unread(carol.id, chat.id) == (0, 0)
@@ -0,0 +1,75 @@
+import csv
+import gzip
+import uuid
+from datetime import date, datetime
+from pathlib import Path
+
+import pytest
+
+from app.crud import partitions as crud
+
+
+def _write_export(path: str, rows: list[list]) -> None:
+    # the layout COPY ... (FORMAT csv) writes
+    with open(path, "w", newline="") as output:
+        csv.writer(output).writerows(rows)
+
+
+def test_partition_months() -> None:
+    assert crud.add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+    assert crud.add_months(date(2025, 1, 1), -1) == date(2024, 12, 1)
+    assert crud.partition_name("message_read", date(2025, 5, 1)) == "message_read_p2025_05"
+    assert crud.partition_month("message_read_p2025_05") == date(2025, 5, 1)
+
+
+def test_read_archived_month(tmp_path: Path) -> None:
+    month = date(2025, 1, 1)
+    directory = str(tmp_path)
+    created_at = datetime(2025, 1, 10, 12, 30, 1, 250)
+    export = str(tmp_path / "export.csv")
+    _write_export(export, [
+        [chat_id * 10 + i, chat_id, 7, uuid.uuid4(), f'chat {chat_id}, "quoted",\nline',
+         created_at, created_at]
+        for chat_id in (1, 2, 3) for i in range(2)
+    ])
+    messages = crud.split_by_chat(export, crud.archive_path(directory, "message", month), "message")
+    _write_export(export, [
+        [message_id, user_id, created_at, created_at, created_at, message_id // 10]
+        for message_id in (20, 21, 30) for user_id in (8, 9)
+    ])
+    reads = crud.split_by_chat(export, crud.archive_path(directory, "message_read", month), "message_read")
+    assert [count for _, _, count in messages.values()] == [2, 2, 2]
+    assert list(reads) == [2, 3]
+
+    # the members make up one gzip file
+    with gzip.open(crud.archive_path(directory, "message", month), "rt", newline="") as lines:
+        assert len(list(csv.reader(lines))) == 6
+
+    archived = crud.ArchivedMonth(month, 2, *messages[2][:2], *reads[2][:2])
+    rows = crud.read_archived_messages(directory, archived)
+    assert [msg["id"] for msg in rows] == [20, 21]
+    assert rows[0]["content"] == 'chat 2, "quoted",\nline'
+    assert rows[0]["created_at"] == created_at
+
+    assert crud.read_archived_readers(directory, archived, {21}) == {21: [8, 9]}
+    unread = crud.ArchivedMonth(month, 2, *messages[1][:2], 0, 0)
+    assert crud.read_archived_readers(directory, unread, {10}) == {}
+
+
+def test_archive_checked_and_missing(tmp_path: Path) -> None:
+    month = date(2025, 1, 1)
+    directory = str(tmp_path)
+    path = crud.archive_path(directory, "message", month)
+    export = str(tmp_path / "export.csv")
+    created_at = datetime(2025, 1, 10)
+    _write_export(export, [[1, 1, 7, uuid.uuid4(), "hi", created_at, created_at]])
+    members = crud.split_by_chat(export, path, "message")
+    crud.verify_export(path, members)
+
+    offset, length, count = members[1]
+    with pytest.raises(ValueError):
+        crud.verify_export(path, {1: (offset, length, count + 1)})
+
+    Path(path).unlink()
+    with pytest.raises(crud.ArchiveUnavailableError):
+        crud.read_archived_messages(directory, crud.ArchivedMonth(month, 1, offset, length, 0, 0))
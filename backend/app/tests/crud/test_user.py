@@ -4,14 +4,14 @@ from sqlmodel import Session
 from app.crud import users as crud
 from app.core.security import verify_password
 from app.models import Users, UserCreate, UserUpdate
-from app.tests.utils.utils import random_email, random_lower_string
+from app.tests.utils.utils import random_email, random_lower_string, run_crud
 
 
 def test_create_user(db: Session) -> None:
     email = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=email, password=password)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
     assert user.email == email
     assert hasattr(user, "hashed_password")
 
@@ -20,9 +20,8 @@ def test_authenticate_user(db: Session) -> None:
     email = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=email, password=password)
-    user = crud.create_user(session=db, user_create=user_in)
-    authenticated_user = crud.authenticate(
-        session=db, email=email, password=password)
+    user = run_crud(crud.create_user, user_create=user_in)
+    authenticated_user = run_crud(crud.authenticate, email=email, password=password)
     assert authenticated_user
     assert user.email == authenticated_user.email
 
@@ -30,7 +29,7 @@ def test_authenticate_user(db: Session) -> None:
 def test_not_authenticate_user(db: Session) -> None:
     email = random_email()
     password = random_lower_string()
-    user = crud.authenticate(session=db, email=email, password=password)
+    user = run_crud(crud.authenticate, email=email, password=password)
     assert user is None
 
 
@@ -38,7 +37,7 @@ def test_check_if_user_is_active(db: Session) -> None:
     email = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=email, password=password)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
     assert user.is_active is True
 
 
@@ -46,7 +45,7 @@ def test_check_if_user_is_active_inactive(db: Session) -> None:
     email = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=email, password=password, disabled=True)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
     assert user.is_active
 
 
@@ -54,7 +53,7 @@ def test_check_if_user_is_superuser(db: Session) -> None:
     email = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=email, password=password, is_superuser=True)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
     assert user.is_superuser is True
 
 
@@ -62,7 +61,7 @@ def test_check_if_user_is_superuser_normal_user(db: Session) -> None:
     username = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=username, password=password)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
     assert user.is_superuser is False
 
 
@@ -70,7 +69,7 @@ def test_get_user(db: Session) -> None:
     password = random_lower_string()
     username = random_email()
     user_in = UserCreate(email=username, password=password, is_superuser=True)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
     user_2 = db.get(Users, user.id)
     assert user_2
     assert user.email == user_2.email
@@ -81,11 +80,11 @@ def test_update_user(db: Session) -> None:
     password = random_lower_string()
     email = random_email()
     user_in = UserCreate(email=email, password=password, is_superuser=True)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
     new_password = random_lower_string()
     user_in_update = UserUpdate(password=new_password, is_superuser=True)
     if user.id is not None:
-        crud.update_user(session=db, db_user=user, user_in=user_in_update)
+        run_crud(crud.update_user, db_user=user, user_in=user_in_update)
     user_2 = db.get(Users, user.id)
     assert user_2
     assert user.email == user_2.email
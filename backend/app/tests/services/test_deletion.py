@@ -0,0 +1,89 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+import redis.asyncio as redis
+
+from app.core.config import settings
+from app.crud import deletion as crud
+from app.services import deletion as deletion_module
+from app.services.deletion import JOB_STREAM, DeletionJobs
+
+CHAT_ID = 987_654_321
+
+
+class _Session:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+
+class _HotPages:
+    async def invalidate(self, chat_id: int) -> None:
+        pass
+
+    async def archives_changed(self) -> None:
+        pass
+
+
+@pytest.fixture
+def chat_messages(monkeypatch):
+    """(created_at, id) of the chat's messages; the second batch fails once."""
+    start = datetime(2025, 1, 1)
+    state = {
+        'messages': [(start + timedelta(minutes=i), i) for i in range(1, 6)],
+        'batches': 0,
+        'chat_deleted': False,
+    }
+
+    async def delete_chat_messages_batch(*, async_session, chat_id, after, batch_size):
+        state['batches'] += 1
+        if state['batches'] == 2:
+            raise ConnectionError('connection lost')
+        batch = sorted(key for key in state['messages'] if key > after)[:batch_size]
+        if not batch:
+            return 0, None
+        state['messages'] = [key for key in state['messages'] if key not in batch]
+        return len(batch), batch[-1]
+
+    async def delete_chat_row(*, async_session, chat_id):
+        state['chat_deleted'] = True
+
+    monkeypatch.setattr(deletion_module, 'AsyncAutocommitSessionLocal', _Session)
+    monkeypatch.setattr(crud, 'delete_chat_messages_batch', delete_chat_messages_batch)
+    monkeypatch.setattr(crud, 'delete_chat_row', delete_chat_row)
+    monkeypatch.setattr(settings, 'DELETION_BATCH_SIZE', 2)
+    monkeypatch.setattr(settings, 'DELETION_BATCH_PAUSE', 0)
+    monkeypatch.setattr(settings, 'DELETION_CLAIM_IDLE', 0)
+    return state
+
+
+def test_failed_job_is_retried_and_finishes(chat_messages) -> None:
+    async def test() -> None:
+        client = redis.from_url(settings.get_redis_url)
+        await client.delete(JOB_STREAM)
+        try:
+            jobs = DeletionJobs(client, _HotPages())
+            await client.xgroup_create(JOB_STREAM, 'deletion', id='0', mkstream=True)
+            job_id = await jobs.enqueue('chat', CHAT_ID, requested_by=1)
+
+            await jobs._execute(*await jobs._read())
+            job = await jobs.progress(job_id)
+            assert (job['status'], job['attempts'], job['messages']) == ('retrying', '1', '2')
+            assert len(chat_messages['messages']) == 3
+            assert await jobs.active_job('chat', CHAT_ID) == job_id
+
+            # left pending, taken again once idle: picks up where it stopped
+            await jobs._execute(*await jobs._claim())
+            job = await jobs.progress(job_id)
+            assert (job['status'], job['attempts'], job['messages']) == ('done', '2', '5')
+            assert chat_messages['messages'] == []
+            assert chat_messages['chat_deleted']
+            assert await client.xlen(JOB_STREAM) == 0
+        finally:
+            await client.delete(JOB_STREAM)
+            await client.aclose()
+
+    asyncio.run(test())
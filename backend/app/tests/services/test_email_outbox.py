@@ -0,0 +1,82 @@
+import asyncio
+import socket
+
+import pytest
+import redis.asyncio as redis
+from aiosmtpd.controller import Controller
+
+from app.core.config import settings
+from app.services.email_outbox import DEAD_STREAM, EmailOutbox
+
+
+def _free_port() -> int:
+    # Controller checks the server by connecting to its port, so it can't
+    # be given port 0 itself
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+class _Recorder:
+    """aiosmtpd handler keeping what it was sent and from which connection."""
+
+    def __init__(self) -> None:
+        self.messages: list[tuple[list[str], str]] = []
+        self.peers: set = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("bounce"):
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.rcpt_tos, envelope.content.decode()))
+        self.peers.add(session.peer)
+        return "250 Message accepted"
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    recorder = _Recorder()
+    port = _free_port()
+    controller = Controller(recorder, hostname="127.0.0.1", port=port)
+    controller.start()
+    monkeypatch.setattr(settings, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(settings, "SMTP_PORT", port)
+    monkeypatch.setattr(settings, "SMTP_TLS", False)
+    monkeypatch.setattr(settings, "SMTP_SSL", False)
+    monkeypatch.setattr(settings, "SMTP_USER", None)
+    monkeypatch.setattr(settings, "EMAILS_FROM_EMAIL", "info@example.com")
+    yield recorder
+    controller.stop()
+
+
+async def _send_through_outbox(recipients: list[str], expected: int, recorder: _Recorder) -> int:
+    client = redis.from_url(settings.get_redis_url)
+    outbox = EmailOutbox(client)
+    dead_before = await client.xlen(DEAD_STREAM)
+    for email_to in recipients:
+        await outbox.enqueue(email_to=email_to, subject="Hello", html_content="<p>hi</p>")
+    await outbox.start()
+    try:
+        for _ in range(100):
+            if len(recorder.messages) >= expected and await client.xlen(DEAD_STREAM) > dead_before:
+                break
+            await asyncio.sleep(0.05)
+    finally:
+        await outbox.close()
+        dead = await client.xlen(DEAD_STREAM) - dead_before
+        await client.close()
+    return dead
+
+
+def test_outbox_sends_batch_over_one_connection(smtp_server: _Recorder) -> None:
+    recipients = [f"user{i}@example.com" for i in range(5)] + ["bounce@example.com"]
+    dead = asyncio.run(_send_through_outbox(recipients, 5, smtp_server))
+
+    assert sorted(rcpt[0] for rcpt, _ in smtp_server.messages) == recipients[:5]
+    assert len(smtp_server.peers) == 1
+    assert "Subject: Hello" in smtp_server.messages[0][1]
+    # a 5xx reply is not retried
+    assert dead == 1
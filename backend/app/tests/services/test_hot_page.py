@@ -0,0 +1,83 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+import redis.asyncio as redis
+
+from app.core.config import settings
+from app.dto.chatmsg import MessagePublic
+from app.dto.users import UserShort
+from app.services import hot_page as hot_page_module
+from app.services.hot_page import HotPageCache
+
+CHAT_ID = 987_654_321
+
+
+def _message(message_id: int) -> dict:
+    created_at = datetime(2025, 1, 1) + timedelta(seconds=message_id)
+    return MessagePublic(
+        id=message_id, chat_id=CHAT_ID, sender_id=1, content=f'message {message_id}',
+        sender=UserShort(id=1, email='sender@example.com', full_name=None),
+        created_at=created_at, updated_at=created_at,
+    ).model_dump(mode='json')
+
+
+@pytest.fixture
+def postgres_messages(monkeypatch):
+    """Messages get_msg_page answers with, oldest first, and the number of queries."""
+    state = {'messages': [_message(1), _message(2)], 'queries': 0}
+
+    async def get_msg_page(*, async_session, chat_id, limit):
+        state['queries'] += 1
+        return [MessagePublic.model_validate(msg) for msg in state['messages'][-limit:]], None
+
+    monkeypatch.setattr(hot_page_module, 'get_msg_page', get_msg_page)
+    monkeypatch.setattr(settings, 'CHAT_HOT_PAGE_SIZE', 3)
+    return state
+
+
+async def _with_cache(test) -> None:
+    client = redis.from_url(settings.get_redis_url)
+    cache = HotPageCache(client)
+    await cache.invalidate(CHAT_ID)
+    try:
+        await test(cache)
+    finally:
+        await cache.invalidate(CHAT_ID)
+        await client.aclose()
+
+
+def test_push_needs_a_warm_page(postgres_messages) -> None:
+    async def test(cache):
+        postgres_messages['messages'].append(_message(3))
+        # nothing cached yet: a push doesn't start a partial buffer
+        await cache.push(_message(3))
+        assert await cache.latest(CHAT_ID, 3, async_session=None) == postgres_messages['messages']
+
+        await cache.push(_message(4))
+        assert [msg['id'] for msg in await cache.latest(CHAT_ID, 3, async_session=None)] == [2, 3, 4]
+        assert postgres_messages['queries'] == 1
+
+    asyncio.run(_with_cache(test))
+
+
+def test_push_after_warm_is_not_duplicated(postgres_messages) -> None:
+    async def test(cache):
+        # committed, then a warm loads it before its own push runs
+        postgres_messages['messages'].append(_message(3))
+        await cache.latest(CHAT_ID, 3, async_session=None)
+        await cache.push(_message(3))
+        assert [msg['id'] for msg in await cache.latest(CHAT_ID, 3, async_session=None)] == [1, 2, 3]
+
+    asyncio.run(_with_cache(test))
+
+
+def test_invalidate_reloads(postgres_messages) -> None:
+    async def test(cache):
+        assert await cache.from_start(CHAT_ID, None, None, async_session=None) == postgres_messages['messages']
+        postgres_messages['messages'] = [_message(5)]
+        await cache.invalidate(CHAT_ID)
+        assert await cache.from_start(CHAT_ID, None, None, async_session=None) == [_message(5)]
+        assert postgres_messages['queries'] == 2
+
+    asyncio.run(_with_cache(test))
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+import redis.asyncio as redis
+
+from app.core.config import settings
+from app.services import membership as membership_module
+from app.services.membership import ChatMembershipCache, forget_chat_members
+
+CHAT_ID = 987_654_321
+
+
+class _Hub:
+    async def subscribe(self, sink, *channels) -> None:
+        pass
+
+    async def unsubscribe(self, sink, *channels) -> None:
+        pass
+
+
+@pytest.fixture
+def postgres_members(monkeypatch):
+    """Member ids get_chat_member_ids answers with, and the number of queries."""
+    state = {'members': [1, 2], 'queries': 0, 'during_query': None}
+
+    async def get_chat_member_ids(*, async_session, chat_id):
+        state['queries'] += 1
+        members = list(state['members'])
+        if state['during_query']:
+            await state.pop('during_query')()
+        return members
+
+    monkeypatch.setattr(membership_module, 'get_chat_member_ids', get_chat_member_ids)
+    return state
+
+
+async def _with_cache(test) -> None:
+    client = redis.from_url(settings.get_redis_url)
+    await forget_chat_members(client, [CHAT_ID])
+    try:
+        await test(client, ChatMembershipCache(client, _Hub()))
+    finally:
+        await forget_chat_members(client, [CHAT_ID])
+        await client.aclose()
+
+
+def test_miss_fills_redis_and_hit_skips_postgres(postgres_members) -> None:
+    async def test(client, cache):
+        assert await cache.is_member(CHAT_ID, 1, async_session=None)
+        assert await client.sismember(f'chat_members:{CHAT_ID}', 2)
+        # another worker: served from Redis
+        other = ChatMembershipCache(client, _Hub())
+        assert await other.members(CHAT_ID, async_session=None) == {1, 2}
+        assert postgres_members['queries'] == 1
+
+    asyncio.run(_with_cache(test))
+
+
+def test_set_members_invalidates(postgres_members) -> None:
+    async def test(client, cache):
+        await cache.members(CHAT_ID, async_session=None)
+        await cache.set_members(CHAT_ID, [2, 3])
+        assert not await cache.is_member(CHAT_ID, 1, async_session=None)
+        assert await cache.is_member(CHAT_ID, 3, async_session=None)
+
+        await cache.forget_members([CHAT_ID])
+        postgres_members['members'] = [4]
+        assert await cache.members(CHAT_ID, async_session=None) == {4}
+
+    asyncio.run(_with_cache(test))
+
+
+def test_fill_from_stale_read_is_discarded(postgres_members) -> None:
+    async def test(client, cache):
+        writer = ChatMembershipCache(client, _Hub())
+        # user 1 is removed while the reader's Postgres snapshot still has it
+        postgres_members['during_query'] = lambda: writer.set_members(CHAT_ID, [2])
+        assert await cache.members(CHAT_ID, async_session=None) == {1, 2}
+        assert not await cache.is_member(CHAT_ID, 1, async_session=None)
+        assert await ChatMembershipCache(client, _Hub()).members(
+            CHAT_ID, async_session=None) == {2}
+
+    asyncio.run(_with_cache(test))
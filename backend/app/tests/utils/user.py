@@ -4,7 +4,7 @@ from sqlmodel import Session
 from app.crud import users as crud
 from app.core.config import settings
 from app.models import Users, UserCreate, UserUpdate
-from app.tests.utils.utils import random_email, random_lower_string
+from app.tests.utils.utils import random_email, random_lower_string, run_crud
 
 
 def user_authentication_headers(
@@ -23,7 +23,7 @@ def create_random_user(db: Session) -> Users:
     email = random_email()
     password = random_lower_string()
     user_in = UserCreate(email=email, password=password)
-    user = crud.create_user(session=db, user_create=user_in)
+    user = run_crud(crud.create_user, user_create=user_in)
     return user
 
 
@@ -36,15 +36,14 @@ def authentication_token_from_email(
     If the user doesn't exist it is created first.
     """
     password = random_lower_string()
-    user = crud.get_user_by_email(session=db, email=email)
+    user = run_crud(crud.get_user_by_email, email=email)
     if not user:
         user_in_create = UserCreate(email=email, password=password)
-        user = crud.create_user(session=db, user_create=user_in_create)
+        user = run_crud(crud.create_user, user_create=user_in_create)
     else:
         user_in_update = UserUpdate(password=password)
         if not user.id:
             raise Exception("User id not set")
-        user = crud.update_user(
-            session=db, db_user=user, user_in=user_in_update)
+        user = run_crud(crud.update_user, db_user=user, user_in=user_in_update)
 
     return user_authentication_headers(client=client, email=email, password=password)
@@ -1,10 +1,31 @@
+import asyncio
 import random
 import string
+from typing import Any, Awaitable, Callable
 
 from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
 from app.core.config import settings
 
+# Connections of the app's async_engine belong to the TestClient event loop,
+# crud calls from sync tests get their own unpooled ones.
+_test_async_engine = create_async_engine(
+    str(settings.SQLALCHEMY_ASYNC_DATABASE_URI), poolclass=NullPool)
+_TestAsyncSessionLocal = sessionmaker(
+    bind=_test_async_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def run_crud(func: Callable[..., Awaitable[Any]], **kwargs: Any) -> Any:
+    """Run an async crud function from a sync test, in a session of its own."""
+    async def call() -> Any:
+        async with _TestAsyncSessionLocal() as async_session:
+            return await func(async_session=async_session, **kwargs)
+
+    return asyncio.run(call())
+
 
 def random_lower_string() -> str:
     return "".join(random.choices(string.ascii_lowercase, k=32))
@@ -1,7 +1,10 @@
 import asyncio
+import base64
+import binascii
 import logging
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
 from typing import Any
 
@@ -23,11 +26,17 @@ class EmailData:
     subject: str
 
 
-def render_email_template(*, template_name: str, context: dict[str, Any]) -> str:
+@lru_cache
+def _email_template(template_name: str) -> Template:
+    # built templates only change with a deploy, compile each one once
     template_str = (
         Path(__file__).parent / "email-templates" / "build" / template_name
     ).read_text()
-    html_content = Template(template_str).render(context)
+    return Template(template_str)
+
+
+def render_email_template(*, template_name: str, context: dict[str, Any]) -> str:
+    html_content = _email_template(template_name).render(context)
     return html_content
 
 
@@ -124,6 +133,21 @@ def verify_password_reset_token(token: str) -> str | None:
         return None
 
 
+def encode_history_cursor(created_at: datetime, msg_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{msg_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_history_cursor(cursor: str) -> tuple[datetime, int]:
+    """Raises ValueError for anything encode_history_cursor did not produce."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, msg_id = raw.split("|")
+        return datetime.fromisoformat(created_at), int(msg_id)
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
 async def async_task_graceful_shutdown(task: asyncio.Task):
     task.cancel()
     try:
@@ -0,0 +1,108 @@
+"""
+/msg/history page latency at increasing depth: OFFSET vs keyset cursor.
+
+Fills one synthetic chat with generate_series() (millions of rows take a
+few minutes) and fetches a page at each depth both ways:
+
+    python -m benchmarks.history_pagination --messages 2000000
+
+Everything created here is removed at the end.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+from sqlalchemy import delete, select, text
+
+from app.core.db import AsyncSessionLocal
+from app.crud.messages import get_msg_for_chat, get_msg_page
+from app.models import Chats, Message, UserChatParticipant, Users
+
+from benchmarks.ws_delivery import percentile
+
+
+async def populate(session, messages: int) -> tuple[Chats, Users]:
+    tag = uuid.uuid4().hex[:8]
+    user = Users(email=f'bench_{tag}@example.com', hashed_password='-')
+    session.add(user)
+    await session.flush()
+    chat = Chats(name=f'bench_{tag}', is_group=True, owner_id=user.id)
+    session.add(chat)
+    await session.flush()
+    session.add(UserChatParticipant(chat_id=chat.id, user_id=user.id))
+    # one second apart so created_at ordering matches id ordering
+    await session.execute(text("""
+        INSERT INTO message (chat_id, sender_id, content, message_uuid, created_at, updated_at)
+        SELECT :chat_id, :user_id, 'message ' || i, gen_random_uuid(),
+               now() - make_interval(secs => :messages - i), now()
+        FROM generate_series(1, :messages) AS i
+    """), {'chat_id': chat.id, 'user_id': user.id, 'messages': messages})
+    await session.commit()
+    await session.execute(text('ANALYZE message'))
+    return chat, user
+
+
+async def offset_page(chat: Chats, depth: int, limit: int) -> float:
+    async with AsyncSessionLocal() as session:
+        started = time.perf_counter()
+        await get_msg_for_chat(
+            async_session=session, chat_id=chat.id, limit=limit, offset=depth)
+        return time.perf_counter() - started
+
+
+async def cursor_page(chat: Chats, depth: int, limit: int) -> float:
+    async with AsyncSessionLocal() as session:
+        # the cursor a client would hold after paging down to this depth
+        key = (await session.execute(
+            select(Message.created_at, Message.id)
+            .where(Message.chat_id == chat.id)
+            .order_by(Message.created_at.desc(), Message.id.desc())
+            .offset(depth)
+            .limit(1)
+        )).one()
+        started = time.perf_counter()
+        await get_msg_page(
+            async_session=session, chat_id=chat.id, limit=limit, before=tuple(key))
+        return time.perf_counter() - started
+
+
+async def cleanup(session, chat: Chats, user: Users) -> None:
+    await session.execute(delete(Message).where(Message.chat_id == chat.id))
+    await session.execute(delete(UserChatParticipant).where(UserChatParticipant.chat_id == chat.id))
+    await session.execute(delete(Chats).where(Chats.id == chat.id))
+    await session.execute(delete(Users).where(Users.id == user.id))
+    await session.commit()
+
+
+async def main(args: argparse.Namespace) -> None:
+    async with AsyncSessionLocal() as session:
+        chat, user = await populate(session, args.messages)
+        try:
+            print(f'{"depth":>10} {"offset p50":>11} {"offset p99":>11} '
+                  f'{"cursor p50":>11} {"cursor p99":>11}')
+            depth = 100
+            while depth < args.messages:
+                offset_timings = [
+                    await offset_page(chat, depth, args.limit) for _ in range(args.repeat)]
+                cursor_timings = [
+                    await cursor_page(chat, depth, args.limit) for _ in range(args.repeat)]
+                print(
+                    f'{depth:>10} '
+                    f'{statistics.median(offset_timings) * 1000:>11.2f} '
+                    f'{percentile(offset_timings, 99) * 1000:>11.2f} '
+                    f'{statistics.median(cursor_timings) * 1000:>11.2f} '
+                    f'{percentile(cursor_timings, 99) * 1000:>11.2f}'
+                )
+                depth *= 10
+        finally:
+            await cleanup(session, chat, user)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,77 @@
+"""
+Login throughput (bcrypt verify per second) of PasswordHasher by number of
+worker processes, against the threadpool the routes used before:
+
+    python -m benchmarks.login_throughput --seconds 5 --max-workers 8
+
+Every step keeps 2 jobs per worker in flight, the way a login spike keeps
+the pool saturated, so req/s is the ceiling of one API process.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core import security
+from app.core.config import settings
+from app.core.hashing import PasswordHasher
+
+from benchmarks.ws_delivery import percentile
+
+PASSWORD = 'correct horse battery staple'
+
+
+async def closed_loop(call, concurrency: int, seconds: float) -> list[float]:
+    timings = []
+    deadline = time.perf_counter() + seconds
+
+    async def client() -> None:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await call()
+            timings.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return timings
+
+
+def report(label: str, timings: list[float], seconds: float) -> None:
+    print(
+        f'{label:<12} {len(timings) / seconds:>8.1f} '
+        f'{statistics.median(timings) * 1000:>8.1f} '
+        f'{percentile(timings, 99) * 1000:>8.1f}'
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    hashed = security.get_password_hash(PASSWORD)
+    # measure throughput, not admission control
+    settings.PASSWORD_HASH_QUEUE_LIMIT = 2 * args.max_workers
+    settings.PASSWORD_HASH_TIMEOUT = 60
+
+    print(f'{"pool":<12} {"req/s":>8} {"p50 ms":>8} {"p99 ms":>8}')
+    timings = await closed_loop(
+        lambda: run_in_threadpool(security.verify_password, PASSWORD, hashed),
+        2 * args.max_workers, args.seconds)
+    report('threadpool', timings, args.seconds)
+
+    for workers in range(1, args.max_workers + 1):
+        hasher = PasswordHasher(workers)
+        await hasher.start()
+        try:
+            timings = await closed_loop(
+                lambda: hasher.run(security.verify_password, PASSWORD, hashed),
+                2 * workers, args.seconds)
+        finally:
+            await hasher.close()
+        report(f'{workers} proc', timings, args.seconds)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,134 @@
+"""
+Messages/sec a single worker can persist and serialize for /ws/chat.
+
+Compares the legacy path (get_msg_by_uuid, the chat lookup and ORM insert
+create_group_msg did before insert_msg existed, commit + refresh,
+get_msg_by_id with eager loads) against the single-statement insert_msg
+fast path on an autocommit session.
+Needs the database from init_db (any group chat with participants):
+
+    python -m benchmarks.msg_persist --messages 5000 --concurrency 20
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import delete
+from sqlmodel import select
+
+from app.core.db import AsyncAutocommitSessionLocal, AsyncSessionLocal
+from app.crud.groups import get_chat_from_uuid
+from app.crud.messages import (
+    get_msg_by_id,
+    get_msg_by_uuid,
+    insert_msg,
+)
+from app.dto.chatmsg import MessagePublic
+from app.dto.users import UserShort
+from app.models import Chats, Message, UserChatParticipant, Users
+
+
+async def legacy_create_group_msg(*, async_session, chat_uuid, sender_id: int, message: str) -> Message:
+    """create_group_msg as it was, kept here as the baseline."""
+    chat_id = await get_chat_from_uuid(
+        async_session=async_session,
+        chat_uuid=chat_uuid,
+        only_id=True,
+    )
+    db_obj = Message(
+        chat_id=chat_id,
+        sender_id=sender_id,
+        content=message,
+    )
+    async_session.add(db_obj)
+    await async_session.commit()
+    await async_session.refresh(db_obj)
+    return db_obj
+
+
+def group_chat_id_statement(*, chat_uuid: str, sender_id: int):
+    """The group chat's id, looked up inside insert_msg's statement."""
+    return (
+        select(Chats.id)
+        .join(UserChatParticipant)
+        .where(
+            Chats.chat_id == str(chat_uuid),
+            Chats.is_group == True,
+            UserChatParticipant.user_id == sender_id,
+        )
+    )
+
+
+async def legacy_send(session, chat: Chats, user: Users, msg_uuid: uuid.UUID) -> dict:
+    if await get_msg_by_uuid(async_session=session, msg_uuid=msg_uuid):
+        raise RuntimeError('duplicate')
+    msg = await legacy_create_group_msg(
+        async_session=session,
+        chat_uuid=chat.chat_id,
+        sender_id=user.id,
+        message='benchmark',
+    )
+    msg = await get_msg_by_id(async_session=session, msg_id=msg.id)
+    return MessagePublic.model_validate(msg).model_dump()
+
+
+async def fast_send(session, chat: Chats, user: Users, msg_uuid: uuid.UUID) -> dict:
+    row = await insert_msg(
+        async_session=session,
+        chat_id=group_chat_id_statement(chat_uuid=chat.chat_id, sender_id=user.id),
+        sender_id=user.id,
+        message='benchmark',
+        message_uuid=msg_uuid,
+    )
+    return MessagePublic(
+        id=row.id,
+        chat_id=row.chat_id,
+        sender_id=user.id,
+        content='benchmark',
+        sender=UserShort.model_validate(user),
+        created_at=row.created_at,
+        updated_at=row.updated_at,
+    ).model_dump()
+
+
+async def run(name, send, session_factory, chat, user, messages, concurrency):
+    uuids = [uuid.uuid4() for _ in range(messages)]
+    per_socket = [uuids[i::concurrency] for i in range(concurrency)]
+
+    async def socket(batch):
+        # one long-lived session per socket, as in ws_chat
+        async with session_factory() as session:
+            for msg_uuid in batch:
+                await send(session, chat, user, msg_uuid)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(socket(batch) for batch in per_socket))
+    elapsed = time.perf_counter() - started
+    print(f'{name:<8} {messages / elapsed:>10.1f} msg/s  ({elapsed:.2f}s)')
+
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(Message).where(Message.message_uuid.in_(uuids)))
+        await session.commit()
+
+
+async def main(args: argparse.Namespace) -> None:
+    async with AsyncSessionLocal() as session:
+        chat, user = (await session.execute(
+            select(Chats, Users)
+            .join(UserChatParticipant, UserChatParticipant.chat_id == Chats.id)
+            .join(Users, Users.id == UserChatParticipant.user_id)
+            .where(Chats.is_group == True)
+        )).first()
+
+    await run('legacy', legacy_send, AsyncSessionLocal, chat, user,
+              args.messages, args.concurrency)
+    await run('fast', fast_send, AsyncAutocommitSessionLocal, chat, user,
+              args.messages, args.concurrency)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,144 @@
+"""
+Storage and /msg/history latency of the two READ_TRACKING_MODE models on a
+synthetic group chat where every member has read every message:
+
+    python -m benchmarks.read_tracking --members 50 --messages 20000
+
+Everything created here is removed at the end.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, select, text
+
+from app.core.config import settings
+from app.core.db import AsyncSessionLocal
+from app.crud.messages import get_msg_for_chat
+from app.models import Chats, Message, MessageRead, UserChatParticipant, Users
+
+from benchmarks.ws_delivery import percentile
+
+
+async def relation_size(session, name: str) -> int:
+    return (await session.execute(
+        text('SELECT pg_total_relation_size(:name)'), {'name': name})).scalar()
+
+
+async def populate(session, members: int, messages: int) -> tuple[Chats, list[int]]:
+    now = datetime.now()
+    tag = uuid.uuid4().hex[:8]
+    user_ids = (await session.execute(
+        insert(Users).returning(Users.id),
+        [
+            {
+                'email': f'bench_{tag}_{i}@example.com',
+                'hashed_password': '-',
+                'is_active': True,
+                'is_superuser': False,
+                'created_at': now,
+                'updated_at': now,
+            }
+            for i in range(members)
+        ],
+    )).scalars().all()
+    chat = Chats(name=f'bench_{tag}', is_group=True, owner_id=user_ids[0])
+    session.add(chat)
+    await session.flush()
+    await session.execute(insert(UserChatParticipant), [
+        {'chat_id': chat.id, 'user_id': user_id, 'created_at': now, 'updated_at': now}
+        for user_id in user_ids
+    ])
+    for start in range(0, messages, 5000):
+        await session.execute(insert(Message), [
+            {
+                'chat_id': chat.id,
+                'sender_id': user_ids[i % members],
+                'content': f'message {i}',
+                'message_uuid': uuid.uuid4(),
+                'created_at': now,
+                'updated_at': now,
+            }
+            for i in range(start, min(messages, start + 5000))
+        ])
+    await session.commit()
+    return chat, user_ids
+
+
+async def fill_read_rows(session, chat: Chats) -> None:
+    await session.execute(text("""
+        INSERT INTO message_read (message_id, user_id, created_at, updated_at)
+        SELECT m.id, p.user_id, now(), now()
+        FROM message m
+        JOIN user_chat_participants p ON p.chat_id = m.chat_id
+        WHERE m.chat_id = :chat_id AND p.user_id <> m.sender_id
+    """), {'chat_id': chat.id})
+    await session.commit()
+
+
+async def fill_watermarks(session, chat: Chats) -> None:
+    await session.execute(text("""
+        UPDATE user_chat_participants
+        SET last_read_message_id = (SELECT max(id) FROM message WHERE chat_id = :chat_id)
+        WHERE chat_id = :chat_id
+    """), {'chat_id': chat.id})
+    await session.commit()
+
+
+async def history_latency(chat: Chats, pages: int, total: int) -> list[float]:
+    timings = []
+    for page in range(pages):
+        offset = (page * 100) % max(total - 100, 1)
+        async with AsyncSessionLocal() as session:
+            started = time.perf_counter()
+            await get_msg_for_chat(
+                async_session=session, chat_id=chat.id, limit=100, offset=offset)
+            timings.append(time.perf_counter() - started)
+    return timings
+
+
+async def cleanup(session, chat: Chats, user_ids: list[int]) -> None:
+    message_ids = select(Message.id).where(Message.chat_id == chat.id)
+    await session.execute(delete(MessageRead).where(MessageRead.message_id.in_(message_ids)))
+    await session.execute(delete(Message).where(Message.chat_id == chat.id))
+    await session.execute(delete(UserChatParticipant).where(UserChatParticipant.chat_id == chat.id))
+    await session.execute(delete(Chats).where(Chats.id == chat.id))
+    await session.execute(delete(Users).where(Users.id.in_(user_ids)))
+    await session.commit()
+
+
+async def main(args: argparse.Namespace) -> None:
+    async with AsyncSessionLocal() as session:
+        chat, user_ids = await populate(session, args.members, args.messages)
+        try:
+            before = await relation_size(session, 'message_read')
+            await fill_read_rows(session, chat)
+            rows_bytes = await relation_size(session, 'message_read') - before
+            await fill_watermarks(session, chat)
+            watermark_bytes = (await session.execute(
+                select(func.sum(func.pg_column_size(UserChatParticipant.last_read_message_id)))
+                .where(UserChatParticipant.chat_id == chat.id)
+            )).scalar()
+
+            print(f'{"mode":<10} {"storage":>14} {"p50 ms":>8} {"p99 ms":>8}')
+            for mode, size in (('rows', rows_bytes), ('watermark', watermark_bytes)):
+                settings.READ_TRACKING_MODE = mode
+                timings = await history_latency(chat, args.pages, args.messages)
+                print(
+                    f'{mode:<10} {size:>12} B '
+                    f'{statistics.median(timings) * 1000:>8.2f} '
+                    f'{percentile(timings, 99) * 1000:>8.2f}'
+                )
+        finally:
+            await cleanup(session, chat, user_ids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--members', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--pages', type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,107 @@
+"""
+Idle CPU and delivery latency of the pub/sub readers used by /ws/chat.
+
+Runs every reader mode against a live Redis:
+
+    python -m benchmarks.ws_delivery --redis-url redis://localhost:6379/0
+
+Idle: N sockets subscribed to their own channel, nothing published, the
+process CPU time spent over the window is reported.
+Latency: M subscribers on a shared channel, messages are published with a
+perf_counter() stamp and the publish -> on_message delay is recorded.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import redis.asyncio as redis
+
+from app.core.pubsub import READERS
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+async def _start_readers(client, mode, channels, on_message):
+    pubsubs, tasks = [], []
+    reader = READERS[mode]
+    for channel in channels:
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(channel)
+        pubsubs.append(pubsub)
+        tasks.append(asyncio.create_task(reader(pubsub, on_message)))
+    return pubsubs, tasks
+
+
+async def _stop_readers(pubsubs, tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for pubsub in pubsubs:
+        await pubsub.aclose()
+
+
+async def bench_idle(client, mode: str, sockets: int, seconds: float) -> float:
+    async def on_message(_channel: str, _data: str) -> None:
+        pass
+
+    channels = [f'bench_idle_{mode}_{i}' for i in range(sockets)]
+    pubsubs, tasks = await _start_readers(client, mode, channels, on_message)
+    # let the readers settle into their steady state
+    await asyncio.sleep(1)
+    cpu_start = time.process_time()
+    await asyncio.sleep(seconds)
+    cpu_used = time.process_time() - cpu_start
+    await _stop_readers(pubsubs, tasks)
+    return cpu_used / seconds * 100
+
+
+async def bench_latency(client, mode: str, sockets: int, messages: int, rate: float) -> list[float]:
+    latencies: list[float] = []
+    channel = f'bench_latency_{mode}'
+
+    async def on_message(_channel: str, data: str) -> None:
+        latencies.append(time.perf_counter() - json.loads(data)['ts'])
+
+    pubsubs, tasks = await _start_readers(client, mode, [channel] * sockets, on_message)
+    for _ in range(messages):
+        await client.publish(channel, json.dumps({'ts': time.perf_counter()}))
+        await asyncio.sleep(1 / rate)
+    await asyncio.sleep(1.5)
+    await _stop_readers(pubsubs, tasks)
+    return latencies
+
+
+async def main(args: argparse.Namespace) -> None:
+    client = redis.from_url(args.redis_url)
+    print(f'{"mode":<6} {"idle cpu %":>10} {"p50 ms":>8} {"p99 ms":>8} {"recv":>8}')
+    for mode in READERS:
+        idle_cpu = await bench_idle(client, mode, args.idle_sockets, args.idle_seconds)
+        latencies = await bench_latency(
+            client, mode, args.sockets, args.messages, args.rate)
+        print(
+            f'{mode:<6} {idle_cpu:>10.2f} '
+            f'{statistics.median(latencies) * 1000:>8.2f} '
+            f'{percentile(latencies, 99) * 1000:>8.2f} '
+            f'{len(latencies):>8}'
+        )
+    await client.aclose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--redis-url', default='redis://localhost:6379/0')
+    parser.add_argument('--idle-sockets', type=int, default=1000)
+    parser.add_argument('--idle-seconds', type=float, default=10)
+    parser.add_argument('--sockets', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=200,
+                        help='messages published per second')
+    asyncio.run(main(parser.parse_args()))
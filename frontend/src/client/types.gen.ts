@@ -255,7 +255,7 @@ export type NotifyMsgRead = {
   who_read: UserShort,
 }
 
-export type NotifyMsgType = 'MSG_READ' | 'CHAT_INVITED'; 
+export type NotifyMsgType = 'MSG_READ' | 'CHAT_INVITED' | 'RESYNC' | 'PRESENCE' | 'TYPING' | 'PONG'; 
 
 export type NotifyMsg = {
   type: NotifyMsgType,
@@ -1,8 +1,11 @@
 import React, { createContext, useContext, useEffect, useState, useRef } from 'react';
 import { v4 as uuidv4 } from 'uuid';
-import { ChatMsgResponse, NotifyMsg } from '../client';
+import { ChatMsgResponse, NotifyMsg, NotifyMsgType } from '../client';
 import { isLoggedIn } from '../hooks/useAuth';
 
+// Показываются пользователю, PRESENCE/TYPING/PONG пока не используются
+const SHOWN_NOTIFY_TYPES: NotifyMsgType[] = ['MSG_READ', 'CHAT_INVITED', 'RESYNC'];
+
 interface WebSocketContextType {
   socket: WebSocket | null;
   sendMessage: (message: string, type: string, receiverId: string | number) => void;
@@ -70,7 +73,9 @@ export const WebSocketProvider: React.FC<{ children: React.ReactNode }> = ({ chi
         return;
       }
       if ('type' in newMessage) {
-        setNotifications(prev => [...prev, newMessage as NotifyMsg]);
+        if (SHOWN_NOTIFY_TYPES.includes((newMessage as NotifyMsg).type)) {
+          setNotifications(prev => [...prev, newMessage as NotifyMsg]);
+        }
       } else {
         subscribersRef.current.forEach(callback => callback(newMessage as ChatMsgResponse));
       }